@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Batch AI enrichment of existing documents
+
+Backfills tags and references by packing several documents into one
+structured prompt with JSON output, instead of one tag call and one
+reference call per document. Documents the model does not answer for (or
+answers invalidly) fall back to a single tag call and the local citation
+parser. Every written document goes through ``server.on_document_write``
+like an edit in the API: a ``document.updated`` event in the outbox, so
+webhooks and running servers see the new tags and references, and the
+related-documents, entity and citation indexes.
+
+Examples:
+    python batch_enrich.py --missing-only
+    python batch_enrich.py --category supplement --batch-size 10 --concurrency 2
+    python batch_enrich.py --tag magnesium --fields tags --dry-run
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pymongo import UpdateOne
+
+sys.path.insert(0, str(Path(__file__).parent))
+import server  # noqa: E402
+import mongo  # noqa: E402
+import enrichment  # noqa: E402
+import events  # noqa: E402
+
+# Tags written by generate_tags_with_ai when the LLM call failed
+DEFAULT_TAGS = ["orthomoleculair", "kennis"]
+
+PROJECTION = {"_id": 0, "content": 1, "content_external": 1, "references": 1,
+              **{field: 1 for field in events.PAYLOAD_FIELDS}}
+
+
+def build_query(args) -> dict:
+    query = {"file_type": {"$ne": "blog_article"}}
+    if args.category:
+        query["category"] = args.category
+    if args.tag:
+        query["tags"] = {"$regex": f"^{re.escape(args.tag)}$", "$options": "i"}
+    if args.missing_only:
+        missing = []
+        if "tags" in args.fields:
+            missing += [{"tags": {"$size": 0}}, {"tags": {"$exists": False}}, {"tags": DEFAULT_TAGS}]
+        if "references" in args.fields:
+            missing += [{"references": {"$size": 0}}, {"references": {"$exists": False}}]
+        query["$or"] = missing
+    return query
+
+
+class Stats:
+    def __init__(self, total: int):
+        self.total = total
+        self.processed = 0
+        self.batch_calls = 0
+        self.fallback_docs = 0
+        self.single_calls = 0
+        self.started = time.perf_counter()
+
+    def report(self, final: bool = False):
+        elapsed = time.perf_counter() - self.started
+        rate = self.processed / elapsed if elapsed else 0.0
+        llm_calls = self.batch_calls + self.single_calls
+        print(
+            f"{'Done' if final else 'Progress'}: {self.processed}/{self.total} documents "
+            f"({rate:.2f} docs/s), {llm_calls} LLM calls "
+            f"({self.batch_calls} batched, {self.single_calls} single for {self.fallback_docs} fallbacks)",
+            flush=True,
+        )
+
+
+async def enrich_batch(docs: list, args, stats: Stats) -> list:
+    """Enrich one batch; returns (document, fields to set) per document"""
+    chat = server.LlmChat(
+        api_key=os.environ.get('EMERGENT_LLM_KEY'),
+        session_id=str(uuid.uuid4()),
+        system_message="Je bent een expert in het taggen van medische en orthomoleculaire documenten en het identificeren van wetenschappelijke referenties. Je antwoordt uitsluitend met geldige JSON."
+    ).with_model("anthropic", "claude-4-sonnet-20250514")
+
+    try:
+        response = await chat.send_message(server.UserMessage(text=enrichment.build_batch_prompt(docs)))
+        results = enrichment.parse_batch_response(response, [doc["id"] for doc in docs])
+    except Exception as e:
+        logging.error(f"Batch enrichment call failed: {str(e)}")
+        results = {}
+    stats.batch_calls += 1
+
+    updates = []
+    for doc in docs:
+        result = results.get(doc["id"])
+        if result is None:
+            # Parse failure or missing answer: one tag call, references from the local parser
+            stats.fallback_docs += 1
+            result = {}
+            if "tags" in args.fields:
+                result["tags"] = await server.generate_tags_with_ai(doc["title"], doc["content"])
+                stats.single_calls += 1
+            if "references" in args.fields:
+                result["references"] = await server.extract_references(doc["content"], allow_llm=False)
+
+        update = {field: result[field] for field in args.fields if field in result}
+        update["updated_at"] = datetime.now(timezone.utc).isoformat()
+        updates.append((doc, update))
+    return updates
+
+
+async def record_writes(updates: list):
+    """Propagate written documents like an API edit: outbox event, derived indexes, write version"""
+    for before, update in updates:
+        await server.on_document_write(before["id"], before=before, after={**before, **update})
+
+
+async def run(args):
+    server.client, server.pool_monitor = mongo.create_client()
+    db = server.db = server.client[os.environ['DB_NAME']]
+    query = build_query(args)
+    total = await db.documents.count_documents(query)
+    if args.limit:
+        total = min(total, args.limit)
+    stats = Stats(total)
+    print(f"Enriching {total} documents ({', '.join(args.fields)}) in batches of {args.batch_size}")
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    pending = set()
+
+    async def process(batch):
+        async with semaphore:
+            updates = await enrich_batch(batch, args, stats)
+            if updates and not args.dry_run:
+                await db.documents.bulk_write(
+                    [UpdateOne({"id": doc["id"]}, {"$set": update}) for doc, update in updates], ordered=False
+                )
+                await record_writes(updates)
+            stats.processed += len(batch)
+            stats.report()
+
+    cursor = db.documents.find(query, PROJECTION).sort("created_at", 1)
+    if args.limit:
+        cursor = cursor.limit(args.limit)
+
+    batch = []
+    batch_chars = 0
+    async for doc in cursor:
+        doc["content"] = doc.get("content") or ""
+        batch.append(doc)
+        batch_chars += min(len(doc["content"]), enrichment.BATCH_EXCERPT_CHARS)
+        if len(batch) >= args.batch_size or batch_chars >= args.max_batch_chars:
+            pending.add(asyncio.create_task(process(batch)))
+            batch, batch_chars = [], 0
+            # Bound memory: do not read further ahead than the running batches
+            if len(pending) >= args.concurrency * 2:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # Raise a failed batch here instead of dropping it
+                    task.result()
+    if batch:
+        pending.add(asyncio.create_task(process(batch)))
+    if pending:
+        await asyncio.gather(*pending)
+
+    stats.report(final=True)
+    single_call_baseline = stats.processed * len(args.fields)
+    print(f"LLM calls saved versus one call per document and field: "
+          f"{single_call_baseline - stats.batch_calls - stats.single_calls}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--category", help="only documents in this category")
+    parser.add_argument("--tag", help="only documents with this tag")
+    parser.add_argument("--missing-only", action="store_true", help="only documents without tags/references")
+    parser.add_argument("--fields", nargs="+", choices=["tags", "references"], default=["tags", "references"])
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-batch-chars", type=int, default=24000, help="prompt excerpt budget per batch")
+    parser.add_argument("--concurrency", type=int, default=2, help="batches in flight")
+    parser.add_argument("--dry-run", action="store_true", help="call the LLM but do not write results")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the Wellness Archive API
+
+Runs server.app in-process (httpx ASGI transport) against a local mongod or
+mongomock, replaces LlmChat and UserMessage with deterministic fakes (so the
+LLM package is not needed) and seeds a synthetic Dutch corpus. For every
+corpus size it measures throughput and p50/p95/p99 latency per scenario and
+writes the results as JSON, so runs from different commits can be compared
+with --compare.
+
+Examples:
+    python benchmark.py --sizes 1000 10000 --output bench-main.json
+    python benchmark.py --mongo mongomock --sizes 1000 --scenarios list search
+    python benchmark.py --compare bench-main.json bench-branch.json
+    python benchmark.py --mongo mongomock --scenarios chat --chat-session-messages 10000
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+ROOT_DIR = Path(__file__).parent
+
+CATEGORIES = ["artikel", "onderzoek", "supplement", "kruiden", "aantekening", "boek"]
+
+TOPICS = [
+    "magnesium", "vitamine D", "vitamine C", "zink", "ijzer", "omega-3", "probiotica",
+    "kurkuma", "darmgezondheid", "microbioom", "stress", "slaap", "migraine", "diabetes",
+    "cholesterol", "artritis", "schildklier", "cortisol", "vermoeidheid", "ontsteking",
+]
+
+SENTENCES = [
+    "Uit onderzoek blijkt dat {topic} een belangrijke rol speelt bij {other}.",
+    "Bij een tekort aan {topic} zien we vaak klachten zoals vermoeidheid en spierkrampen.",
+    "De aanbevolen dosering van {topic} ligt tussen de 200 en 400 mg per dag.",
+    "Patiënten met {other} hebben mogelijk baat bij suppletie met {topic}.",
+    "Voeding rijk aan {topic} omvat groenten, noten, zaden en vette vis.",
+    "Let op interacties tussen {topic} en medicatie, overleg altijd met de behandelaar.",
+    "Een orthomoleculaire benadering van {other} combineert voeding, suppletie en leefstijl.",
+    "In de kPNI wordt {topic} gezien als ondersteuning van de stressas en het immuunsysteem.",
+]
+
+QUERIES = ["magnesium", "vitamine D", "darm", "stress", "omega-3", "slaap", "zink", "migraine"]
+
+DEFAULT_SCENARIOS = [
+    "list", "list_revalidate", "search", "by_tag", "stats", "export", "ingest", "chat", "blog_create"
+]
+
+
+class FakeLlmChat:
+    """Deterministic stand-in for emergentintegrations' LlmChat"""
+
+    latency = 0.0
+
+    def __init__(self, api_key=None, session_id=None, system_message=""):
+        self.session_id = session_id
+        self.system_message = system_message or ""
+
+    def with_model(self, provider, model):
+        return self
+
+    async def send_message(self, user_message):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        text = getattr(user_message, "text", str(user_message))
+        if "Taalcode" in text:
+            return "nl"
+        if "Genereer relevante tags" in text:
+            return "magnesium, vitamine D, darmgezondheid, stress"
+        if "referenties" in text:
+            return "GEEN"
+        return "Dit is een deterministisch antwoord voor benchmarkdoeleinden over orthomoleculaire zorg."
+
+
+class FakeUserMessage:
+    """Stand-in for emergentintegrations' UserMessage"""
+
+    def __init__(self, text: str = "", **kwargs):
+        self.text = text
+
+
+def make_document(rng: random.Random, index: int, now: datetime) -> dict:
+    """Build one synthetic Dutch document in the shape the API stores"""
+    topic, other = rng.sample(TOPICS, 2)
+    # Mostly articles and notes, with a tail of textbook-sized bodies
+    paragraph_count = rng.choices([2, 4, 8, 30, 150], weights=[30, 30, 20, 15, 5])[0]
+    paragraphs = []
+    for _ in range(paragraph_count):
+        sentences = [rng.choice(SENTENCES).format(topic=topic, other=other) for _ in range(rng.randint(3, 6))]
+        paragraphs.append(" ".join(sentences))
+    content = "\n\n".join(paragraphs)
+    created_at = (now - timedelta(minutes=index)).isoformat()
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "title": f"{topic.capitalize()} en {other} ({index})",
+        "category": rng.choice(CATEGORIES),
+        "file_type": "text",
+        "content": content,
+        "content_preview": None,
+        "is_large_document": len(content) > 2000,
+        "one_liner": f"Praktische inzichten over {topic} bij {other}.",
+        "consumer_blog_title": None,
+        "tags": sorted({topic, other, rng.choice(TOPICS)}),
+        "references": [],
+        "created_at": created_at,
+        "updated_at": None,
+        "file_size": len(content),
+        "original_filename": None,
+        "has_original_file": False,
+        "original_language": None,
+        "was_translated": False,
+    }
+
+
+async def seed_corpus(db, size: int, seed: int, batch_size: int = 1000) -> list:
+    """Insert a synthetic corpus of `size` documents and return their ids"""
+    import bodies
+    import cache
+
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    await db.documents.delete_many({})
+    await db[bodies.BODIES_COLLECTION].delete_many({})
+    await db.categories.delete_many({})
+    await db.chat_messages.delete_many({})
+    await db.chat_buckets.delete_many({})
+    await db.categories.insert_many([
+        {"id": str(uuid.uuid4()), "name": name, "description": None, "created_at": now.isoformat()}
+        for name in CATEGORIES
+    ])
+
+    # Reads cached for the previous corpus size must not be served for this one
+    for read_cache in (cache.document_cache, cache.category_cache, cache.tag_cache,
+                       cache.search_cache, cache.context_cache):
+        read_cache.clear()
+    await cache.bump_write_version(db)
+
+    ids = []
+    for start in range(0, size, batch_size):
+        batch = [make_document(rng, i, now) for i in range(start, min(size, start + batch_size))]
+        ids.extend(doc["id"] for doc in batch)
+        parts = []
+        for doc in batch:
+            if bodies.is_external(doc["content"]):
+                parts.extend(bodies.body_parts(doc["id"], doc["content"]))
+            doc.update(bodies.inline_fields(doc["content"]))
+        await db.documents.insert_many(batch)
+        if parts:
+            await db[bodies.BODIES_COLLECTION].insert_many(parts)
+    return ids
+
+
+async def storage_report(db) -> dict:
+    """Size of the metadata and body collections"""
+    import bson
+
+    report = {}
+    for name in ("documents", "document_bodies"):
+        try:
+            stats = await db.command("collStats", name)
+            report[name] = {
+                "count": stats.get("count"),
+                "size_bytes": stats.get("size"),
+                "storage_bytes": stats.get("storageSize"),
+                "avg_object_bytes": stats.get("avgObjSize"),
+            }
+        except Exception:
+            # mongomock has no collStats; measure the BSON size of every row instead
+            sizes = [len(bson.encode(row)) async for row in db[name].find()]
+            report[name] = {
+                "count": len(sizes),
+                "size_bytes": sum(sizes),
+                "avg_object_bytes": int(sum(sizes) / len(sizes)) if sizes else 0,
+            }
+    return report
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def build_scenarios(doc_ids: list, rng: random.Random) -> dict:
+    """Map scenario names to coroutines that issue one request each"""
+
+    async def list_documents(http):
+        return await http.get("/api/documents")
+
+    list_etag = {}
+
+    async def list_revalidate(http):
+        # Conditional GET as the frontend does on navigation; 304 once the ETag is known
+        headers = {"If-None-Match": list_etag["value"]} if "value" in list_etag else {}
+        response = await http.get("/api/documents", headers=headers)
+        if response.headers.get("etag"):
+            list_etag["value"] = response.headers["etag"]
+        return response
+
+    async def search(http):
+        return await http.get(f"/api/documents/search/{rng.choice(QUERIES)}")
+
+    async def by_tag(http):
+        return await http.get(f"/api/documents/by-tag/{rng.choice(TOPICS)}")
+
+    async def stats(http):
+        return await http.get("/api/stats")
+
+    async def export(http):
+        return await http.get("/api/export/oneliners")
+
+    async def ingest(http):
+        doc = make_document(rng, rng.randint(0, 10**6), datetime.now(timezone.utc))
+        return await http.post("/api/documents/paste", data={
+            "title": doc["title"], "content": doc["content"], "category": doc["category"]
+        })
+
+    async def chat(http):
+        return await http.post("/api/chat", json={
+            "session_id": f"bench-{rng.randint(0, 50)}",
+            "message": f"{rng.choice(QUERIES)} bij vermoeidheid?",
+            "context_type": "general",
+        })
+
+    async def blog_create(http):
+        return await http.post("/api/blog/create", json={
+            "document_ids": rng.sample(doc_ids, min(2, len(doc_ids))),
+            "title": f"Blog over {rng.choice(TOPICS)}",
+        })
+
+    return {
+        "list": list_documents,
+        "list_revalidate": list_revalidate,
+        "search": search,
+        "by_tag": by_tag,
+        "stats": stats,
+        "export": export,
+        "ingest": ingest,
+        "chat": chat,
+        "blog_create": blog_create,
+    }
+
+
+async def run_scenario(http, request_fn, requests: int, concurrency: int, warmup: int) -> dict:
+    """Issue `requests` calls with `concurrency` workers and summarize latencies"""
+    for _ in range(warmup):
+        await request_fn(http)
+
+    latencies = []
+    errors = 0
+    response_bytes = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors, response_bytes
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await request_fn(http)
+            latencies.append((time.perf_counter() - started) * 1000)
+            response_bytes += response.num_bytes_downloaded
+            if response.status_code >= 400:
+                errors += 1
+
+    wall_started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - wall_started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 2) if wall else 0.0,
+        "mean_ms": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "avg_response_bytes": int(response_bytes / requests) if requests else 0,
+    }
+
+
+_mock_patches = contextlib.ExitStack()
+
+
+def load_server(args):
+    """Import server.py with the benchmark database and the fake LLM"""
+    os.environ.setdefault("MONGO_URL", args.mongo_url)
+    os.environ["DB_NAME"] = args.db_name
+    sys.path.insert(0, str(ROOT_DIR))
+    import server
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    FakeLlmChat.latency = args.llm_latency_ms / 1000
+    server.LlmChat = FakeLlmChat
+    server.UserMessage = FakeUserMessage
+
+    # The ASGI transport sends no lifespan events, so connect here
+    if args.mongo == "mongomock":
+        from mongomock_motor import AsyncMongoMockClient, enabled_gridfs_integration
+
+        # Keep the GridFS patches active for the rest of the process
+        _mock_patches.enter_context(enabled_gridfs_integration())
+        server.client = AsyncMongoMockClient()
+        server.pool_monitor = None
+    else:
+        server.client, server.pool_monitor = server.mongo.create_client()
+    server.db = server.client[args.db_name]
+    return server
+
+
+async def run_benchmarks(args) -> dict:
+    import httpx
+
+    server = load_server(args)
+    transport = httpx.ASGITransport(app=server.app)
+    results = []
+    storage = []
+
+    headers = {"Accept-Encoding": args.accept_encoding}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers, timeout=None) as http:
+        for size in args.sizes:
+            seed_started = time.perf_counter()
+            doc_ids = await seed_corpus(server.db, size, args.seed)
+            seed_seconds = time.perf_counter() - seed_started
+            print(f"Seeded {size} documents in {seed_seconds:.1f}s")
+            storage.append({"size": size, **await storage_report(server.db)})
+            print(f"  storage: {storage[-1]}")
+            # The ASGI transport sends no startup event, so build the search index here
+            index_started = time.perf_counter()
+            await server.retrieval.build(server.db)
+            print(f"  search index built in {time.perf_counter() - index_started:.1f}s")
+
+            scenarios = build_scenarios(doc_ids, random.Random(args.seed + size))
+            for name in args.scenarios:
+                summary = await run_scenario(http, scenarios[name], args.requests, args.concurrency, args.warmup)
+                summary.update({"size": size, "scenario": name})
+                results.append(summary)
+                print(f"  {name:<15} {summary['throughput_rps']:>9.1f} req/s  "
+                      f"p50 {summary['p50_ms']:>8.2f}ms  p95 {summary['p95_ms']:>8.2f}ms  "
+                      f"p99 {summary['p99_ms']:>8.2f}ms  {summary['avg_response_bytes']:>10} B  "
+                      f"errors {summary['errors']}")
+
+    report = {"meta": run_metadata(args), "results": results, "storage": storage}
+    if args.serialization:
+        report["serialization"] = serialization_benchmark(server, 1000, args.serialization_rounds, args.seed)
+        print(f"Serialization of 1000 documents: {report['serialization']}")
+    if args.chat_session_messages:
+        report["chat_storage"] = await chat_storage_benchmark(server, args.chat_session_messages, args.chat_read_rounds)
+        print(f"Chat session of {args.chat_session_messages} messages: {report['chat_storage']}")
+    return report
+
+
+async def chat_storage_benchmark(server, messages: int, rounds: int) -> dict:
+    """Write and read one long chat session: a document per message vs per-session buckets"""
+    import chats
+
+    db = server.db
+    legacy, buckets = db[chats.LEGACY_COLLECTION], db[chats.BUCKETS_COLLECTION]
+    await legacy.delete_many({})
+    await buckets.delete_many({})
+    await legacy.create_index([("session_id", 1), ("timestamp", 1)])
+    await chats.ensure_indexes(db)
+
+    started_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    turns = []
+    for i in range(0, messages, 2):
+        turns.append([
+            server.ChatMessage(session_id="bench-long", role=role, content=f"Bericht {i + j} over magnesium en slaap.",
+                               timestamp=(started_at + timedelta(seconds=i + j)).isoformat()).dict()
+            for j, role in enumerate(("user", "assistant"))
+        ])
+
+    results = {"messages": messages, "bucket_size": chats.CHAT_BUCKET_SIZE}
+    started = time.perf_counter()
+    for turn in turns:
+        for message in turn:
+            await legacy.insert_one(dict(message))
+    results["per_message_write_ms_per_turn"] = round((time.perf_counter() - started) / len(turns) * 1000, 3)
+    started = time.perf_counter()
+    for turn in turns:
+        await chats.append(db, "bench-long", turn)
+    results["bucket_write_ms_per_turn"] = round((time.perf_counter() - started) / len(turns) * 1000, 3)
+    results["per_message_documents"] = await legacy.count_documents({})
+    results["bucket_documents"] = await buckets.count_documents({})
+
+    async def per_message_read(limit):
+        rows = await legacy.find({"session_id": "bench-long"}, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+        return rows[::-1]
+
+    for limit in sorted({50, 1000, messages}):
+        for name, read in (("per_message", per_message_read), ("bucket", lambda n: chats.history(db, "bench-long", n))):
+            timings = []
+            for _ in range(rounds):
+                read_started = time.perf_counter()
+                rows = await read(limit)
+                timings.append((time.perf_counter() - read_started) * 1000)
+            assert len(rows) == min(limit, messages)
+            results[f"{name}_read_{limit}_ms"] = round(statistics.median(timings), 3)
+
+    await legacy.delete_many({})
+    await buckets.delete_many({})
+    return results
+
+
+def serialization_benchmark(server, documents: int, rounds: int, seed: int) -> dict:
+    """CPU time to turn `documents` raw rows into a JSON list body, model path vs raw orjson path"""
+    from pydantic import TypeAdapter
+
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    rows = [make_document(rng, i, now) for i in range(documents)]
+    adapter = TypeAdapter(List[server.Document])
+
+    def model_path():
+        # What the list endpoints did before: Document(**doc) per row, then FastAPI
+        # validates against response_model, serializes in JSON mode and json.dumps
+        models = [server.Document(**row) for row in rows]
+        validated = adapter.validate_python(models)
+        return json.dumps(adapter.dump_python(validated, mode="json")).encode("utf-8")
+
+    def raw_path():
+        return server.ORJSONResponse(server.document_rows(rows)).body
+
+    results = {"documents": documents, "rounds": rounds}
+    for name, fn in (("pydantic_models", model_path), ("orjson_rows", raw_path)):
+        fn()
+        started = time.process_time()
+        for _ in range(rounds):
+            body = fn()
+        results[f"{name}_cpu_ms"] = round((time.process_time() - started) / rounds * 1000, 3)
+        results[f"{name}_bytes"] = len(body)
+    return results
+
+
+def run_metadata(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mongo": args.mongo,
+        "seed": args.seed,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "llm_latency_ms": args.llm_latency_ms,
+        "accept_encoding": args.accept_encoding,
+    }
+
+
+def compare(baseline_path: str, candidate_path: str, threshold: float) -> int:
+    """Print per-scenario deltas between two result files; non-zero exit on regressions"""
+    baseline = json.loads(Path(baseline_path).read_text())
+    candidate = json.loads(Path(candidate_path).read_text())
+    base_rows = {(r["size"], r["scenario"]): r for r in baseline["results"]}
+    regressions = 0
+
+    print(f"{'size':>7} {'scenario':<12} {'p50 Δ':>9} {'p95 Δ':>9} {'p99 Δ':>9} {'rps Δ':>9}")
+    for row in candidate["results"]:
+        base = base_rows.get((row["size"], row["scenario"]))
+        if not base:
+            continue
+        deltas = {}
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            deltas[key] = (row[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+        regressed = deltas["p95_ms"] > threshold or deltas["throughput_rps"] < -threshold
+        regressions += regressed
+        print(f"{row['size']:>7} {row['scenario']:<12} {deltas['p50_ms']:>+8.1f}% {deltas['p95_ms']:>+8.1f}% "
+              f"{deltas['p99_ms']:>+8.1f}% {deltas['throughput_rps']:>+8.1f}%{'  REGRESSION' if regressed else ''}")
+    return 1 if regressions else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000], help="corpus sizes, e.g. 1000 10000 100000")
+    parser.add_argument("--scenarios", nargs="+", default=DEFAULT_SCENARIOS, choices=DEFAULT_SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mongo", choices=["local", "mongomock"], default="local")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="wellness_benchmark")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency of the fake LLM")
+    parser.add_argument("--accept-encoding", default="br, gzip",
+                        help="Accept-Encoding sent by the client; use 'identity' to measure uncompressed bandwidth")
+    parser.add_argument("--serialization", action="store_true",
+                        help="also measure CPU time to serialize a 1000-document list")
+    parser.add_argument("--serialization-rounds", type=int, default=20)
+    parser.add_argument("--chat-session-messages", type=int, default=0,
+                        help="also measure writing and reading one chat session of this many messages (e.g. 10000)")
+    parser.add_argument("--chat-read-rounds", type=int, default=5)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"))
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+
+    report = asyncio.run(run_benchmarks(args))
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Out-of-line, compressed storage for large document bodies.
+
+Documents whose ``content`` is longer than ``BODY_INLINE_MAX_CHARS`` keep only
+the first ``BODY_HEAD_CHARS`` characters inline (enough for list snippets and
+LLM context excerpts) and are flagged with ``content_external``. The full body
+is zstd-compressed (zlib when ``zstandard`` is not installed) and stored in
+``document_bodies`` in parts of at most ``BODY_PART_BYTES`` compressed bytes,
+so bodies are not bound by Mongo's 16 MB document limit. Readers that need the
+whole text call ``load_content``/``hydrate``.
+"""
+import asyncio
+import os
+import re
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+from bson.binary import Binary
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, zlib is used instead
+    zstandard = None
+
+BODY_INLINE_MAX_CHARS = int(os.environ.get('BODY_INLINE_MAX_CHARS', '32768'))
+BODY_HEAD_CHARS = int(os.environ.get('BODY_HEAD_CHARS', '2000'))
+BODY_PART_BYTES = 8 * 1024 * 1024
+ZSTD_LEVEL = int(os.environ.get('BODY_ZSTD_LEVEL', '6'))
+
+BODIES_COLLECTION = 'document_bodies'
+
+
+def compress(text: str) -> tuple:
+    raw = text.encode('utf-8')
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return 'zlib', zlib.compress(raw, 6)
+
+
+def decompress(codec: str, data: bytes) -> str:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed bodies")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    return zlib.decompress(data).decode('utf-8')
+
+
+def is_external(content: str) -> bool:
+    return len(content) > BODY_INLINE_MAX_CHARS
+
+
+def inline_fields(content: str) -> dict:
+    """Fields stored on the metadata document for a given body"""
+    if not is_external(content):
+        return {"content": content, "content_external": False}
+    return {"content": content[:BODY_HEAD_CHARS], "content_external": True}
+
+
+def body_parts(document_id: str, content: str) -> List[dict]:
+    """Compressed body parts for `document_bodies`"""
+    codec, data = compress(content)
+    now = datetime.now(timezone.utc).isoformat()
+    parts = []
+    for index, start in enumerate(range(0, len(data), BODY_PART_BYTES)):
+        parts.append({
+            "document_id": document_id,
+            "part": index,
+            "codec": codec,
+            "data": Binary(data[start:start + BODY_PART_BYTES]),
+            "size": len(content),
+            "compressed_size": len(data),
+            "updated_at": now,
+        })
+    return parts
+
+
+async def ensure_indexes(db):
+    await db[BODIES_COLLECTION].create_index([("document_id", 1), ("part", 1)], unique=True)
+
+
+async def store_content(db, document_id: str, content: str) -> dict:
+    """Write (or drop) the out-of-line body and return the inline fields to store"""
+    fields = inline_fields(content)
+    await db[BODIES_COLLECTION].delete_many({"document_id": document_id})
+    if fields["content_external"]:
+        parts = await asyncio.to_thread(body_parts, document_id, content)
+        await db[BODIES_COLLECTION].insert_many(parts)
+    return fields
+
+
+async def delete_body(db, document_id: str):
+    await db[BODIES_COLLECTION].delete_many({"document_id": document_id})
+
+
+async def load_content(db, doc: dict) -> str:
+    """Full content of a document, decompressing the external body when needed"""
+    if not doc.get('content_external'):
+        return doc.get('content', '')
+    parts = await db[BODIES_COLLECTION].find(
+        {"document_id": doc['id']}, {"codec": 1, "data": 1, "_id": 0}
+    ).sort("part", 1).to_list(None)
+    if not parts:
+        return doc.get('content', '')
+    data = b"".join(bytes(part['data']) for part in parts)
+    return await asyncio.to_thread(decompress, parts[0]['codec'], data)
+
+
+async def hydrate(db, doc: Optional[dict]) -> Optional[dict]:
+    """Copy of a metadata document with its full content"""
+    if not doc or not doc.get('content_external'):
+        return doc
+    return {**doc, "content": await load_content(db, doc)}
+
+
+async def batches(db, projection: dict, batch_size: int, full: bool = True):
+    """Every document, in lists of `batch_size`, with its full content unless `full` is false"""
+    batch = []
+    async for doc in db.documents.find({}, projection):
+        if full and doc.get('content_external'):
+            doc['content'] = await load_content(db, doc)
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def map_batches(db, projection: dict, batch_size: int, executor, function, in_flight: int) -> list:
+    """Results of `function(batch)` for every batch of documents, run in a (process) executor
+
+    At most `in_flight` batches are read ahead of the results, so only those
+    bodies are held in memory instead of the whole archive.
+    """
+    loop = asyncio.get_running_loop()
+    rows, pending = [], deque()
+    async for batch in batches(db, projection, batch_size):
+        pending.append(loop.run_in_executor(executor, function, batch))
+        if len(pending) >= in_flight:
+            rows += await pending.popleft()
+    while pending:
+        rows += await pending.popleft()
+    return rows
+
+
+async def search_bodies(db, query: str, exclude: Iterable[str] = (), limit: int = 100) -> List[str]:
+    """Ids of documents whose external body matches a case-insensitive regex"""
+    try:
+        pattern = re.compile(query, re.IGNORECASE)
+    except re.error:
+        return []
+
+    excluded = set(exclude)
+    matches = []
+    cursor = db[BODIES_COLLECTION].find(
+        {"document_id": {"$nin": list(excluded)}}, {"document_id": 1, "codec": 1, "data": 1, "_id": 0}
+    ).sort([("document_id", 1), ("part", 1)])
+
+    current_id, codec, chunks = None, None, []
+
+    async def check(codec, chunks):
+        text = await asyncio.to_thread(decompress, codec, b"".join(chunks))
+        return pattern.search(text) is not None
+
+    async for part in cursor:
+        if part['document_id'] != current_id:
+            if current_id is not None and await check(codec, chunks):
+                matches.append(current_id)
+                if len(matches) >= limit:
+                    return matches
+            current_id, codec, chunks = part['document_id'], part['codec'], []
+        chunks.append(bytes(part['data']))
+    if current_id is not None and len(matches) < limit and await check(codec, chunks):
+        matches.append(current_id)
+    return matches
@@ -0,0 +1,253 @@
+"""In-process read-through cache for hot document, category and tag reads.
+
+Entries are bounded by an approximate byte budget and expire after a TTL, so a
+worker never serves data older than ``CACHE_TTL_SECONDS`` even if it misses an
+invalidation. Writes in server.py invalidate precisely (the document itself and
+the tag lists it appears in); with several uvicorn workers the optional Mongo
+change-stream listener propagates writes made by the other workers.
+
+Search results are not invalidated per document. Instead, each entry is
+stamped with the archive write version: a counter in Mongo that every document
+mutation bumps, from any worker or backfill script. An entry stamped with an
+older version is never served.
+"""
+import asyncio
+import logging
+import os
+from collections import Counter
+from typing import Iterable
+
+from cachetools import TTLCache
+from pymongo import UpdateOne
+
+CACHE_ENABLED = os.environ.get('CACHE_ENABLED', '1') == '1'
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '300'))
+CACHE_DOCUMENTS_MAX_BYTES = int(os.environ.get('CACHE_DOCUMENTS_MAX_BYTES', str(64 * 1024 * 1024)))
+CACHE_TAGS_MAX_BYTES = int(os.environ.get('CACHE_TAGS_MAX_BYTES', str(32 * 1024 * 1024)))
+CACHE_CHANGE_STREAMS = os.environ.get('CACHE_CHANGE_STREAMS', '0') == '1'
+CACHE_SEARCH_MAX_BYTES = int(os.environ.get('CACHE_SEARCH_MAX_BYTES', str(32 * 1024 * 1024)))
+CACHE_CONTEXT_MAX_BYTES = int(os.environ.get('CACHE_CONTEXT_MAX_BYTES', str(8 * 1024 * 1024)))
+SEARCH_WARMUP_QUERIES = int(os.environ.get('SEARCH_WARMUP_QUERIES', '20'))
+
+COUNTERS_COLLECTION = 'counters'
+WRITE_VERSION_KEY = 'archive_writes'
+SEARCH_QUERIES_COLLECTION = 'search_queries'
+
+MISSING = object()
+
+
+def _document_size(doc: dict) -> int:
+    """Approximate memory footprint of a raw document"""
+    return 512 + len(doc.get('content') or '') + len(doc.get('content_preview') or '')
+
+
+def _value_size(value) -> int:
+    if isinstance(value, bytes):
+        return 64 + len(value)
+    if isinstance(value, tuple):
+        return sum(_value_size(item) for item in value)
+    if isinstance(value, dict):
+        return _document_size(value)
+    if isinstance(value, list):
+        return 64 + sum(_value_size(item) for item in value)
+    return 256
+
+
+class ReadCache:
+    """Byte-bounded LRU cache with TTL and hit/miss counters"""
+
+    def __init__(self, name: str, max_bytes: int, ttl: float):
+        self.name = name
+        self._cache = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=_value_size)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        if not CACHE_ENABLED:
+            return MISSING
+        value = self._cache.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if not CACHE_ENABLED:
+            return
+        try:
+            self._cache[key] = value
+        except ValueError:
+            # Value larger than the whole cache budget
+            pass
+
+    def invalidate(self, key):
+        if self._cache.pop(key, MISSING) is not MISSING:
+            self.invalidations += 1
+
+    def values(self):
+        return list(self._cache.values())
+
+    def clear(self):
+        self.invalidations += len(self._cache)
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "bytes": self._cache.currsize,
+            "max_bytes": self._cache.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SearchCache(ReadCache):
+    """Search responses stamped with the write version (and index generation) they were computed at"""
+
+    def __init__(self, name: str, max_bytes: int, ttl: float):
+        super().__init__(name, max_bytes, ttl)
+        self.stale = 0
+
+    def lookup(self, key, version: int, generation=None):
+        entry = self.get(key)
+        if entry is MISSING:
+            return MISSING
+        if entry[0] != version or entry[1] != generation:
+            # Counted as a miss: the archive changed since the entry was stored
+            self.hits -= 1
+            self.misses += 1
+            self.stale += 1
+            self.invalidate(key)
+            return MISSING
+        return entry[2]
+
+    def store(self, key, version: int, generation, body: bytes):
+        self.set(key, (version, generation, body))
+
+    def stats(self) -> dict:
+        return {**super().stats(), "stale": self.stale}
+
+
+document_cache = ReadCache("documents", CACHE_DOCUMENTS_MAX_BYTES, CACHE_TTL_SECONDS)
+category_cache = ReadCache("categories", 1024 * 1024, CACHE_TTL_SECONDS)
+tag_cache = ReadCache("tags", CACHE_TAGS_MAX_BYTES, CACHE_TTL_SECONDS)
+search_cache = SearchCache("search", CACHE_SEARCH_MAX_BYTES, CACHE_TTL_SECONDS)
+# Knowledge-base excerpts selected for LLM prompts, stamped like search results
+context_cache = SearchCache("context", CACHE_CONTEXT_MAX_BYTES, CACHE_TTL_SECONDS)
+
+CATEGORIES_KEY = "all"
+
+
+def tag_key(tag: str) -> str:
+    return tag.lower()
+
+
+def invalidate_document(document_id: str, tags: Iterable[str] = ()):
+    """Drop a document and every tag list it appears in"""
+    document_cache.invalidate(document_id)
+    for tag in tags:
+        tag_cache.invalidate(tag_key(tag))
+
+
+def invalidate_categories():
+    category_cache.invalidate(CATEGORIES_KEY)
+
+
+def stats() -> dict:
+    return {
+        "enabled": CACHE_ENABLED,
+        "ttl_seconds": CACHE_TTL_SECONDS,
+        "change_streams": CACHE_CHANGE_STREAMS,
+        "caches": {c.name: c.stats() for c in (document_cache, category_cache, tag_cache, search_cache, context_cache)},
+    }
+
+
+# Archive write version for search results
+
+async def write_version(db) -> int:
+    counter = await db[COUNTERS_COLLECTION].find_one({"_id": WRITE_VERSION_KEY})
+    return counter["seq"] if counter else 0
+
+
+async def bump_write_version(db):
+    """Mark every cached search result as stale, in all workers"""
+    await db[COUNTERS_COLLECTION].update_one({"_id": WRITE_VERSION_KEY}, {"$inc": {"seq": 1}}, upsert=True)
+
+
+# Query popularity, for warming the search cache at startup
+
+_query_counts = Counter()
+
+
+def count_query(query: str):
+    _query_counts[query] += 1
+
+
+async def flush_query_counts(db):
+    if not _query_counts:
+        return
+    counts = dict(_query_counts)
+    _query_counts.clear()
+    await db[SEARCH_QUERIES_COLLECTION].bulk_write([
+        UpdateOne({"_id": query}, {"$inc": {"count": count}}, upsert=True) for query, count in counts.items()
+    ], ordered=False)
+
+
+async def flush_query_counts_periodically(db, interval: float = 60):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await flush_query_counts(db)
+            except Exception as e:
+                logging.error(f"Error saving search query counts: {str(e)}")
+    except asyncio.CancelledError:
+        raise
+
+
+async def top_queries(db, limit: int = SEARCH_WARMUP_QUERIES) -> list:
+    rows = await db[SEARCH_QUERIES_COLLECTION].find().sort("count", -1).limit(limit).to_list(limit)
+    return [row["_id"] for row in rows]
+
+
+def _invalidate_by_object_id(object_id):
+    """Drop a cached document by Mongo _id (delete events carry no 'id' field)"""
+    for doc in document_cache.values():
+        if doc.get('_id') == object_id:
+            invalidate_document(doc['id'], doc.get('tags', []))
+
+
+async def watch_documents(db):
+    """Invalidate on writes made by other workers via Mongo change streams"""
+    try:
+        async with db.documents.watch(full_document='updateLookup') as stream:
+            async for change in stream:
+                operation = change.get('operationType')
+                full_document = change.get('fullDocument') or {}
+                _invalidate_by_object_id(change.get('documentKey', {}).get('_id'))
+                if full_document.get('id'):
+                    invalidate_document(full_document['id'], full_document.get('tags', []))
+                # Old tags are unknown without pre-images, so drop all tag lists when tags may have moved
+                updated_fields = change.get('updateDescription', {}).get('updatedFields', {})
+                if operation in ('delete', 'replace') or 'tags' in updated_fields:
+                    tag_cache.clear()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.error(f"Document change stream stopped: {str(e)}")
+
+
+async def watch_categories(db):
+    try:
+        async with db.categories.watch() as stream:
+            async for _ in stream:
+                invalidate_categories()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.error(f"Category change stream stopped: {str(e)}")
@@ -0,0 +1,121 @@
+"""Chat history stored in per-session buckets.
+
+Messages live in the ``chat_buckets`` collection as arrays of up to
+``CHAT_BUCKET_SIZE`` messages per document. A message is appended with one
+upsert: ``$push`` into the session's bucket that still has room, or a new
+bucket when there is none. A chat turn stores the question before asking the
+LLM and the answer once it arrives. A history read fetches a
+few buckets, newest first, through the ``(session_id, first_at)`` index,
+instead of one document per message.
+
+A session is deleted once it has been idle (no message in any of its
+buckets) for ``CHAT_RETENTION_DAYS``. This runs as a periodic cleanup rather
+than a TTL index on the buckets, because a TTL on each bucket would drop the
+older buckets of a session that is still in use. Messages in the old
+per-message ``chat_messages`` collection are merged into the history of their
+session while its buckets hold fewer than the requested messages, and are
+removed together with their session once it is idle.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+CHAT_BUCKET_SIZE = int(os.environ.get('CHAT_BUCKET_SIZE', '100'))
+CHAT_RETENTION_DAYS = float(os.environ.get('CHAT_RETENTION_DAYS', '180'))
+CHAT_CLEANUP_SECONDS = float(os.environ.get('CHAT_CLEANUP_SECONDS', '3600'))
+CHAT_HISTORY_LIMIT = 1000
+
+BUCKETS_COLLECTION = "chat_buckets"
+LEGACY_COLLECTION = "chat_messages"
+
+
+async def ensure_indexes(db):
+    await db[BUCKETS_COLLECTION].create_index([("session_id", 1), ("first_at", -1)])
+    await db[BUCKETS_COLLECTION].create_index([("session_id", 1), ("count", 1)])
+    await db[BUCKETS_COLLECTION].create_index("last_at")
+    await db[LEGACY_COLLECTION].create_index([("session_id", 1), ("timestamp", -1)])
+
+
+async def append(db, session_id: str, messages: List[dict]):
+    """Store a turn's messages (dicts with a timestamp) in one write"""
+    now = messages[-1]["timestamp"]
+    await db[BUCKETS_COLLECTION].update_one(
+        {"session_id": session_id, "count": {"$lte": CHAT_BUCKET_SIZE - len(messages)}},
+        {
+            "$push": {"messages": {"$each": messages}},
+            "$inc": {"count": len(messages)},
+            "$set": {"last_at": now},
+            "$setOnInsert": {"first_at": messages[0]["timestamp"]},
+        },
+        upsert=True,
+    )
+
+
+async def history(db, session_id: str, limit: int = CHAT_HISTORY_LIMIT) -> List[dict]:
+    """The session's last `limit` messages, oldest first"""
+    buckets = db[BUCKETS_COLLECTION].find(
+        {"session_id": session_id}, {"_id": 0, "messages": 1}
+    ).sort("first_at", -1)
+    messages = []
+    async for bucket in buckets:
+        messages.extend(bucket["messages"])
+        if len(messages) >= limit:
+            break
+    if len(messages) < limit:
+        # Sessions started before buckets existed have their older messages here
+        messages += await db[LEGACY_COLLECTION].find(
+            {"session_id": session_id}, {"_id": 0}
+        ).sort("timestamp", -1).limit(limit).to_list(limit)
+    # Concurrent turns can fill two buckets at once, so order by time after merging
+    messages.sort(key=lambda message: message["timestamp"])
+    return messages[-limit:]
+
+
+async def delete_session(db, session_id: str) -> int:
+    result = await db[BUCKETS_COLLECTION].delete_many({"session_id": session_id})
+    legacy = await db[LEGACY_COLLECTION].delete_many({"session_id": session_id})
+    return result.deleted_count + legacy.deleted_count
+
+
+async def cleanup(db, retention_days: Optional[float] = None) -> int:
+    """Delete sessions without a message in the retention period; returns the number of sessions"""
+    retention_days = CHAT_RETENTION_DAYS if retention_days is None else retention_days
+    if retention_days <= 0:
+        return 0
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).isoformat()
+    buckets, legacy = db[BUCKETS_COLLECTION], db[LEGACY_COLLECTION]
+
+    async def active(session_id: str) -> bool:
+        return bool(
+            await buckets.find_one({"session_id": session_id, "last_at": {"$gte": cutoff}}, {"_id": 1})
+            or await legacy.find_one({"session_id": session_id, "timestamp": {"$gte": cutoff}}, {"_id": 1})
+        )
+
+    removed = set()
+    for session_id in await buckets.distinct("session_id", {"last_at": {"$lt": cutoff}}):
+        # Old buckets of a session that is still active stay
+        if not await active(session_id):
+            await buckets.delete_many({"session_id": session_id})
+            removed.add(session_id)
+    # Old per-message rows go with their session, never out of the history of an active one
+    for session_id in await legacy.distinct("session_id", {"timestamp": {"$lt": cutoff}}):
+        if session_id in removed or not await active(session_id):
+            await legacy.delete_many({"session_id": session_id})
+            removed.add(session_id)
+    if removed:
+        logging.info(f"Removed {len(removed)} idle chat sessions")
+    return len(removed)
+
+
+async def cleanup_periodically(db, interval: float = CHAT_CLEANUP_SECONDS):
+    try:
+        while True:
+            try:
+                await cleanup(db)
+            except Exception as e:
+                logging.error(f"Chat cleanup error: {str(e)}")
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        raise
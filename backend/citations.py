@@ -0,0 +1,253 @@
+"""Local reference extraction and the shared citation index.
+
+``extract`` reads a document line by line, once, and finds:
+- identifiers anywhere in the text: DOIs, PMIDs, PMC ids and URLs (doi.org
+  and PubMed links are turned into the DOI or PMID they point to);
+- citation lines in APA ("Jansen, P. (2019). ...") or Vancouver
+  ("Jansen P, de Vries K. ... 2019;12:45-9") style;
+- every line with a year below a heading such as "Referenties", "Bronnen"
+  or "Literatuur", which is where papers keep their references.
+
+Each reference gets a normalized key: its DOI, PMID, PMC id or URL, or a hash
+of the folded text for a citation without one. All keys found on one line
+are kept with it, and references sharing any key are one entry, so the same
+study cited by PMID in one place and by DOI and PMID in another is one entry.
+
+The ``citations`` collection holds one row per study with all of its keys and
+the ids of the documents that cite it. A written reference joins the row that
+already has one of its keys (rows found to be the same study are merged), and
+only starts a row of its own when none does. Lookups go through the indexed
+``keys`` and ``documents`` arrays, so "which documents cite this study" is a
+single query. A document write adds or pulls only that document's id.
+"""
+import hashlib
+import os
+import re
+import unicodedata
+from datetime import datetime, timezone
+from typing import List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+CITATIONS_LLM_FALLBACK = os.environ.get('CITATIONS_LLM_FALLBACK', '0') == '1'
+CITATIONS_MAX_REFERENCES = int(os.environ.get('CITATIONS_MAX_REFERENCES', '50'))
+
+CITATIONS_COLLECTION = "citations"
+
+MAX_LINE_CHARS = 1000
+MAX_TEXT_CHARS = 500
+
+DOI = re.compile(r'\b10\.\d{4,9}/[-._;()/:a-z0-9]+', re.IGNORECASE)
+PMID = re.compile(r'\bPMID:?\s*(\d{1,9})\b', re.IGNORECASE)
+PMCID = re.compile(r'\bPMC\s?(\d{4,9})\b')
+URL = re.compile(r'\bhttps?://[^\s<>"\'\]]+', re.IGNORECASE)
+YEAR = re.compile(r'\b(?:19|20)\d{2}\b')
+
+HEADING = re.compile(
+    r'^(?:#+\s*)?(?:\d+\.?\s*)?(referenties|referentielijst|bronnen|bronvermelding|literatuur|literatuurlijst|'
+    r'geraadpleegde literatuur|references|bibliography|sources|literature)\s*:?$',
+    re.IGNORECASE,
+)
+BULLET = re.compile(r'^(?:[-•*–]|\[\d{1,3}\]|\d{1,3}[.)])\s+')
+APA = re.compile(r"^[A-Z][\w'’-]+,\s(?:[A-Z]\.\s?){1,3}.{0,300}?\((?:19|20)\d{2}[a-z]?\)")
+VANCOUVER = re.compile(r"^[A-Z][\w'’-]+\s[A-Z]{1,3}[,.].{0,300}?\b(?:19|20)\d{2}\s?;\s?\d+")
+ET_AL = re.compile(r"^[A-Z][\w'’-]+\set\sal\.?,?\s\(?(?:19|20)\d{2}")
+
+_TRAILING = '.,;:'
+_PUBMED = re.compile(r'(?:pubmed\.ncbi\.nlm\.nih\.gov/|ncbi\.nlm\.nih\.gov/pubmed/)(\d{1,9})')
+_PMC = re.compile(r'ncbi\.nlm\.nih\.gov/pmc/articles/pmc(\d{4,9})')
+
+
+def _trim(value: str) -> str:
+    """Drop sentence punctuation and unbalanced closing brackets after an identifier"""
+    while value and (value[-1] in _TRAILING or (value[-1] == ')' and value.count('(') < value.count(')'))):
+        value = value[:-1]
+    return value
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if not k.lower().startswith('utm_')])
+    return urlunsplit((parts.scheme.lower(), host, parts.path.rstrip('/'), query, ''))
+
+
+def identifiers(text: str) -> List[tuple]:
+    """(type, value) of the DOIs, PMIDs, PMC ids and URLs in a line, in order"""
+    found = []
+    for match in URL.finditer(text):
+        url = _trim(match.group())
+        lowered = url.lower()
+        doi = DOI.search(url) if 'doi.org/' in lowered else None
+        pubmed, pmc = _PUBMED.search(lowered), _PMC.search(lowered)
+        if doi:
+            found.append(("doi", _trim(doi.group()).lower()))
+        elif pubmed:
+            found.append(("pmid", pubmed.group(1)))
+        elif pmc:
+            found.append(("pmcid", f"PMC{pmc.group(1)}"))
+        else:
+            found.append(("url", normalize_url(url)))
+    # Identifiers outside URLs
+    bare = URL.sub(' ', text)
+    found += [("doi", _trim(match.group()).lower()) for match in DOI.finditer(bare)]
+    found += [("pmid", match.group(1)) for match in PMID.finditer(bare)]
+    found += [("pmcid", f"PMC{match.group(1)}") for match in PMCID.finditer(bare)]
+    return list(dict.fromkeys(found))
+
+
+def text_key(text: str) -> str:
+    folded = unicodedata.normalize('NFKD', text.casefold())
+    folded = re.sub(r'[^0-9a-z]+', ' ', folded.encode('ascii', 'ignore').decode('ascii')).strip()
+    return "ref:" + hashlib.sha1(folded.encode('ascii')).hexdigest()[:16]
+
+
+def is_citation(text: str, in_references: bool) -> bool:
+    if in_references:
+        return len(text) >= 20 and bool(YEAR.search(text))
+    return bool(APA.match(text) or VANCOUVER.match(text) or ET_AL.match(text))
+
+
+def extract(content: str) -> List[dict]:
+    """References in content, deduplicated, in order of appearance: [{key, keys, type, value, text}]"""
+    citations = {}
+    in_references = False
+    for line in (content or '').splitlines():
+        stripped = line.strip()
+        if not stripped or len(stripped) > MAX_LINE_CHARS:
+            continue
+        if HEADING.match(stripped):
+            in_references = True
+            continue
+        if in_references and stripped.startswith('#'):
+            in_references = False
+        text = BULLET.sub('', stripped)
+        ids = identifiers(text)
+        if is_citation(text, in_references):
+            # One reference per citation line, known under all of its identifiers
+            keys = [f"{kind}:{value}" for kind, value in ids] or [text_key(text)]
+            kind, value = ids[0] if ids else ("citation", text[:MAX_TEXT_CHARS])
+            _add(citations, keys, kind, value, text)
+        else:
+            for kind, value in ids:
+                _add(citations, [f"{kind}:{value}"], kind, value, text)
+    return list({citation["key"]: citation for citation in citations.values()}.values())
+
+
+def _add(citations: dict, keys: List[str], kind: str, value: str, text: str):
+    """Add a reference under all of its keys, or its new keys to the entry that has one of them"""
+    known = next((citations[key] for key in keys if key in citations), None)
+    if known is None:
+        known = {"key": keys[0], "keys": [], "type": kind, "value": value, "text": text[:MAX_TEXT_CHARS]}
+    for key in keys:
+        if key not in known["keys"]:
+            known["keys"].append(key)
+        citations[key] = known
+
+
+def reference_strings(found: List[dict], limit: int = CITATIONS_MAX_REFERENCES) -> List[str]:
+    """The document's ``references`` field: one display string per reference line"""
+    return list(dict.fromkeys(citation["text"] for citation in found))[:limit]
+
+
+def lookup_keys(query: str) -> List[str]:
+    """Keys to look up for a DOI, PMID, URL or citation text typed by a user"""
+    query = query.strip()
+    if re.fullmatch(r'\d{1,9}', query):
+        return [f"pmid:{query}"]
+    ids = identifiers(query)
+    return [f"{kind}:{value}" for kind, value in ids] or [text_key(BULLET.sub('', query))]
+
+
+async def ensure_indexes(db):
+    await db[CITATIONS_COLLECTION].create_index("keys")
+    await db[CITATIONS_COLLECTION].create_index("documents")
+
+
+async def update(db, document_id: str, after: Optional[dict], found: Optional[List[dict]] = None):
+    """Point the citation index at the references of one written document"""
+    import bodies
+
+    if found is None:
+        found = extract((await bodies.hydrate(db, after))['content']) if after is not None else []
+    collection = db[CITATIONS_COLLECTION]
+    current, row_keys = await _resolve(collection, found)
+    stored = set(await collection.distinct("_id", {"documents": document_id}))
+    removed = list(stored - current.keys())
+
+    now = datetime.now(timezone.utc).isoformat()
+    operations = [UpdateOne({"_id": row_id}, {"$pull": {"documents": document_id}}) for row_id in removed]
+    operations += [
+        UpdateOne({"_id": row_id}, {
+            "$addToSet": {"documents": document_id, "keys": {"$each": keys}},
+            "$setOnInsert": {"type": citation["type"], "value": citation["value"], "text": citation["text"], "created_at": now},
+        }, upsert=True)
+        for row_id, (citation, keys) in current.items()
+        if row_id not in stored or not set(keys) <= row_keys.get(row_id, set())
+    ]
+    if not operations:
+        return
+    try:
+        await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError:
+        # Another worker inserted one of the same citations first; the upserts now match
+        await collection.bulk_write(operations, ordered=False)
+    if removed:
+        await collection.delete_many({"_id": {"$in": removed}, "documents": {"$size": 0}})
+
+
+async def _resolve(collection, found: List[dict]) -> tuple:
+    """Row id for every reference: ({row id: (citation, keys)}, {row id: stored keys})
+
+    A reference goes to the row holding one of its keys, or to a new row
+    under its own key. Rows that turn out to hold the same study are merged
+    into the first.
+    """
+    wanted = [key for citation in found for key in citation["keys"]]
+    rows = await collection.find({"keys": {"$in": wanted}}, {"keys": 1}).to_list(None) if wanted else []
+    row_keys = {row["_id"]: set(row["keys"]) for row in rows}
+    owner = {}
+    for row in rows:
+        for key in row["keys"]:
+            owner.setdefault(key, row["_id"])
+
+    current = {}
+    for citation in found:
+        row_ids = list(dict.fromkeys(owner[key] for key in citation["keys"] if key in owner))
+        row_id = row_ids[0] if row_ids else citation["key"]
+        keys = list(citation["keys"])
+        for other in row_ids[1:]:
+            merged = await collection.find_one_and_delete({"_id": other})
+            if merged:
+                await collection.update_one({"_id": row_id}, {"$addToSet": {
+                    "keys": {"$each": merged["keys"]}, "documents": {"$each": merged.get("documents", [])},
+                }})
+                row_keys[row_id] |= set(merged["keys"])
+            owner.update((key, row_id) for key, key_owner in list(owner.items()) if key_owner == other)
+            if other in current:
+                keys += current.pop(other)[1]
+        # Two references of one document can end up in the same row
+        first, known = current.get(row_id, (citation, []))
+        current[row_id] = (first, list(dict.fromkeys(known + keys)))
+    return current, row_keys
+
+
+async def citing_documents(db, query: str) -> List[dict]:
+    """Citations matching a DOI, PMID, URL or citation text, with the ids of the documents citing them"""
+    return await db[CITATIONS_COLLECTION].find(
+        {"keys": {"$in": lookup_keys(query)}}, {"_id": 0, "keys": 1, "type": 1, "value": 1, "text": 1, "documents": 1}
+    ).to_list(20)
+
+
+async def document_citations(db, document_id: str) -> List[dict]:
+    rows = db[CITATIONS_COLLECTION].find(
+        {"documents": document_id}, {"_id": 0, "keys": 1, "type": 1, "value": 1, "text": 1, "documents": 1}
+    )
+    return [
+        {**{key: value for key, value in row.items() if key != "documents"}, "cited_by": len(row["documents"])}
+        async for row in rows
+    ]
@@ -0,0 +1,369 @@
+"""Local (non-LLM) derivations of document text: previews, one-liners and
+consumer blog titles. Pure functions without database or app state, so they
+can run in worker processes (see reindex.py)."""
+import re
+
+# Vocabularies recognized in document content (also used for typeahead entities, see suggest.py)
+VITAMIN_PATTERN = r'\b(vitamine?\s*[a-z0-9]+|vitamin\s*[a-z0-9]+|foliumzuur|biotine|niacine|riboflavine|thiamine)\b'
+MINERAL_PATTERN = r'\b(magnesium|calcium|ijzer|zink|selenium|jodium|kalium|fosfor|chroom|mangaan|koper)\b'
+SUPPLEMENT_PATTERN = r'\b(omega[- ]?3|probiotica|prebiotica|coq10|co-enzym|kurkuma|ginkgo|ginseng|spirulina|chlorella)\b'
+HERB_PATTERN = r'\b(ashwagandha|rhodiola|valeriaan|passiebloem|echinacea|gember|mariadistel|sint[- ]janskruid|kamille|brandnetel|melisse|zoethout|boswellia|saffraan)\b'
+CONDITION_PATTERN = r'\b(diabetes|hypertensie|cholesterol|artritis|fibromyalgie|migraine|eczeem|psoriasis|astma|allergieën?|depressie|angst|adhd|autisme|alzheimer|parkinson|kanker|hart[- ]?vaatziekten?)\b'
+FOOD_GROUP_PATTERN = r'\b(groenten?|fruit|vis|vlees|noten|zaden|graanproducten?|peulvruchten?|oliën?|kruiden?)\b'
+FOOD_PATTERN = r'\b(broccoli|spinazie|wortel|biet|avocado|blauwe bessen?|zalm|sardines?|walnoten|lijnzaad|kurkuma|gember)\b'
+
+ENTITY_PATTERNS = {
+    "vitamine": re.compile(VITAMIN_PATTERN),
+    "mineraal": re.compile(MINERAL_PATTERN),
+    "supplement": re.compile(SUPPLEMENT_PATTERN),
+    "kruid": re.compile(HERB_PATTERN),
+}
+
+# Entities of the knowledge graph (see graph.py): the vocabularies above plus
+# conditions and specific foods. Food groups are too generic to link.
+GRAPH_PATTERNS = {
+    **ENTITY_PATTERNS,
+    "aandoening": re.compile(CONDITION_PATTERN),
+    "voeding": re.compile(FOOD_PATTERN),
+}
+
+_VITAMIN_NAME = re.compile(r'vitamine?\s*([abcdek]\d{0,2})$')
+
+
+def canonical_entity(kind: str, match: str) -> str:
+    """Canonical spelling of a vocabulary match, or '' for noise like 'vitamines'"""
+    match = ' '.join(match.split())
+    if kind == "vitamine" and match.startswith("vitamin"):
+        name = _VITAMIN_NAME.match(match)
+        return f"vitamine {name.group(1)}" if name else ''
+    if kind == "supplement" and match.startswith("omega"):
+        return "omega-3"
+    if kind == "kruid" and match.startswith("sint"):
+        return "sint-janskruid"
+    if kind == "aandoening":
+        if match.startswith("allergie"):
+            return "allergie"
+        if match.startswith("hart"):
+            return "hart- en vaatziekten"
+    if kind == "voeding":
+        return {"blauwe besse": "blauwe bessen", "sardine": "sardines"}.get(match, match)
+    return match
+
+
+def extract_entities(text: str) -> set:
+    """(kind, name) pairs of known vitamins, minerals, supplements and herbs mentioned in text"""
+    text = text.lower()
+    entities = set()
+    for kind, pattern in ENTITY_PATTERNS.items():
+        for match in pattern.findall(text):
+            name = canonical_entity(kind, match)
+            if name:
+                entities.add((kind, name))
+    return entities
+
+
+def count_entities(text: str) -> dict:
+    """name -> (kind, mentions) for the knowledge graph vocabularies; the first kind wins for shared names"""
+    text = text.lower()
+    counts = {}
+    for kind, pattern in GRAPH_PATTERNS.items():
+        for match in pattern.findall(text):
+            name = canonical_entity(kind, match)
+            if name and counts.get(name, (kind,))[0] == kind:
+                counts[name] = (kind, counts.get(name, (kind, 0))[1] + 1)
+    return counts
+
+
+def generate_document_preview(content: str, title: str = "") -> tuple[str, bool]:
+    """Generate intelligent preview for documents and determine if it's a large document"""
+    
+    # Define thresholds
+    LARGE_DOCUMENT_THRESHOLD = 2000  # characters
+    PREVIEW_LENGTH = 800  # characters for preview
+    
+    content_length = len(content)
+    is_large = content_length > LARGE_DOCUMENT_THRESHOLD
+    
+    if not is_large:
+        # Small document - return full content
+        return content, False
+    
+    # Large document - generate intelligent preview
+    lines = content.split('\n')
+    preview_lines = []
+    char_count = 0
+    
+    # Always include title if provided
+    if title:
+        preview_lines.append(f"Samenvatting van: {title}")
+        preview_lines.append("")
+    
+    # Try to get meaningful content from the beginning
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+            
+        # Skip headers that might be metadata
+        if line.lower().startswith(('auteur:', 'bron:', 'datum:', 'pagina:', 'hoofdstuk:')):
+            continue
+            
+        # Add line if it contributes to understanding
+        if char_count + len(line) <= PREVIEW_LENGTH:
+            preview_lines.append(line)
+            char_count += len(line) + 2  # +2 for \n\n
+        else:
+            # Add partial line and break
+            remaining_chars = PREVIEW_LENGTH - char_count
+            if remaining_chars > 50:  # Only add if meaningful portion remains
+                preview_lines.append(line[:remaining_chars] + "...")
+            break
+    
+    # Add summary footer
+    preview_lines.append("")
+    preview_lines.append(f"[Dit is een preview van een document met {content_length:,} karakters. De volledige inhoud is beschikbaar voor AI verwerking en blog generatie.]")
+    
+    preview = "\n\n".join(preview_lines)
+    
+    return preview, is_large
+
+def generate_oneliner_mock(title: str, content: str) -> str:
+    """Generate a concise one-sentence summary for Make.com automation"""
+    
+    # Simple mock implementation - extract key concepts
+    words = content.lower().split()
+    
+    # Common orthomolecular/health keywords to look for
+    health_keywords = [
+        'vitamine', 'mineralen', 'supplement', 'voeding', 'gezondheid', 
+        'orthomoleculair', 'behandeling', 'therapie', 'preventie',
+        'darm', 'microbioom', 'ontstekingsremming', 'antioxidant',
+        'stress', 'energie', 'immuniteit', 'herstel', 'balans'
+    ]
+    
+    # Find relevant keywords in content
+    found_keywords = [kw for kw in health_keywords if kw in ' '.join(words)][:3]
+    
+    # Generate context-aware one-liner
+    if 'vitamine' in found_keywords or 'mineralen' in found_keywords:
+        return f"Onderzoek naar de rol van vitamines en mineralen bij {title.lower()}, met focus op orthomoleculaire behandelingsmogelijkheden."
+    elif 'darm' in found_keywords or 'microbioom' in found_keywords:
+        return f"Inzichten over darmgezondheid en microbioom in relatie tot {title.lower()}, belangrijk voor holistische gezondheidszorg."
+    elif 'ontstekingsremming' in found_keywords or 'antioxidant' in found_keywords:
+        return f"Evidence voor ontstekingsremmende en antioxidantrijke interventies bij {title.lower()}, geschikt voor natuurgeneeskundige praktijk."
+    elif 'stress' in found_keywords or 'energie' in found_keywords:
+        return f"Natuurlijke strategieën voor stress- en energiemanagement gerelateerd aan {title.lower()}, toepasbaar in orthomoleculaire behandeling."
+    else:
+        # Generic health-focused one-liner
+        return f"Praktische inzichten over {title.lower()} vanuit orthomoleculair perspectief, relevant voor natuurgeneeskundige behandeling en preventie."
+
+def generate_consumer_blog_title_mock(title: str, content: str, seed=None) -> str:
+    """Generate consumer-friendly blog title based on actual document content
+
+    The title is picked at random from the matching options; pass a seed to
+    get the same pick for the same input every time.
+    """
+    import random
+    import re
+    
+    # Extract key concepts, nutrients, and topics from the actual content
+    content_lower = content.lower()
+    
+    # Extract specific nutrients, vitamins, minerals mentioned in content
+    nutrients = []
+    vitamin_pattern = VITAMIN_PATTERN
+    mineral_pattern = MINERAL_PATTERN
+    supplement_pattern = SUPPLEMENT_PATTERN
+    condition_pattern = CONDITION_PATTERN
+    
+    # Find all matches
+    vitamins = re.findall(vitamin_pattern, content_lower)
+    minerals = re.findall(mineral_pattern, content_lower)  
+    supplements = re.findall(supplement_pattern, content_lower)
+    conditions = re.findall(condition_pattern, content_lower)
+    
+    # Also look for food items and health topics
+    foods = []
+    food_patterns = [FOOD_GROUP_PATTERN, FOOD_PATTERN]
+    for pattern in food_patterns:
+        foods.extend(re.findall(pattern, content_lower))
+    
+    # Generate content-specific blog titles based on what's actually in the document
+    blog_options = []
+    
+    # Vitamin-specific titles
+    for vitamin in set(vitamins):
+        if 'vitamine d' in vitamin or 'vitamin d' in vitamin:
+            blog_options.extend([
+                "vitamine D: waarom heb je het nodig?",
+                "hoe optimaliseer je vitamine D natuurlijk",
+                "vitamine D tekort herkennen en aanpakken",
+                "de beste bronnen van vitamine D",
+                "vitamine D en je immuunsysteem"
+            ])
+        elif 'vitamine c' in vitamin or 'vitamin c' in vitamin:
+            blog_options.extend([
+                "vitamine C: meer dan alleen weerstand",
+                "natuurlijke vitamine C bronnen die werken",
+                "hoe veel vitamine C heb je echt nodig?",
+                "vitamine C bij verkoudheid: werkt het?"
+            ])
+        elif 'vitamine b' in vitamin or 'b-complex' in content_lower:
+            blog_options.extend([
+                "B-vitamines: energie uit je voeding",
+                "welke B-vitamines heb je nodig?",
+                "B12 tekort: signalen en oplossingen",
+                "foliumzuur: niet alleen voor zwangere vrouwen"
+            ])
+    
+    # Mineral-specific titles  
+    for mineral in set(minerals):
+        if mineral == 'magnesium':
+            blog_options.extend([
+                "magnesium: het ontspanningsmineraal",
+                "magnesiumtekort herkennen en oplossen",
+                "de beste magnesium supplementen",
+                "magnesium tegen stress en spierkrampen"
+            ])
+        elif mineral == 'ijzer':
+            blog_options.extend([
+                "ijzertekort: meer dan alleen vermoeidheid",
+                "ijzer uit plantaardige bronnen",
+                "hoe verbeter je ijzeropname natuurlijk?",
+                "ijzer en je energieniveau"
+            ])
+        elif mineral == 'zink':
+            blog_options.extend([
+                "zink: het immuunmineraal",
+                "zinktekort herkennen: deze signalen wijzen erop",
+                "de beste natuurlijke zinkbronnen",
+                "zink voor huid, haar en nagels"
+            ])
+        elif mineral == 'calcium':
+            blog_options.extend([
+                "calcium zonder zuivel: kan dat?",
+                "calcium en vitamine D: het perfecte duo",
+                "sterke botten na de menopauze",
+                "calcium uit plantaardige bronnen"
+            ])
+    
+    # Supplement-specific titles
+    for supplement in set(supplements):
+        if 'omega' in supplement:
+            blog_options.extend([
+                "omega-3: waarom vis niet genoeg is",
+                "de beste omega-3 supplementen",
+                "omega-3 voor hersenen en hart",
+                "plantaardige omega-3: wat zijn de opties?"
+            ])
+        elif 'probiotica' in supplement:
+            blog_options.extend([
+                "probiotica: welke stammen werken echt?",
+                "probiotica na antibiotica: zo doe je het",
+                "fermented food vs probiotica supplementen",
+                "probiotica voor een gezonde darm"
+            ])
+        elif 'kurkuma' in supplement:
+            blog_options.extend([
+                "kurkuma: het gouden ontstekingsremmende kruid",
+                "kurkuma supplementen: waar moet je op letten?",
+                "kurkuma in de keuken: zo gebruik je het",
+                "kurkuma en zwarte peper: waarom samen?"
+            ])
+    
+    # Condition-specific titles
+    for condition in set(conditions):
+        if condition in ['diabetes', 'bloedsuiker']:
+            blog_options.extend([
+                "bloedsuiker stabiliseren met voeding",
+                "natuurlijke diabeteszorg: wat helpt?",
+                "suikervrije snacks die echt lekker zijn",
+                "insulineresistentie omkeren met voeding"
+            ])
+        elif condition in ['hypertensie', 'hoge bloeddruk']:
+            blog_options.extend([
+                "bloeddruk verlagen zonder medicijnen",
+                "zout verminderen: praktische tips",
+                "kalium: het vergeten mineraal voor je hart",
+                "natuurlijke bloeddrukverlagende voeding"
+            ])
+        elif condition == 'cholesterol':
+            blog_options.extend([
+                "cholesterol verlagen met deze voedingsmiddelen",
+                "goed vs slecht cholesterol: wat is het verschil?",
+                "cholesterolvrije voeding: myt of waarheid?",
+                "natuurlijke cholesterolverlaging: zo werkt het"
+            ])
+        elif condition in ['artritis', 'gewrichtspijn']:
+            blog_options.extend([
+                "ontstekingsremmende voeding bij artritis",
+                "gewrichtspijn verlichting uit je keuken",
+                "voedingsmiddelen die ontstekingen verergeren",
+                "natuurlijke gewrichtsverzorging"
+            ])
+    
+    # Food-specific titles
+    for food in set(foods):
+        if food in ['vis', 'zalm', 'sardines']:
+            blog_options.extend([
+                "vette vis: waarom 2x per week niet genoeg is",
+                "duurzame visoliën: waar moet je op letten?",
+                "vis eten met kwik: hoe minimaliseer je risico's?",
+                "de beste vissoorten voor omega-3"
+            ])
+        elif food in ['noten', 'walnoten']:
+            blog_options.extend([
+                "noten: de gezondste snack voor je brein",
+                "welke noten zijn het gezondst?",
+                "notenschillen: weg ermee of laten zitten?",
+                "noten en gewichtsbeheersing: past dat samen?"
+            ])
+    
+    # If document mentions metabolism/energy
+    if any(word in content_lower for word in ['metabolisme', 'stofwisseling', 'energieproductie', 'mitochondriën']):
+        blog_options.extend([
+            "je metabolisme aanjagen: natuurlijke methoden",
+            "mitochondriën: de energiefabrieken van je cellen",
+            "stofwisseling verbeteren na je 40e",
+            "energie krijgen uit je voeding: zo werkt het"
+        ])
+    
+    # If document mentions digestion
+    if any(word in content_lower for word in ['spijsvertering', 'darmgezondheid', 'microbioom']):
+        blog_options.extend([
+            "spijsvertering optimaliseren: praktische tips",
+            "microbioom herstellen na antibiotica",
+            "darmgezondheid en je immuunsysteem",
+            "fermented foods: de natuurlijke probiotica"
+        ])
+    
+    # If document mentions hormones
+    if any(word in content_lower for word in ['hormonen', 'oestrogeen', 'testosteron', 'cortisol', 'insuline', 'schildklier']):
+        blog_options.extend([
+            "hormonen balanceren met voeding",
+            "schildklierfunctie ondersteunen natuurlijk",
+            "stress hormonen verlagen: voedingstips",
+            "hormonen en gewichtstoename: het verband"
+        ])
+    
+    # If no specific content matches found, use document title for inspiration
+    if not blog_options:
+        title_words = title.lower().split()
+        if any(word in title_words for word in ['advanced', 'nutrition', 'metabolisme', 'voeding']):
+            blog_options = [
+                "voeding en metabolisme: de basis uitgelegd",
+                "advanced nutrition: wat betekent dat voor jou?",
+                "wetenschappelijk bewezen voedingstips",
+                "voedingsleer voor de praktijk"
+            ]
+        else:
+            # Fallback generic options
+            blog_options = [
+                "orthomoleculaire voeding: waar begin je?",
+                "natuurlijke gezondheid: de basis principes",
+                "voedingssupplementen: wat werkt echt?",
+                "preventieve gezondheidszorg met voeding"
+            ]
+    
+    # Return random option from the content-specific options
+    return (random.Random(seed) if seed is not None else random).choice(blog_options)
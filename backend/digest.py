@@ -0,0 +1,299 @@
+"""Knowledge digest of supplements, vitamins, minerals and herbs for advice prompts.
+
+For every entity recognized by the vocabularies in derivations.py the digest
+keeps, across the archive:
+- the passages that discuss it most (ranked by mentions, with a boost for
+  documents in the supplement/kruiden categories or tagged with the entity);
+- dosing sentences (the entity next to an amount such as "300 mg");
+- contraindication sentences (interactions, pregnancy, side effects, ...).
+
+It is built in the background and follows the event outbox like the search
+index, re-analyzing only the documents that changed. The advice endpoint
+looks up the entities named in the question (dict lookups) and assembles a
+context block that fits ``ADVICE_CONTEXT_TOKENS``, taking items round-robin
+so every entity gets its best passage before any gets a second one.
+"""
+import heapq
+import os
+import re
+import threading
+from collections import Counter
+from typing import Iterable, List, Optional
+
+import events
+from derivations import extract_entities
+
+ADVICE_CONTEXT_TOKENS = int(os.environ.get('ADVICE_CONTEXT_TOKENS', '1200'))
+DIGEST_ITEMS_PER_ENTITY = int(os.environ.get('DIGEST_ITEMS_PER_ENTITY', '6'))
+DIGEST_MAX_ENTITIES = 4
+CHUNK_CHARS = 400
+
+SUPPLEMENT_CATEGORIES = {"supplement", "kruiden"}
+SUPPLEMENT_TAGS = {"supplement", "kruiden", "gemmo"}
+
+PROJECTION = {"_id": 0, "id": 1, "title": 1, "content": 1, "content_external": 1, "category": 1,
+              "tags": 1, "created_at": 1, "updated_at": 1}
+
+_PARAGRAPH = re.compile(r'\n\s*\n')
+_SENTENCE = re.compile(r'(?<=[.!?])\s+')
+DOSE = re.compile(r'\b\d+(?:[.,]\d+)?\s*(?:mg|mcg|µg|ug|microgram|milligram|gram|g|ie|iu|ml|druppels?|capsules?|tabletten?)\b', re.IGNORECASE)
+CONTRAINDICATION = re.compile(
+    r'\b(contra-?indicatie\w*|niet (?:gebruiken|combineren|geschikt)|interactie\w*|wisselwerking\w*|zwanger\w*|'
+    r'borstvoeding|bloedverdun\w*|anticoagul\w*|voorzichtig\w*|bijwerking\w*|nierfunctie\w*|overdoser\w*|allergi\w*)\b',
+    re.IGNORECASE,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for Dutch text)"""
+    return len(text) // 4 + 1
+
+
+def chunks(content: str) -> List[str]:
+    """Paragraphs, with long ones cut into ~CHUNK_CHARS windows at sentence boundaries"""
+    result = []
+    for paragraph in _PARAGRAPH.split(content or ''):
+        paragraph = ' '.join(paragraph.split())
+        if not paragraph:
+            continue
+        current = ''
+        for sentence in _SENTENCE.split(paragraph):
+            if current and len(current) + len(sentence) > CHUNK_CHARS:
+                result.append(current)
+                current = ''
+            current = f"{current} {sentence}".strip()
+        if current:
+            result.append(current[:CHUNK_CHARS * 2])
+    return result
+
+
+class Item:
+    __slots__ = ("score", "document_id", "title", "text")
+
+    def __init__(self, score: float, document_id: str, title: str, text: str):
+        self.score = score
+        self.document_id = document_id
+        self.title = title
+        self.text = text
+
+    def as_dict(self) -> dict:
+        return {"text": self.text, "document_id": self.document_id, "title": self.title}
+
+
+def analyze(doc: dict) -> dict:
+    """name -> (kind, passages, dosing, contraindications) for the entities of one document"""
+    title = doc.get('title') or ''
+    tags = {tag.lower() for tag in doc.get('tags') or []}
+    boost = 2 if doc.get('category') in SUPPLEMENT_CATEGORIES or tags & SUPPLEMENT_TAGS else 0
+    title_entities = {name for _, name in extract_entities(title)}
+
+    found = {}
+    for chunk in chunks(doc.get('content')):
+        lowered = chunk.lower()
+        entities = extract_entities(chunk)
+        if not entities:
+            continue
+        # Sentences with an amount or a warning, and the entities they name
+        facts = []
+        for sentence in _SENTENCE.split(chunk):
+            dose, warning = DOSE.search(sentence), CONTRAINDICATION.search(sentence)
+            if dose or warning:
+                facts.append((sentence, bool(dose), bool(warning), {name for _, name in extract_entities(sentence)}))
+        for kind, name in entities:
+            relevance = boost + (1 if name in title_entities or name in tags else 0)
+            _, passages, dosing, warnings = found.setdefault(name, (kind, [], [], []))
+            passages.append(Item(max(1, lowered.count(name)) + relevance, doc['id'], title, chunk))
+            for sentence, dose, warning, names in facts:
+                if name in names:
+                    if dose:
+                        dosing.append(Item(1 + relevance, doc['id'], title, sentence))
+                    if warning:
+                        warnings.append(Item(1 + relevance, doc['id'], title, sentence))
+    # Keep the best few per document; the ranking across documents happens per entity
+    return {
+        name: (kind, *(heapq.nlargest(2, items, key=lambda item: item.score) for items in (passages, dosing, warnings)))
+        for name, (kind, passages, dosing, warnings) in found.items()
+    }
+
+
+class EntityDigest:
+    __slots__ = ("kind", "name", "by_document", "_ranked")
+
+    def __init__(self, kind: str, name: str):
+        self.kind = kind
+        self.name = name
+        self.by_document = {}  # document id -> (passages, dosing, contraindications)
+        self._ranked = None
+
+    def ranked(self) -> dict:
+        """Best items across documents; computed once per change of the entity
+
+        Call with the digest's lock held: ``Digest.add`` changes ``by_document``
+        and resets the ranking from a worker thread.
+        """
+        if self._ranked is None:
+            columns = list(zip(*self.by_document.values())) or [(), (), ()]
+            self._ranked = {
+                field: heapq.nlargest(DIGEST_ITEMS_PER_ENTITY, (item for items in column for item in items),
+                                      key=lambda item: item.score)
+                for field, column in zip(("passages", "dosing", "contraindications"), columns)
+            }
+        return self._ranked
+
+    def as_dict(self) -> dict:
+        ranked = self.ranked()
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "documents": len(self.by_document),
+            **{field: [item.as_dict() for item in items] for field, items in ranked.items()},
+        }
+
+
+class Digest:
+    def __init__(self):
+        self.entities = {}       # name -> EntityDigest
+        self.contributions = {}  # document id -> names
+        self.documents = {}      # document id -> source stamp {id, title, updated_at}
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entities)
+
+    def add(self, doc: dict):
+        analysis = analyze(doc)
+        with self._lock:
+            self._remove(doc['id'])
+            for name, (kind, *parts) in analysis.items():
+                entry = self.entities.get(name)
+                if entry is None:
+                    entry = self.entities[name] = EntityDigest(kind, name)
+                entry.by_document[doc['id']] = tuple(parts)
+                entry._ranked = None
+            if analysis:
+                self.contributions[doc['id']] = list(analysis)
+                self.documents[doc['id']] = {
+                    "id": doc['id'],
+                    "title": doc.get('title'),
+                    "updated_at": doc.get('updated_at') or doc.get('created_at'),
+                }
+
+    def add_many(self, docs):
+        for doc in docs:
+            self.add(doc)
+
+    def remove(self, document_id: str):
+        with self._lock:
+            self._remove(document_id)
+
+    def _remove(self, document_id: str):
+        self.documents.pop(document_id, None)
+        for name in self.contributions.pop(document_id, ()):
+            entry = self.entities.get(name)
+            if entry is None:
+                continue
+            entry.by_document.pop(document_id, None)
+            entry._ranked = None
+            if not entry.by_document:
+                del self.entities[name]
+
+    def entry(self, name: str) -> Optional[EntityDigest]:
+        return self.entities.get(name)
+
+    def describe(self, name: str) -> Optional[dict]:
+        """An entity's digest as a dict; ranks under the lock, like assemble"""
+        with self._lock:
+            entry = self.entities.get(name)
+            return entry.as_dict() if entry else None
+
+    def entities_of(self, document_ids: Iterable[str]) -> Counter:
+        counts = Counter()
+        for document_id in document_ids:
+            counts.update(self.contributions.get(document_id, ()))
+        return counts
+
+    def assemble(self, names: List[str], budget_tokens: int):
+        """(context text, source documents) for the entities, within the token budget"""
+        with self._lock:
+            entries = [self.entities[name] for name in names if name in self.entities]
+            queues = []
+            for entry in entries:
+                ranked = entry.ranked()
+                # Best passage, dose and warning first, then the next of each
+                queue = []
+                for i in range(DIGEST_ITEMS_PER_ENTITY):
+                    for label, field in (("", "passages"), ("Dosering: ", "dosing"), ("Let op: ", "contraindications")):
+                        if i < len(ranked[field]):
+                            queue.append((label, ranked[field][i]))
+                queues.append(queue)
+
+            sections = {entry.name: [] for entry in entries}
+            seen, sources = [], {}
+            used = sum(estimate_tokens(f"{entry.name} ({entry.kind}):") for entry in entries)
+            for i in range(max((len(queue) for queue in queues), default=0)):
+                for entry, queue in zip(entries, queues):
+                    if i >= len(queue):
+                        continue
+                    label, item = queue[i]
+                    line = f"- {label}{item.text} [{item.title}]"
+                    cost = estimate_tokens(line)
+                    # Skip a sentence already quoted as part of a chosen passage
+                    if any(item.text in quoted for quoted in seen) or used + cost > budget_tokens:
+                        continue
+                    seen.append(item.text)
+                    used += cost
+                    sections[entry.name].append(line)
+                    sources[item.document_id] = self.documents[item.document_id]
+
+        text = "\n".join(
+            f"{entry.name} ({entry.kind}):\n" + "\n".join(sections[entry.name])
+            for entry in entries if sections[entry.name]
+        )
+        return text, list(sources.values())
+
+
+def excerpt_context(docs: List[dict], budget_tokens: int, excerpt_chars: int = 300) -> str:
+    """Title and excerpt lines of documents, within the token budget"""
+    lines, used = [], 0
+    for doc in docs:
+        line = f"- {doc['title']}: {doc['content'][:excerpt_chars]}..."
+        if used + estimate_tokens(line) > budget_tokens:
+            break
+        used += estimate_tokens(line)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def entities_in(text: str) -> List[str]:
+    """Entity names mentioned in text, in order of appearance"""
+    lowered = text.lower()
+    return [name for _, name in sorted(extract_entities(text), key=lambda entity: lowered.find(entity[1]))]
+
+
+follower = events.Follower("Knowledge digest", Digest, PROJECTION, unit="entities", batch_size=200)
+build, update, sync, maintain = follower.build, follower.update, follower.sync, follower.maintain
+
+
+def is_ready() -> bool:
+    return follower.index.ready
+
+
+def context_for(question: str, related_document_ids: Iterable[str] = (), budget_tokens: int = ADVICE_CONTEXT_TOKENS):
+    """(context text, source documents) for an advice question, or None when no known entity applies
+
+    Entities named in the question come first; without any, the entities most
+    mentioned in the related documents (e.g. search hits for the question) are used.
+    """
+    index = follower.index
+    names = [name for name in entities_in(question) if index.entry(name)]
+    if not names:
+        names = [name for name, _ in index.entities_of(related_document_ids).most_common(DIGEST_MAX_ENTITIES)]
+    if not names:
+        return None
+    text, sources = index.assemble(names[:DIGEST_MAX_ENTITIES], budget_tokens)
+    return (text, sources) if text else None
+
+
+def lookup(name: str) -> Optional[dict]:
+    return follower.index.describe(' '.join(name.lower().split()))
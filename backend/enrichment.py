@@ -0,0 +1,193 @@
+"""Incremental re-enrichment of edited documents.
+
+Content is split into paragraph-aligned chunks whose hashes are stored on the
+document (``chunk_hashes``). When a document is edited, the old and new chunk
+lists are diffed to decide which derived fields are actually affected:
+
+- local fields (preview, large-document flag, one-liner, references from the
+  citation parser) are always cheap and are recomputed whenever the content
+  or title changed;
+- AI tags only read the title and the first ``TAGS_WINDOW`` characters, so
+  they are only refreshed when the edit touches that window;
+- edits that change less than ``ENRICH_TRIVIAL_CHANGE_RATIO`` of the text
+  (typo fixes, whitespace) never trigger LLM calls. The changed text is the
+  span between the common prefix and the common suffix of the old and new
+  content, measured against the length of the document; the changed chunks
+  only say where that span is.
+
+For backfills, ``build_batch_prompt``/``parse_batch_response`` pack several
+documents into one JSON-answering prompt (see batch_enrich.py).
+"""
+import difflib
+import hashlib
+import json
+import os
+import re
+from typing import List, Optional
+
+CHUNK_TARGET_CHARS = int(os.environ.get('CHUNK_TARGET_CHARS', '1500'))
+ENRICH_TRIVIAL_CHANGE_RATIO = float(os.environ.get('ENRICH_TRIVIAL_CHANGE_RATIO', '0.05'))
+
+# Characters of content read by the tag and (fallback) reference prompts in server.py
+TAGS_WINDOW = 1000
+REFERENCES_WINDOW = 2000
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def chunk_content(content: str, target_chars: int = CHUNK_TARGET_CHARS) -> List[str]:
+    """Split content into chunks of whole paragraphs of roughly `target_chars`"""
+    chunks = []
+    current = []
+    size = 0
+    for paragraph in re.split(r'\n\s*\n', content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and size + len(paragraph) > target_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def chunk_hashes(content: str) -> List[str]:
+    """Whitespace-insensitive hashes of the chunks of a document"""
+    return [
+        hashlib.sha1(_WHITESPACE.sub(' ', chunk).encode('utf-8')).hexdigest()[:16]
+        for chunk in chunk_content(content)
+    ]
+
+
+def first_difference(old: str, new: str) -> int:
+    """Offset of the first differing character (length of the common prefix)"""
+    limit = min(len(old), len(new))
+    step = 4096
+    offset = 0
+    # Compare whole blocks at C speed, then scan the first differing block
+    while offset < limit and old[offset:offset + step] == new[offset:offset + step]:
+        offset += step
+    for i in range(offset, min(limit, offset + step)):
+        if old[i] != new[i]:
+            return i
+    return limit
+
+
+def common_suffix(old: str, new: str, limit: int) -> int:
+    """Length of the common suffix, at most `limit` characters"""
+    step = 4096
+    size = 0
+    while size + step <= limit and old[len(old) - size - step:len(old) - size] == new[len(new) - size - step:len(new) - size]:
+        size += step
+    while size < limit and old[len(old) - size - 1] == new[len(new) - size - 1]:
+        size += 1
+    return size
+
+
+def changed_chars(old: str, new: str) -> int:
+    """Characters between the common prefix and suffix of the longer text"""
+    prefix = first_difference(old, new)
+    suffix = common_suffix(old, new, min(len(old), len(new)) - prefix)
+    return max(len(old), len(new)) - prefix - suffix
+
+
+def plan(old_content: str, new_content: str, old_hashes: Optional[List[str]] = None,
+         title_changed: bool = False) -> dict:
+    """Decide which derived fields an edit affects"""
+    new_hashes = chunk_hashes(new_content)
+    if old_hashes is None:
+        old_hashes = chunk_hashes(old_content)
+
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    changed_chunks = []
+    for tag, _, _, j1, j2 in matcher.get_opcodes():
+        if tag in ('replace', 'insert'):
+            changed_chunks.extend(range(j1, j2))
+
+    content_changed = old_hashes != new_hashes
+    changed_ratio = 0.0
+    if content_changed:
+        changed_ratio = changed_chars(old_content, new_content) / max(len(old_content), len(new_content), 1)
+    trivial = changed_ratio < ENRICH_TRIVIAL_CHANGE_RATIO
+    first_change = first_difference(old_content, new_content) if content_changed else len(new_content)
+
+    return {
+        "changed": content_changed or title_changed,
+        "changed_ratio": round(changed_ratio, 4),
+        "changed_chunks": changed_chunks,
+        "chunk_hashes": new_hashes,
+        "trivial": trivial and not title_changed,
+        "refresh_tags": title_changed or (content_changed and not trivial and first_change < TAGS_WINDOW),
+        "refresh_references": content_changed,
+    }
+
+
+# Batch enrichment: several documents per LLM call with structured JSON output
+
+BATCH_EXCERPT_CHARS = REFERENCES_WINDOW
+MAX_TAGS = 7
+MAX_REFERENCES = 10
+
+
+def build_batch_prompt(docs: List[dict]) -> str:
+    """One prompt asking for tags and references of several documents as JSON"""
+    sections = []
+    for doc in docs:
+        sections.append(
+            f"### DOCUMENT {doc['id']}\n"
+            f"Titel: {doc['title']}\n"
+            f"Inhoud: {doc['content'][:BATCH_EXCERPT_CHARS]}..."
+        )
+    documents = "\n\n".join(sections)
+    return f"""Analyseer de volgende {len(docs)} documenten. Geef voor elk document:
+- "tags": 3-7 relevante tags in het Nederlands (hoofdonderwerpen, supplementen/kruiden, aandoeningen/symptomen, therapeutische categorieën)
+- "references": alle referenties, bronnen, studies of citaten in de tekst (maximaal 10, lege lijst als er geen zijn)
+
+{documents}
+
+Antwoord ALLEEN met geldige JSON in dit formaat, zonder uitleg:
+{{"documents": [{{"id": "<document id>", "tags": ["tag1", "tag2"], "references": ["Auteur (jaar) - Titel"]}}]}}"""
+
+
+def _clean_strings(values, limit: int) -> Optional[List[str]]:
+    if not isinstance(values, list):
+        return None
+    cleaned = []
+    for value in values:
+        if not isinstance(value, str):
+            return None
+        value = value.strip().lstrip('-').strip()
+        if value and value.upper() != "GEEN" and value not in cleaned:
+            cleaned.append(value)
+    return cleaned[:limit]
+
+
+def parse_batch_response(response: str, expected_ids: List[str]) -> dict:
+    """Validated {id: {"tags": [...], "references": [...]}} for the documents the model answered"""
+    start = response.find('{')
+    end = response.rfind('}')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        payload = json.loads(response[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+
+    items = payload.get('documents') if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        return {}
+
+    expected = set(expected_ids)
+    results = {}
+    for item in items:
+        if not isinstance(item, dict) or item.get('id') not in expected:
+            continue
+        tags = _clean_strings(item.get('tags'), MAX_TAGS)
+        references = _clean_strings(item.get('references', []), MAX_REFERENCES)
+        if not tags or references is None:
+            continue
+        results[item['id']] = {"tags": tags, "references": references}
+    return results
@@ -0,0 +1,352 @@
+"""Outbound change events: outbox collection, cursor feed and webhook delivery.
+
+Every document write recorded through ``server.on_document_write`` appends an
+event (``document.created``, ``document.updated``, ``document.deleted`` or
+``blog.created``) to the ``events`` outbox with a monotonically increasing
+``seq``. Consumers either pull ``/api/events?after=<seq>`` or receive batches
+posted to the URLs in ``WEBHOOK_URLS`` by an async dispatcher. ``Follower``
+keeps a worker's in-process indexes (search, suggestions, digest) current from
+the same outbox.
+
+A seq is taken and written in the same insert: the next number after the
+newest event, guarded by the unique index on ``seq``. A writer that loses the
+race to another worker gets a duplicate key error and retries with the number
+after the winner's, which is then already visible. So seq N+1 can only be
+committed after seq N, and a reader's ``after=`` cursor never skips an event
+that shows up later. The ``counters`` row keeps the highest seq written, so
+numbering continues when every event has expired.
+
+Delivery is at-least-once and in order per webhook: a webhook's cursor only
+advances after a 2xx response, failed batches are retried with capped
+exponential backoff, and a retried batch is resent with the same
+``Idempotency-Key`` header (every event also carries its own ``id``). A lease
+on the cursor keeps several uvicorn workers from posting the same batch
+concurrently. Set ``WEBHOOK_SECRET`` to sign bodies (``X-Webhook-Signature``,
+HMAC-SHA256). webhook_receiver.py is a local receiver for testing.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import mongo
+
+WEBHOOK_URLS = [url.strip() for url in os.environ.get('WEBHOOK_URLS', '').split(',') if url.strip()]
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '50'))
+WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get('WEBHOOK_TIMEOUT_SECONDS', '10'))
+WEBHOOK_POLL_SECONDS = float(os.environ.get('WEBHOOK_POLL_SECONDS', '5'))
+WEBHOOK_BACKOFF_SECONDS = float(os.environ.get('WEBHOOK_BACKOFF_SECONDS', '2'))
+WEBHOOK_MAX_BACKOFF_SECONDS = float(os.environ.get('WEBHOOK_MAX_BACKOFF_SECONDS', '600'))
+EVENTS_RETENTION_DAYS = int(os.environ.get('EVENTS_RETENTION_DAYS', '30'))
+
+EVENTS_COLLECTION = 'events'
+COUNTERS_COLLECTION = 'counters'
+CURSORS_COLLECTION = 'webhook_cursors'
+
+EVENT_TYPES = ("document.created", "document.updated", "document.deleted", "blog.created")
+
+# Document fields included in event payloads (bodies are fetched via the API)
+PAYLOAD_FIELDS = ("id", "title", "category", "file_type", "tags", "one_liner",
+                  "consumer_blog_title", "created_at", "updated_at")
+
+_LEASE_SECONDS = 60
+_owner = str(uuid.uuid4())
+_wakeup = asyncio.Event()
+
+
+def event_type(before: Optional[dict], after: Optional[dict]) -> Optional[str]:
+    if before is None and after is None:
+        return None
+    if after is None:
+        return "document.deleted"
+    if before is None:
+        return "blog.created" if after.get('file_type') == 'blog_article' else "document.created"
+    return "document.updated"
+
+
+def _payload(before: Optional[dict], after: Optional[dict]) -> dict:
+    source = after if after is not None else before
+    data = {field: source.get(field) for field in PAYLOAD_FIELDS if field in source}
+    if before is not None and after is not None:
+        data["changed_fields"] = sorted(
+            field for field in set(before) | set(after)
+            if field not in ("_id", "updated_at") and before.get(field) != after.get(field)
+        )
+    return data
+
+
+async def ensure_indexes(db):
+    await db[EVENTS_COLLECTION].create_index("seq", unique=True)
+    await mongo.ensure_ttl_index(db, EVENTS_COLLECTION, "recorded_at", EVENTS_RETENTION_DAYS * 86400)
+
+
+async def record(db, document_id: str, before: Optional[dict] = None, after: Optional[dict] = None) -> Optional[int]:
+    """Append the event for a document write to the outbox; returns its seq"""
+    kind = event_type(before, after)
+    if kind is None:
+        return None
+    now = datetime.now(timezone.utc)
+    event = {
+        "id": str(uuid.uuid4()),
+        "type": kind,
+        "document_id": document_id,
+        "occurred_at": now.isoformat(),
+        "recorded_at": now,
+        "data": _payload(before, after),
+    }
+    while True:
+        seq = await latest_seq(db) + 1
+        try:
+            await db[EVENTS_COLLECTION].insert_one({"seq": seq, **event})
+            break
+        except DuplicateKeyError:
+            continue  # another writer took this seq; the next read sees it
+    await db[COUNTERS_COLLECTION].update_one({"_id": EVENTS_COLLECTION}, {"$max": {"seq": seq}}, upsert=True)
+    _wakeup.set()
+    return seq
+
+
+def _public(event: dict) -> dict:
+    return {key: value for key, value in event.items() if key not in ("_id", "recorded_at")}
+
+
+async def read(db, after: int = 0, limit: int = 100, types: Optional[List[str]] = None) -> dict:
+    """Events with seq > `after`, oldest first, and the cursor to continue from"""
+    query = {"seq": {"$gt": after}}
+    if types:
+        query["type"] = {"$in": types}
+    rows = await db[EVENTS_COLLECTION].find(query).sort("seq", 1).limit(limit + 1).to_list(limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "events": [_public(row) for row in rows],
+        "next_cursor": rows[-1]["seq"] if rows else after,
+        "has_more": has_more,
+    }
+
+
+# In-process indexes
+
+class Follower:
+    """An in-process index built from the documents collection and kept current from the outbox
+
+    ``new_index`` makes an empty index with ``add``, ``add_many``, ``remove``
+    and a ``ready`` flag; ``projection`` is what its documents need. With
+    ``full`` set, external bodies are loaded before a document is added.
+
+    This worker's own writes are applied inline by ``update`` with the seq of
+    their event, and ``sync`` skips those events instead of indexing the same
+    write a second time.
+    """
+
+    def __init__(self, name: str, new_index, projection: dict, unit: str = "entries",
+                 full: bool = True, batch_size: int = 500, interval: float = 5):
+        self.name = name
+        self.new_index = new_index
+        self.projection = projection
+        self.unit = unit
+        self.full = full
+        self.batch_size = batch_size
+        self.interval = interval
+        self.index = new_index()
+        self.synced_seq = 0
+        self.builds = 0
+        self._applied = set()  # seqs of local writes already applied, above synced_seq
+
+    async def build(self, db):
+        """Build a fresh index from the documents collection and swap it in"""
+        import bodies
+
+        started = time.perf_counter()
+        seq = await latest_seq(db)
+        fresh = self.new_index()
+        async for batch in bodies.batches(db, self.projection, self.batch_size, full=self.full):
+            await asyncio.to_thread(fresh.add_many, batch)
+        fresh.ready = True
+        self.index, self.synced_seq = fresh, seq
+        self._applied = {applied for applied in self._applied if applied > seq}
+        self.builds += 1
+        logging.info(f"{self.name} built: {len(fresh)} {self.unit} in {time.perf_counter() - started:.1f}s")
+        return fresh
+
+    async def update(self, db, document_id: str, after: Optional[dict], seq: Optional[int] = None):
+        """Apply one document write to this worker's index; `seq` is its outbox event, if recorded"""
+        import bodies
+
+        if not self.index.ready:
+            return
+        if seq is not None and seq > self.synced_seq:
+            self._applied.add(seq)
+        if after is None:
+            self.index.remove(document_id)
+            return
+        if self.full:
+            after = await bodies.hydrate(db, after)
+        await asyncio.to_thread(self.index.add, after)
+
+    async def sync(self, db):
+        """Apply writes recorded in the outbox since the last build or sync (other workers included)"""
+        while True:
+            page = await read(db, after=self.synced_seq, limit=500)
+            for event in page["events"]:
+                if event["seq"] in self._applied:
+                    continue
+                doc = None
+                if event["type"] != "document.deleted":
+                    doc = await db.documents.find_one({"id": event["document_id"]}, self.projection)
+                    if doc is None:
+                        continue  # deleted since; its own event follows
+                await self.update(db, event["document_id"], doc)
+            self.synced_seq = page["next_cursor"]
+            self._applied = {seq for seq in self._applied if seq > self.synced_seq}
+            if not page["has_more"]:
+                return
+
+    async def maintain(self, db):
+        """Background task: build the index, then follow the outbox"""
+        try:
+            await self.build(db)
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.sync(db)
+                except Exception as e:
+                    logging.error(f"{self.name} sync error: {str(e)}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"{self.name} build failed: {str(e)}")
+
+
+# Webhook delivery
+
+def _cursor_id(url: str) -> str:
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:24]
+
+
+def sign(body: bytes) -> str:
+    return "sha256=" + hmac.new(WEBHOOK_SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Capped exponential backoff with jitter for the n-th consecutive failure"""
+    delay = min(WEBHOOK_MAX_BACKOFF_SECONDS, WEBHOOK_BACKOFF_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def _acquire(db, url: str) -> Optional[dict]:
+    """Lease the webhook cursor for this process, or None when another worker holds it or it is backing off"""
+    now = datetime.now(timezone.utc)
+    # New webhooks start at the current end of the outbox instead of replaying history
+    await db[CURSORS_COLLECTION].update_one(
+        {"_id": _cursor_id(url)},
+        {"$setOnInsert": {"url": url, "last_seq": await latest_seq(db), "attempts": 0,
+                          "retry_at": now, "lease_until": now, "lease_owner": None}},
+        upsert=True,
+    )
+    return await db[CURSORS_COLLECTION].find_one_and_update(
+        {"_id": _cursor_id(url), "retry_at": {"$lte": now},
+         "$or": [{"lease_until": {"$lte": now}}, {"lease_owner": _owner}]},
+        {"$set": {"lease_owner": _owner, "lease_until": now + timedelta(seconds=_LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def latest_seq(db) -> int:
+    """Highest seq written: the newest event, or the counter once every event has expired"""
+    latest = await db[EVENTS_COLLECTION].find_one({}, {"seq": 1}, sort=[("seq", -1)])
+    if latest:
+        return latest["seq"]
+    counter = await db[COUNTERS_COLLECTION].find_one({"_id": EVENTS_COLLECTION})
+    return counter["seq"] if counter else 0
+
+
+async def deliver(db, http, url: str) -> int:
+    """Post the next batch of events to one webhook; returns the number delivered"""
+    cursor = await _acquire(db, url)
+    if cursor is None:
+        return 0
+
+    # A batch that failed before is resent unchanged, so its idempotency key stays valid
+    pending_until = cursor.get("pending_until")
+    query = {"seq": {"$gt": cursor["last_seq"]}}
+    if pending_until:
+        query["seq"]["$lte"] = pending_until
+    rows = await db[EVENTS_COLLECTION].find(query).sort("seq", 1).limit(WEBHOOK_BATCH_SIZE).to_list(WEBHOOK_BATCH_SIZE)
+    if not rows:
+        await db[CURSORS_COLLECTION].update_one({"_id": cursor["_id"]}, {"$set": {"lease_until": datetime.now(timezone.utc)}})
+        return 0
+
+    first_seq, last_seq = rows[0]["seq"], rows[-1]["seq"]
+    idempotency_key = f"{cursor['_id']}:{first_seq}-{last_seq}"
+    body = json.dumps({"events": [_public(row) for row in rows]}, ensure_ascii=False).encode('utf-8')
+    headers = {"Content-Type": "application/json", "Idempotency-Key": idempotency_key}
+    if WEBHOOK_SECRET:
+        headers["X-Webhook-Signature"] = sign(body)
+
+    now = datetime.now(timezone.utc)
+    try:
+        response = await http.post(url, content=body, headers=headers, timeout=WEBHOOK_TIMEOUT_SECONDS)
+        response.raise_for_status()
+    except Exception as e:
+        attempts = cursor.get("attempts", 0) + 1
+        delay = backoff_seconds(attempts)
+        logging.error(f"Webhook delivery to {url} failed (attempt {attempts}, retry in {delay:.0f}s): {str(e)}")
+        await db[CURSORS_COLLECTION].update_one({"_id": cursor["_id"]}, {"$set": {
+            "attempts": attempts, "pending_until": last_seq, "last_error": str(e),
+            "retry_at": now + timedelta(seconds=delay), "lease_until": now,
+        }})
+        return 0
+
+    await db[CURSORS_COLLECTION].update_one({"_id": cursor["_id"]}, {
+        "$set": {"last_seq": last_seq, "attempts": 0, "retry_at": now, "lease_until": now,
+                 "last_delivered_at": now.isoformat()},
+        "$unset": {"pending_until": "", "last_error": ""},
+    })
+    return len(rows)
+
+
+async def dispatch(db):
+    """Background task: deliver outbox events to all configured webhooks"""
+    import httpx
+
+    logging.info(f"Webhook dispatcher started for {len(WEBHOOK_URLS)} URL(s)")
+    async with httpx.AsyncClient() as http:
+        while True:
+            try:
+                _wakeup.clear()
+                delivered = 0
+                for url in WEBHOOK_URLS:
+                    delivered += await deliver(db, http, url)
+                if delivered:
+                    continue  # drain the backlog before waiting
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=WEBHOOK_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Webhook dispatcher error: {str(e)}")
+                await asyncio.sleep(WEBHOOK_POLL_SECONDS)
+
+
+async def webhook_status(db) -> List[dict]:
+    rows = await db[CURSORS_COLLECTION].find(
+        {"url": {"$in": WEBHOOK_URLS}}, {"_id": 0, "lease_owner": 0}
+    ).to_list(None)
+    latest = await latest_seq(db)
+    for row in rows:
+        row["lag"] = latest - row["last_seq"]
+    return rows
@@ -0,0 +1,185 @@
+"""Shared cache for LLM generations (treatment plans, supplement advice).
+
+A generation is stored in the ``generation_cache`` collection under a key
+made of the endpoint, its request fields after normalization (case, accents
+and whitespace do not matter), the model and a knowledge-base version. The
+knowledge-base version is a hash of the id and last update of every document
+that went into the prompt, so advice is generated again as soon as one of its
+source documents changes, while edits elsewhere in the archive keep it cached.
+Prompts that use no documents have a fixed version.
+
+Entries expire after ``GENERATION_CACHE_TTL_HOURS`` (a Mongo TTL index, also
+checked on read). Callers can bypass the cache (neither read nor stored) or
+refresh it (generate and replace the entry). Identical requests that arrive
+while a generation is running wait for that one instead of calling the model
+again.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Iterable, Optional
+
+import mongo
+
+GENERATION_CACHE_ENABLED = os.environ.get('GENERATION_CACHE_ENABLED', '1') == '1'
+GENERATION_CACHE_TTL_HOURS = float(os.environ.get('GENERATION_CACHE_TTL_HOURS', '168'))
+
+GENERATIONS_COLLECTION = "generation_cache"
+
+# Bump when the prompts in server.py change, so older generations are not served
+PROMPT_VERSION = 2
+
+NO_DOCUMENTS = "none"
+
+_metrics = Counter()
+_inflight = {}
+
+
+def normalize(value: str) -> str:
+    """Lowercase, accent-folded text with whitespace collapsed"""
+    folded = unicodedata.normalize('NFKD', value or '')
+    folded = ''.join(c for c in folded if not unicodedata.combining(c))
+    return ' '.join(folded.casefold().split())
+
+
+def kb_version(docs: Iterable[dict]) -> str:
+    """Version of the documents used in a prompt: changes when any of them is edited"""
+    stamps = sorted(f"{doc['id']}@{doc.get('updated_at') or doc.get('created_at') or ''}" for doc in docs)
+    if not stamps:
+        return NO_DOCUMENTS
+    return hashlib.sha256('\n'.join(stamps).encode('utf-8')).hexdigest()[:16]
+
+
+def cache_key(kind: str, fields: dict, version: str, model: str) -> str:
+    payload = {
+        "kind": kind,
+        "fields": {name: normalize(value) for name, value in sorted(fields.items())},
+        "kb_version": version,
+        "model": model,
+        "prompt_version": PROMPT_VERSION,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+async def ensure_indexes(db):
+    await mongo.ensure_ttl_index(db, GENERATIONS_COLLECTION, "created_at", int(GENERATION_CACHE_TTL_HOURS * 3600))
+
+
+def _created_at(entry: dict) -> datetime:
+    # pymongo returns naive UTC datetimes
+    return entry["created_at"].replace(tzinfo=timezone.utc)
+
+
+def _fresh(entry: dict) -> bool:
+    return datetime.now(timezone.utc) - _created_at(entry) < timedelta(hours=GENERATION_CACHE_TTL_HOURS)
+
+
+async def generate(db, kind: str, fields: dict, version: str, model: str,
+                   produce: Callable[[], Awaitable[str]], bypass: bool = False, refresh: bool = False):
+    """Returns (response, cache info); calls produce() only when no fresh entry exists"""
+    key = cache_key(kind, fields, version, model)
+    info = {"status": "miss", "kb_version": version, "generated_at": None}
+
+    if not GENERATION_CACHE_ENABLED or bypass:
+        _metrics[f"{kind}.bypasses"] += 1
+        info["status"] = "bypass"
+        response, _ = await _timed(produce)
+        info["generated_at"] = datetime.now(timezone.utc).isoformat()
+        return response, info
+
+    if refresh:
+        info["status"] = "refresh"
+    else:
+        try:
+            entry = await db[GENERATIONS_COLLECTION].find_one({"_id": key})
+        except Exception as e:
+            logging.error(f"Generation cache read error: {str(e)}")
+            _metrics[f"{kind}.errors"] += 1
+            entry = None
+        if entry and _fresh(entry):
+            _metrics[f"{kind}.hits"] += 1
+            _metrics[f"{kind}.saved_seconds"] += entry.get("seconds", 0)
+            info.update(status="hit", generated_at=_created_at(entry).isoformat())
+            return entry["response"], info
+
+    if key in _inflight and not refresh:
+        # The same advice is being generated for another request right now
+        pending = _inflight[key]
+        try:
+            response, generated_at = await asyncio.shield(pending)
+            _metrics[f"{kind}.coalesced"] += 1
+            info.update(status="coalesced", generated_at=generated_at)
+            return response, info
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise  # this request itself was cancelled
+            # The request generating it went away (e.g. client disconnect): generate here
+
+    _metrics[f"{kind}.refreshes" if refresh else f"{kind}.misses"] += 1
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        response, seconds = await _timed(produce)
+        now = datetime.now(timezone.utc)
+        future.set_result((response, now.isoformat()))
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # waiters re-raise it; avoid "exception never retrieved"
+        raise
+    finally:
+        # Cancellation is a BaseException: waiters must not be left waiting for it
+        if not future.done():
+            future.cancel()
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+    _metrics[f"{kind}.llm_seconds"] += seconds
+    try:
+        await db[GENERATIONS_COLLECTION].replace_one({"_id": key}, {
+            "kind": kind,
+            "kb_version": version,
+            "model": model,
+            "response": response,
+            "seconds": round(seconds, 3),
+            "created_at": now,
+        }, upsert=True)
+        _metrics[f"{kind}.stores"] += 1
+    except Exception as e:
+        logging.error(f"Generation cache write error: {str(e)}")
+        _metrics[f"{kind}.errors"] += 1
+    info["generated_at"] = now.isoformat()
+    return response, info
+
+
+async def _timed(produce):
+    started = time.perf_counter()
+    response = await produce()
+    return response, time.perf_counter() - started
+
+
+async def invalidate(db, kind: Optional[str] = None) -> int:
+    """Delete cached generations, e.g. after changing a prompt without bumping PROMPT_VERSION"""
+    result = await db[GENERATIONS_COLLECTION].delete_many({"kind": kind} if kind else {})
+    return result.deleted_count
+
+
+async def stats(db) -> dict:
+    kinds = {}
+    for name, value in _metrics.items():
+        kind, metric = name.split('.', 1)
+        kinds.setdefault(kind, {})[metric] = round(value, 3) if isinstance(value, float) else value
+    for kind, row in kinds.items():
+        lookups = row.get("hits", 0) + row.get("misses", 0) + row.get("coalesced", 0)
+        row["hit_ratio"] = round((row.get("hits", 0) + row.get("coalesced", 0)) / lookups, 4) if lookups else 0.0
+    return {
+        "enabled": GENERATION_CACHE_ENABLED,
+        "ttl_hours": GENERATION_CACHE_TTL_HOURS,
+        "entries": await db[GENERATIONS_COLLECTION].estimated_document_count(),
+        "kinds": kinds,
+    }
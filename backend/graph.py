@@ -0,0 +1,181 @@
+"""Entity index and co-occurrence graph of the archive.
+
+Entities are the vitamins, minerals, supplements, herbs, conditions and foods
+of the vocabularies in derivations.py (``count_entities``). Two collections
+hold them:
+
+- ``entity_mentions``: one row per document and entity, with the number of
+  mentions. Indexed by entity, so "documents mentioning X and Y" is one
+  aggregation over the rows of X and Y instead of a content scan.
+- ``entity_edges``: one row per ordered pair of entities that appear in the
+  same document, with the number of such documents. Every pair is stored in
+  both directions, so "top entities co-occurring with X" is an indexed
+  ``find`` sorted by that count.
+
+A document write compares the document's new entities with its stored
+mentions and only adjusts the rows and edge counts that changed.
+rebuild_graph.py recomputes both collections for an existing archive, in
+staging collections that replace the live ones when they are complete.
+"""
+import asyncio
+from itertools import permutations
+from typing import Dict, List, Optional
+
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from derivations import count_entities
+
+MENTIONS_COLLECTION = "entity_mentions"
+EDGES_COLLECTION = "entity_edges"
+
+PROJECTION = {"_id": 0, "id": 1, "title": 1, "content": 1, "content_external": 1}
+
+
+def entity_key(name: str) -> str:
+    """Canonical name for a user-supplied entity ("Vitamin D" -> "vitamine d")"""
+    name = ' '.join(name.lower().split())
+    found = count_entities(name)
+    return next(iter(found)) if len(found) == 1 else name
+
+
+def mentions(doc: dict) -> Dict[str, tuple]:
+    """name -> (kind, count) for a document's title and content"""
+    return count_entities(f"{doc.get('title') or ''}\n{doc.get('content') or ''}")
+
+
+def mention_rows(document_id: str, found: Dict[str, tuple]) -> List[dict]:
+    return [
+        {"_id": f"{document_id}|{name}", "document_id": document_id, "entity": name, "kind": kind, "count": count}
+        for name, (kind, count) in found.items()
+    ]
+
+
+def edge(a: str, b: str, found: Dict[str, tuple]) -> dict:
+    return {"entity": a, "other": b, "other_kind": found[b][0]}
+
+
+async def ensure_indexes(db):
+    for name in (MENTIONS_COLLECTION, EDGES_COLLECTION):
+        await _create_indexes(db[name], name)
+
+
+async def _create_indexes(collection, name: str):
+    """Indexes of the mentions or edges collection `name`, created on `collection`"""
+    if name == MENTIONS_COLLECTION:
+        await collection.create_index([("entity", 1), ("count", -1)])
+        await collection.create_index("document_id")
+    else:
+        await collection.create_index([("entity", 1), ("documents", -1)])
+
+
+async def update(db, document_id: str, after: Optional[dict]):
+    """Apply the difference between a document's stored and current entities"""
+    import bodies
+
+    found = {}
+    if after is not None:
+        doc = await bodies.hydrate(db, after)
+        found = await asyncio.to_thread(mentions, doc)
+
+    stored = {
+        row["entity"]: (row["kind"], row["count"])
+        async for row in db[MENTIONS_COLLECTION].find({"document_id": document_id}, {"_id": 0, "entity": 1, "kind": 1, "count": 1})
+    }
+    if stored == found:
+        return
+
+    removed, added = stored.keys() - found.keys(), found.keys() - stored.keys()
+    mention_ops = [DeleteOne({"_id": f"{document_id}|{name}"}) for name in removed]
+    mention_ops += [
+        ReplaceOne({"_id": row["_id"]}, row, upsert=True)
+        for row in mention_rows(document_id, {name: found[name] for name in found if stored.get(name) != found[name]})
+    ]
+    if mention_ops:
+        await db[MENTIONS_COLLECTION].bulk_write(mention_ops, ordered=False)
+
+    # Pairs that lost this document: any pair with a removed entity; gained: any pair with an added one
+    lost = [pair for pair in permutations(sorted(stored), 2) if pair[0] in removed or pair[1] in removed]
+    gained = [pair for pair in permutations(sorted(found), 2) if pair[0] in added or pair[1] in added]
+    edge_ops = [UpdateOne({"_id": f"{a}|{b}"}, {"$inc": {"documents": -1}}) for a, b in lost]
+    edge_ops += [
+        UpdateOne({"_id": f"{a}|{b}"}, {"$inc": {"documents": 1}, "$setOnInsert": edge(a, b, found)}, upsert=True)
+        for a, b in gained
+    ]
+    if edge_ops:
+        await db[EDGES_COLLECTION].bulk_write(edge_ops, ordered=False)
+        if lost:
+            await db[EDGES_COLLECTION].delete_many({"documents": {"$lte": 0}})
+
+
+async def documents_with(db, names: List[str], limit: int = 20) -> List[dict]:
+    """Documents that mention every entity, most mentions first: [{document_id, mentions: {name: count}}]"""
+    names = list(dict.fromkeys(entity_key(name) for name in names))
+    pipeline = [
+        {"$match": {"entity": {"$in": names}}},
+        {"$group": {
+            "_id": "$document_id",
+            "entities": {"$sum": 1},
+            "total": {"$sum": "$count"},
+            "mentions": {"$push": {"entity": "$entity", "count": "$count"}},
+        }},
+        {"$match": {"entities": len(names)}},
+        {"$sort": {"total": -1, "_id": 1}},
+        {"$limit": limit},
+    ]
+    return [
+        {"document_id": row["_id"], "mentions": {m["entity"]: m["count"] for m in row["mentions"]}}
+        async for row in db[MENTIONS_COLLECTION].aggregate(pipeline)
+    ]
+
+
+async def co_occurring(db, name: str, limit: int = 20) -> List[dict]:
+    """Entities that share the most documents with name: [{entity, kind, documents}]"""
+    rows = await db[EDGES_COLLECTION].find(
+        {"entity": entity_key(name), "documents": {"$gt": 0}}, {"_id": 0, "other": 1, "other_kind": 1, "documents": 1}
+    ).sort("documents", -1).limit(limit).to_list(limit)
+    return [{"entity": row["other"], "kind": row.get("other_kind"), "documents": row["documents"]} for row in rows]
+
+
+async def document_count(db, name: str) -> int:
+    return await db[MENTIONS_COLLECTION].count_documents({"entity": entity_key(name)})
+
+
+def document_mentions(docs: List[dict]) -> List[tuple]:
+    """Worker: [(id, mentions)] for a slice of documents (rebuild_graph.py)"""
+    return [(doc['id'], mentions(doc)) for doc in docs]
+
+
+async def replace_all(db, found: Dict[str, Dict[str, tuple]], batch_size: int = 1000) -> dict:
+    """Replace both collections with the mentions of every document
+
+    The rows are written to temporary collections that are then renamed over
+    the live ones, so readers see the old graph until the new one is complete.
+    Writes that the server makes to the live collections during the rebuild
+    are replaced as well.
+    """
+    edges, kinds = {}, {}
+    for names in found.values():
+        kinds.update((name, kind) for name, (kind, _) in names.items())
+        for a, b in permutations(sorted(names), 2):
+            edges[(a, b)] = edges.get((a, b), 0) + 1
+
+    mentions = (row for document_id, names in found.items() for row in mention_rows(document_id, names))
+    edge_rows = (
+        {"_id": f"{a}|{b}", "entity": a, "other": b, "other_kind": kinds[b], "documents": count}
+        for (a, b), count in edges.items()
+    )
+    for collection, rows in ((MENTIONS_COLLECTION, mentions), (EDGES_COLLECTION, edge_rows)):
+        staging = db[f"{collection}_rebuild"]
+        await staging.drop()
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                await staging.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            await staging.insert_many(batch, ordered=False)
+        # Creating the indexes also creates an empty collection, so the rename always applies
+        await _create_indexes(staging, collection)
+        await staging.rename(collection, dropTarget=True)
+    return {"documents": len(found), "mentions": sum(map(len, found.values())), "edges": len(edges)}
@@ -0,0 +1,182 @@
+"""HTTP conditional requests and response compression for read endpoints.
+
+Read routes compute a strong ETag from cheap metadata before touching the
+full documents: a document's ``updated_at``, or for lists and statistics the
+archive write version (cache.py), which every document write bumps. A
+matching ``If-None-Match`` gets ``304 Not Modified`` without serializing
+anything. ``CompressionMiddleware`` compresses JSON bodies with brotli when the
+optional ``brotli`` package is installed and the client accepts it, otherwise
+with gzip, in a worker thread for bodies of ``COMPRESSION_THREAD_BYTES`` or
+more. A compressed body gets its own ETag (``-br`` or ``-gzip`` suffix),
+and a 304 repeats the tag the client sent, so it names the same
+representation as the 200 did.
+"""
+import asyncio
+import gzip
+import hashlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+# Cache-Control policy per route. "no-cache" lets browsers keep the body but
+# revalidate with If-None-Match on every navigation.
+CACHE_CONTROL = {
+    "documents": "private, no-cache",
+    "document": "private, no-cache",
+    "categories": "private, max-age=60, must-revalidate",
+    "stats": "private, no-cache",
+}
+
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/csv")
+COMPRESSION_MIN_BYTES = 1024
+# Larger bodies are compressed in a worker thread, so the event loop keeps serving
+COMPRESSION_THREAD_BYTES = 64 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Suffixes added to the ETag of compressed representations (strong ETags must
+# differ per content-coding); stripped again when comparing If-None-Match.
+ENCODING_SUFFIXES = {"br": "-br", "gzip": "-gzip"}
+
+
+def make_etag(*parts) -> str:
+    """Build a strong ETag from the values that determine a representation"""
+    digest = hashlib.sha1("\x1f".join("" if p is None else str(p) for p in parts).encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+
+def _strip_etag(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ENCODING_SUFFIXES.values():
+        if tag.endswith(suffix + '"'):
+            tag = tag[: -len(suffix) - 1] + '"'
+    return tag
+
+
+def _matching_tag(header: str, etag: str) -> Optional[str]:
+    """The If-None-Match entry, as the client sent it, that matches the current ETag"""
+    return next((tag.strip() for tag in header.split(",") if _strip_etag(tag) == etag), None)
+
+
+def etag_matches(request, etag: str) -> bool:
+    """Check a request's If-None-Match header against the current ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return _matching_tag(header, etag) is not None
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def set_cache_headers(response: Response, etag: str, cache_control: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+
+
+def _choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """Compress JSON/text responses with brotli or gzip based on Accept-Encoding"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = _choose_encoding(request_headers.get("accept-encoding", ""))
+        if_none_match = request_headers.get("if-none-match")
+        if encoding is None and not if_none_match:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        chunks = []
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if message["status"] == 304 and if_none_match and "etag" in headers:
+                    # Answer with the ETag of the representation the client holds,
+                    # which is the one a 200 would have carried (suffixed if compressed)
+                    tag = _matching_tag(if_none_match, headers["etag"])
+                    if tag and tag.startswith('"'):
+                        MutableHeaders(raw=message["headers"])["ETag"] = tag
+                if (
+                    encoding is None
+                    or "content-encoding" in headers
+                    or message["status"] in (204, 304)
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                ):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            headers = MutableHeaders(raw=start_message["headers"])
+            if len(body) >= self.minimum_size:
+                if len(body) >= COMPRESSION_THREAD_BYTES:
+                    body = await asyncio.to_thread(compress, body, encoding)
+                else:
+                    body = compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                if "etag" in headers:
+                    etag = headers["etag"]
+                    headers["ETag"] = etag[:-1] + ENCODING_SUFFIXES[encoding] + '"'
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Startup import cost of the API process
+
+Runs ``python -X importtime -c "import server"`` in a fresh interpreter and
+lists what each import costs, grouped per top-level package (self time of all
+its modules) or per module imported directly by server.py (cumulative time).
+The run with the median total of --runs is reported.
+
+Libraries that are only needed by some endpoints belong behind lazy.py; this
+report shows when one slips back into the import path.
+
+Examples:
+    python import_report.py
+    python import_report.py --group direct --top 15
+    python import_report.py --budget-ms 2500 --output imports.json
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def measure(module: str = "server") -> list:
+    """(module, self us, cumulative us, depth) for every module imported by `import <module>`"""
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            rows.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    return rows
+
+
+def summarize(rows: list, module: str, group: str) -> dict:
+    # Children are printed before their parent; the module's own imports follow the previous top-level line
+    end = next(i for i, (name, _, _, depth) in enumerate(rows) if name == module and depth == 0)
+    start = max((i for i in range(end) if rows[i][3] == 0), default=-1) + 1
+    rows = rows[start:end + 1]
+    total_us = rows[-1][2]
+    costs = defaultdict(int)
+    if group == "package":
+        for name, self_us, _, _ in rows:
+            costs[name.split('.')[0]] += self_us
+    else:
+        for name, _, cumulative, depth in rows:
+            if depth == 1:
+                costs[name] += cumulative
+    ranked = sorted(costs.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "module": module,
+        "total_ms": round(total_us / 1000, 1),
+        "modules_imported": len(rows),
+        "group": group,
+        "costs_ms": [{"name": name, "ms": round(us / 1000, 1)} for name, us in ranked],
+    }
+
+
+def main(args) -> dict:
+    runs = [summarize(measure(args.module), args.module, args.group) for _ in range(args.runs)]
+    report = sorted(runs, key=lambda run: run["total_ms"])[len(runs) // 2]
+
+    print(f"import {args.module}: {report['total_ms']:.1f}ms, {report['modules_imported']} modules "
+          f"(median of {args.runs} runs)")
+    for row in report["costs_ms"][:args.top]:
+        share = row["ms"] / report["total_ms"] * 100 if report["total_ms"] else 0
+        print(f"  {row['name']:<40} {row['ms']:>9.1f}ms {share:>5.1f}%")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Wrote {args.output}")
+    if args.budget_ms and report["total_ms"] > args.budget_ms:
+        print(f"Over budget: {report['total_ms']:.1f}ms > {args.budget_ms:.0f}ms")
+        sys.exit(1)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="server")
+    parser.add_argument("--group", choices=["package", "direct"], default="package",
+                        help="self time per top-level package, or cumulative time per direct import")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, help="exit with status 1 when the import takes longer")
+    parser.add_argument("--output", help="write the report as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
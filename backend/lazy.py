@@ -0,0 +1,54 @@
+"""Deferred imports of heavy libraries.
+
+``import server`` should stay cheap so that worker restarts and new replicas
+come up quickly. The PDF and DOCX parsers, the LLM integration and the
+``requests`` client are only needed by some endpoints, so they are imported on
+first use through ``load`` and ``LazyAttribute`` instead of at module level.
+Each deferred import is timed once and logged.
+
+``import_report.py`` measures what ``import server`` itself costs.
+"""
+import importlib
+import logging
+import sys
+import threading
+import time
+
+_import_seconds = {}
+_lock = threading.Lock()
+
+
+def load(module_name: str):
+    """Import a module on first use, recording how long it took"""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    with _lock:
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        if module_name not in _import_seconds:
+            _import_seconds[module_name] = time.perf_counter() - started
+            logging.info(f"Imported {module_name} on first use in {_import_seconds[module_name] * 1000:.0f}ms")
+    return module
+
+
+class LazyAttribute:
+    """Stand-in for ``from module import name`` that imports the module on first call"""
+
+    def __init__(self, module_name: str, name: str):
+        self.module_name = module_name
+        self.name = name
+
+    def resolve(self):
+        return getattr(load(self.module_name), self.name)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<lazy {self.module_name}.{self.name}>"
+
+
+def import_costs() -> dict:
+    """Seconds spent in deferred imports so far, per module"""
+    return dict(_import_seconds)
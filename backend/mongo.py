@@ -0,0 +1,198 @@
+"""Mongo client construction and connection pool monitoring.
+
+Every process (each uvicorn worker, each backfill script) creates one
+``AsyncIOMotorClient`` through ``create_client``, so pool size, timeouts,
+read/write concerns and wire compression are configured in one place:
+
+    MONGO_MAX_POOL_SIZE (100), MONGO_MIN_POOL_SIZE (0), MONGO_MAX_IDLE_TIME_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS (5000),
+    MONGO_CONNECT_TIMEOUT_MS (5000), MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_READ_CONCERN, MONGO_WRITE_CONCERN (w), MONGO_JOURNAL,
+    MONGO_READ_PREFERENCE, MONGO_COMPRESSORS (zstd,snappy)
+
+With N workers the deployment opens up to N x MONGO_MAX_POOL_SIZE connections.
+A ``PoolMonitor`` listener counts connections in use and threads waiting for
+one, which ``/api/health`` reports.
+"""
+import logging
+import os
+import threading
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.errors import OperationFailure
+
+INDEX_OPTIONS_CONFLICT = 85
+
+
+def _int_env(name: str):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def available_compressors(names) -> list:
+    """Requested wire compressors whose libraries are installed"""
+    available = []
+    for name in names:
+        try:
+            if name == 'zstd':
+                import zstandard  # noqa: F401
+            elif name == 'snappy':
+                import snappy  # noqa: F401
+            elif name != 'zlib':
+                continue
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+def client_options() -> dict:
+    """MongoClient keyword arguments from the environment"""
+    options = {
+        "maxPoolSize": _int_env('MONGO_MAX_POOL_SIZE') or 100,
+        "minPoolSize": _int_env('MONGO_MIN_POOL_SIZE') or 0,
+        "serverSelectionTimeoutMS": _int_env('MONGO_SERVER_SELECTION_TIMEOUT_MS') or 5000,
+        "connectTimeoutMS": _int_env('MONGO_CONNECT_TIMEOUT_MS') or 5000,
+        "appname": os.environ.get('MONGO_APP_NAME', 'wellness-archive'),
+    }
+    for option, name in (("maxIdleTimeMS", 'MONGO_MAX_IDLE_TIME_MS'),
+                         ("waitQueueTimeoutMS", 'MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+                         ("socketTimeoutMS", 'MONGO_SOCKET_TIMEOUT_MS')):
+        if _int_env(name) is not None:
+            options[option] = _int_env(name)
+
+    if os.environ.get('MONGO_READ_CONCERN'):
+        options["readConcernLevel"] = os.environ['MONGO_READ_CONCERN']
+    write_concern = os.environ.get('MONGO_WRITE_CONCERN')
+    if write_concern:
+        options["w"] = int(write_concern) if write_concern.isdigit() else write_concern
+    if os.environ.get('MONGO_JOURNAL'):
+        options["journal"] = os.environ['MONGO_JOURNAL'] == '1'
+    if os.environ.get('MONGO_READ_PREFERENCE'):
+        options["readPreference"] = os.environ['MONGO_READ_PREFERENCE']
+
+    requested = [c.strip() for c in os.environ.get('MONGO_COMPRESSORS', 'zstd,snappy').split(',') if c.strip()]
+    compressors = available_compressors(requested)
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection pool counters across all servers of a client"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiting_since = threading.local()
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = {}
+        self.pool_clears = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open": self.open,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "pool_clears": self.pool_clears,
+                "avg_wait_ms": round(self.wait_seconds_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.wait_seconds_max * 1000, 3),
+            }
+
+    def connection_check_out_started(self, event):
+        self._waiting_since.value = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def _stop_waiting(self) -> float:
+        started = getattr(self._waiting_since, 'value', None)
+        self._waiting_since.value = None
+        self.waiting = max(0, self.waiting - 1)
+        return time.perf_counter() - started if started else 0.0
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            waited = self._stop_waiting()
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._stop_waiting()
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+        logging.warning(f"Mongo connection checkout failed ({event.reason}) for {event.address}")
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open = max(0, self.open - 1)
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+async def ensure_ttl_index(db, collection: str, field: str, seconds: int):
+    """Create a TTL index on field, or change the expiry of the existing one to `seconds`"""
+    try:
+        await db[collection].create_index(field, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        # The index exists with another expireAfterSeconds (its setting was changed)
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        await db.command("collMod", collection, index={"keyPattern": {field: 1}, "expireAfterSeconds": seconds})
+        logging.info(f"TTL of {collection}.{field} changed to {seconds}s")
+
+
+def create_client(url: str = None, **overrides):
+    """Returns (client, PoolMonitor) configured from the environment"""
+    monitor = PoolMonitor()
+    options = {**client_options(), **overrides}
+    client = AsyncIOMotorClient(url or os.environ['MONGO_URL'], event_listeners=[monitor], **options)
+    return client, monitor
+
+
+def pool_stats(monitor: PoolMonitor, options: dict = None) -> dict:
+    options = options or client_options()
+    stats = monitor.stats()
+    max_pool_size = options.get("maxPoolSize") or 100
+    return {
+        **stats,
+        "max_pool_size": max_pool_size,
+        "min_pool_size": options.get("minPoolSize", 0),
+        "utilization": round(stats["in_use"] / max_pool_size, 4) if max_pool_size else 0.0,
+        "compressors": options.get("compressors", ""),
+    }
@@ -0,0 +1,138 @@
+"""Local OCR for uploaded images and scanned PDFs.
+
+Tesseract runs in a process pool so OCR never blocks the event loop, and an
+asyncio semaphore bounds how many uploads are recognized at the same time.
+Images are downscaled and normalized first (EXIF rotation, grayscale,
+autocontrast, max ``OCR_MAX_DIMENSION`` pixels on the long side) to keep the
+time per image predictable. When pytesseract or the tesseract binary is
+missing, OCR returns an empty string and uploads fall back to the placeholder.
+"""
+import asyncio
+import io
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+OCR_ENABLED = os.environ.get('OCR_ENABLED', '1') == '1'
+OCR_LANG = os.environ.get('OCR_LANG', 'nld+eng')
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+OCR_MAX_CONCURRENCY = int(os.environ.get('OCR_MAX_CONCURRENCY', str(OCR_WORKERS)))
+OCR_MAX_DIMENSION = int(os.environ.get('OCR_MAX_DIMENSION', '2500'))
+OCR_TIMEOUT_SECONDS = float(os.environ.get('OCR_TIMEOUT_SECONDS', '60'))
+OCR_MAX_PDF_PAGES = int(os.environ.get('OCR_MAX_PDF_PAGES', '50'))
+
+# A PDF whose text layer yields less than this is treated as scanned
+SCANNED_PDF_MIN_CHARS = 100
+
+_executor: Optional[ProcessPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_available: Optional[bool] = None
+
+
+def is_available() -> bool:
+    """Check once whether pytesseract and the tesseract binary are installed"""
+    global _available
+    if _available is None:
+        try:
+            import pytesseract  # noqa: F401
+            _available = OCR_ENABLED and shutil.which('tesseract') is not None
+        except ImportError:
+            _available = False
+        if not _available:
+            logging.info("OCR disabled: pytesseract or tesseract binary not available")
+    return _available
+
+
+def preprocess(image):
+    """Normalize an image for OCR: upright, grayscale, bounded size, stretched contrast"""
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('L')
+    longest = max(image.size)
+    if longest > OCR_MAX_DIMENSION:
+        scale = OCR_MAX_DIMENSION / longest
+        image = image.resize((int(image.width * scale), int(image.height * scale)), Image.LANCZOS)
+    return ImageOps.autocontrast(image)
+
+
+def _recognize(image) -> str:
+    import pytesseract
+
+    try:
+        return pytesseract.image_to_string(preprocess(image), lang=OCR_LANG, timeout=OCR_TIMEOUT_SECONDS)
+    except RuntimeError as e:
+        # pytesseract raises RuntimeError on timeout
+        logging.error(f"OCR timed out: {str(e)}")
+        return ""
+
+
+def _ocr_image_bytes(data: bytes) -> str:
+    """Worker: OCR a single image"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        return _recognize(image)
+
+
+def _ocr_pdf_bytes(data: bytes) -> str:
+    """Worker: OCR the embedded page images of a scanned PDF"""
+    import PyPDF2
+    from PIL import Image
+
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    pages = []
+    for page in reader.pages[:OCR_MAX_PDF_PAGES]:
+        page_text = []
+        for embedded in page.images:
+            try:
+                with Image.open(io.BytesIO(embedded.data)) as image:
+                    page_text.append(_recognize(image))
+            except Exception as e:
+                logging.error(f"Error reading embedded PDF image: {str(e)}")
+        pages.append("\n".join(t for t in page_text if t.strip()))
+    return "\n".join(pages)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor, _semaphore
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+        _semaphore = asyncio.Semaphore(OCR_MAX_CONCURRENCY)
+    return _executor
+
+
+async def _run(fn, data: bytes) -> str:
+    if not is_available():
+        return ""
+    executor = _get_executor()
+    async with _semaphore:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, data)
+        except Exception as e:
+            logging.error(f"OCR error: {str(e)}")
+            return ""
+
+
+async def ocr_image(data: bytes) -> str:
+    """Recognize the text in an uploaded image"""
+    return (await _run(_ocr_image_bytes, data)).strip()
+
+
+async def ocr_scanned_pdf(data: bytes) -> str:
+    """Recognize the text of a PDF without a text layer"""
+    return (await _run(_ocr_pdf_bytes, data)).strip()
+
+
+def looks_scanned(text: str) -> bool:
+    """A PDF whose extracted text layer is (nearly) empty"""
+    return len(text.strip()) < SCANNED_PDF_MIN_CHARS
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,241 @@
+"""Opt-in sampling profiler for slow API requests.
+
+A single background thread samples the stacks of the event loop thread and of
+the thread pool workers (``asyncio.to_thread``, run_in_executor) while at least
+one request is being profiled. Each stack starts with ``[event loop]`` or
+``[worker thread]``, and idle workers are skipped. Every request records its
+start and end time, so concurrent profiled requests share one sampler and each
+one only keeps the samples taken during its own lifetime.
+
+Limits:
+- Samples are taken per thread, not per request: under concurrency a profile
+  also holds the stacks of other requests that ran on the loop or in a worker
+  during its lifetime.
+- Process pools (OCR, the rebuild scripts) cannot be sampled from here; their
+  time shows up as the loop or a worker waiting on the pool.
+- With several busy threads a tick yields several samples, so the profile
+  weights add up to more than the request's wall time.
+
+Profiling is triggered either explicitly (``X-Profile: 1`` header or
+``?profile=1`` together with a valid ``X-Admin-Token``) or automatically for
+every request that takes longer than ``PROFILE_SLOW_REQUEST_MS``. Profiles are
+written to ``PROFILE_DIR`` as collapsed stacks (flamegraph.pl / speedscope
+import) or as native speedscope JSON.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', Path(__file__).parent / 'profiles'))
+PROFILE_FORMAT = os.environ.get('PROFILE_FORMAT', 'collapsed')  # collapsed or speedscope
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+PROFILE_SLOW_REQUEST_MS = float(os.environ.get('PROFILE_SLOW_REQUEST_MS', '0'))  # 0 disables auto mode
+PROFILE_MAX_SAMPLES = int(os.environ.get('PROFILE_MAX_SAMPLES', '200000'))
+
+PROFILE_EXTENSIONS = {
+    'collapsed': '.collapsed.txt',
+    'speedscope': '.speedscope.json',
+}
+
+_SAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+# Names of the threads started by ThreadPoolExecutor and the loop's default executor
+WORKER_THREAD_PREFIXES = ("asyncio_", "ThreadPoolExecutor-")
+_POOL_MODULE = os.path.join("concurrent", "futures", "thread.py")
+
+
+def _is_idle_worker(frame) -> bool:
+    """A pool worker blocked on its queue has its loop function as the innermost frame"""
+    return frame.f_code.co_name == "_worker" and frame.f_code.co_filename.endswith(_POOL_MODULE)
+
+
+def _stack(frame) -> list:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class LoopSampler:
+    """Samples the event loop thread and busy pool workers while profiled requests are active"""
+
+    def __init__(self, interval: float, max_samples: int):
+        self.interval = interval
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._stop: Optional[threading.Event] = None
+        self._target_thread_id: Optional[int] = None
+
+    def acquire(self, thread_id: int):
+        with self._lock:
+            self._active += 1
+            self._target_thread_id = thread_id
+            if self._stop is None:
+                # A new event per run: a stopping thread from the previous run
+                # still sees its own event set and exits, while this run samples
+                self._stop = threading.Event()
+                threading.Thread(target=self._run, args=(self._stop,), name="request-profiler", daemon=True).start()
+
+    def release(self):
+        with self._lock:
+            self._active = max(0, self._active - 1)
+            if self._active == 0 and self._stop is not None:
+                self._stop.set()
+                self._stop = None
+
+    def _run(self, stop: threading.Event):
+        while not stop.wait(self.interval):
+            workers = {
+                thread.ident for thread in threading.enumerate()
+                if thread.name.startswith(WORKER_THREAD_PREFIXES)
+            }
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self._target_thread_id:
+                    root = "[event loop]"
+                elif thread_id in workers and not _is_idle_worker(frame):
+                    root = "[worker thread]"
+                else:
+                    continue
+                self._samples.append((now, tuple([root] + _stack(frame))))
+
+    def collect(self, since: float, until: float) -> Counter:
+        """Count the stacks sampled between two perf_counter timestamps"""
+        stacks = Counter()
+        for timestamp, stack in list(self._samples):
+            if since <= timestamp <= until:
+                stacks[stack] += 1
+        return stacks
+
+
+sampler = LoopSampler(PROFILE_SAMPLE_INTERVAL_MS / 1000, PROFILE_MAX_SAMPLES)
+
+
+def render_collapsed(stacks: Counter) -> str:
+    """Render stacks in the collapsed format understood by flamegraph.pl and speedscope"""
+    lines = [f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()]
+    return "\n".join(lines) + "\n"
+
+
+def render_speedscope(stacks: Counter, name: str, interval: float) -> str:
+    """Render stacks as a speedscope 'sampled' profile"""
+    frame_index = {}
+    frames = []
+    samples = []
+    weights = []
+    for stack, count in stacks.items():
+        indices = []
+        for label in stack:
+            if label not in frame_index:
+                frame_index[label] = len(frames)
+                frames.append({"name": label})
+            indices.append(frame_index[label])
+        samples.append(indices)
+        weights.append(count * interval * 1000)
+
+    return json.dumps({
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        }],
+        "name": name,
+        "exporter": "wellness-archive",
+    })
+
+
+def write_profile(stacks: Counter, method: str, path: str, duration_ms: float) -> str:
+    """Write a profile to PROFILE_DIR and return its file name"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    slug = _SAFE_NAME.sub('_', path.strip('/'))[:80] or 'root'
+    profile_format = PROFILE_FORMAT if PROFILE_FORMAT in PROFILE_EXTENSIONS else 'collapsed'
+    name = f"{timestamp}_{method}_{slug}_{int(duration_ms)}ms{PROFILE_EXTENSIONS[profile_format]}"
+
+    if profile_format == 'speedscope':
+        body = render_speedscope(stacks, f"{method} {path}", sampler.interval)
+    else:
+        body = render_collapsed(stacks)
+
+    (PROFILE_DIR / name).write_text(body, encoding='utf-8')
+    return name
+
+
+def list_profiles() -> List[dict]:
+    """List stored profiles, newest first"""
+    if not PROFILE_DIR.exists():
+        return []
+    profiles = []
+    for path in PROFILE_DIR.iterdir():
+        if path.is_file() and path.name.endswith(tuple(PROFILE_EXTENSIONS.values())):
+            stat = path.stat()
+            profiles.append({
+                "name": path.name,
+                "size": stat.st_size,
+                "created_at": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
+            })
+    return sorted(profiles, key=lambda p: p["name"], reverse=True)
+
+
+def profile_path(name: str) -> Optional[Path]:
+    """Resolve a profile name to a file inside PROFILE_DIR, rejecting anything else"""
+    if name != Path(name).name or not name.endswith(tuple(PROFILE_EXTENSIONS.values())):
+        return None
+    path = PROFILE_DIR / name
+    return path if path.is_file() else None
+
+
+def profiling_requested(request, admin_token: Optional[str]) -> bool:
+    """Check if the client explicitly asked for a profile with a valid admin token"""
+    flag = request.headers.get('x-profile') or request.query_params.get('profile')
+    if flag not in ('1', 'true', 'yes'):
+        return False
+    return bool(admin_token) and request.headers.get('x-admin-token') == admin_token
+
+
+async def profile_request(request, call_next, admin_token: Optional[str]):
+    """Run a request under the sampler when requested or when auto mode is enabled"""
+    explicit = profiling_requested(request, admin_token)
+    if not explicit and PROFILE_SLOW_REQUEST_MS <= 0:
+        return await call_next(request)
+
+    sampler.acquire(threading.get_ident())
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        finished = time.perf_counter()
+        sampler.release()
+
+    duration_ms = (finished - started) * 1000
+    if explicit or duration_ms >= PROFILE_SLOW_REQUEST_MS:
+        stacks = sampler.collect(started, finished)
+        if stacks:
+            try:
+                name = await asyncio.to_thread(
+                    write_profile, stacks, request.method, request.url.path, duration_ms
+                )
+                response.headers['X-Profile-Id'] = name
+                logging.info(f"Profiled {request.method} {request.url.path} in {duration_ms:.0f}ms: {name}")
+            except Exception as e:
+                logging.error(f"Error writing profile: {str(e)}")
+    return response
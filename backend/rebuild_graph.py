@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Rebuild the entity index and co-occurrence graph of the whole archive
+
+Extracts the entities of every document in a process pool and replaces the
+``entity_mentions`` and ``entity_edges`` collections (see graph.py). The new
+rows go to staging collections that are renamed over the live ones when
+complete, so a running server keeps answering from the old graph meanwhile.
+Documents written during the rebuild are only counted when the extraction
+read them; re-save them or run again afterwards. The server keeps both
+collections current on writes; run this once for an existing archive, or
+after changing the vocabularies in derivations.py.
+
+Examples:
+    python rebuild_graph.py
+    python rebuild_graph.py --workers 4 --dry-run
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, str(Path(__file__).parent))
+import bodies  # noqa: E402
+import graph  # noqa: E402
+import mongo  # noqa: E402
+
+ROOT_DIR = Path(__file__).parent
+
+
+async def run(args, db=None):
+    if db is None:
+        load_dotenv(ROOT_DIR / '.env')
+        client, _ = mongo.create_client()
+        db = client[os.environ['DB_NAME']]
+
+    started = time.perf_counter()
+    total = await db.documents.count_documents({})
+    print(f"Extracting entities from {total} documents with {args.workers} workers", flush=True)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        rows = await bodies.map_batches(db, graph.PROJECTION, args.batch_size, executor, graph.document_mentions,
+                                          in_flight=2 * args.workers)
+    found = {document_id: names for document_id, names in rows if names}
+    print(f"Entities extracted in {time.perf_counter() - started:.1f}s "
+          f"({len(found)} documents mention at least one)", flush=True)
+
+    if args.dry_run:
+        print("Dry run: nothing written")
+        return found
+
+    await graph.ensure_indexes(db)
+    counts = await graph.replace_all(db, found)
+    print(f"Done: {counts['mentions']} mentions and {counts['edges']} edges written "
+          f"in {time.perf_counter() - started:.1f}s")
+    return found
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true", help="extract and count but do not write")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
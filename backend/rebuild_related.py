@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Rebuild the related-documents lists of the whole archive
+
+Computes every document's MinHash signature in a process pool, then the
+nearest-neighbour lists (see related.py) with each worker handling a slice
+of the archive, and replaces the ``related_documents`` collection with the
+result. The server keeps the lists current on writes; run this after
+changing RELATED_* settings or the tokenizer, or to fill the collection for
+an existing archive.
+
+Examples:
+    python rebuild_related.py
+    python rebuild_related.py --workers 8 --neighbors 20
+    python rebuild_related.py --dry-run
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import ReplaceOne
+
+sys.path.insert(0, str(Path(__file__).parent))
+import bodies  # noqa: E402
+import mongo  # noqa: E402
+import related  # noqa: E402
+
+ROOT_DIR = Path(__file__).parent
+
+
+def _slices(total: int, parts: int) -> list:
+    size = -(-total // parts) if total else 0
+    return [(start, min(start + size, total)) for start in range(0, total, size or 1)]
+
+
+async def run(args, db=None):
+    if db is None:
+        load_dotenv(ROOT_DIR / '.env')
+        client, _ = mongo.create_client()
+        db = client[os.environ['DB_NAME']]
+
+    started = time.perf_counter()
+    run_started = datetime.now(timezone.utc).isoformat()
+    total = await db.documents.count_documents({})
+    print(f"Computing signatures for {total} documents with {args.workers} workers", flush=True)
+
+    ids, fingerprints, sigs = [], {}, []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        rows = await bodies.map_batches(db, related.PROJECTION, args.batch_size, executor, related.signatures,
+                                          in_flight=2 * args.workers)
+    for document_id, source, signature in rows:
+        if signature:
+            ids.append(document_id)
+            fingerprints[document_id] = source
+            sigs.append(signature)
+    print(f"Signatures: {len(ids)} documents with text in {time.perf_counter() - started:.1f}s", flush=True)
+
+    neighbors_started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=related.load_signatures,
+                             initargs=(ids, sigs)) as executor:
+        # More slices than workers, so a slow slice does not hold up the others
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, related.neighbor_slice, start, stop, args.neighbors)
+            for start, stop in _slices(len(ids), args.workers * 4)
+        ])
+    lists = dict(row for part in results for row in part)
+    print(f"Neighbour lists computed in {time.perf_counter() - neighbors_started:.1f}s "
+          f"(average {sum(map(len, lists.values())) / max(1, len(lists)):.1f} neighbours)", flush=True)
+
+    if args.dry_run:
+        print("Dry run: nothing written")
+        return lists
+
+    collection = db[related.RELATED_COLLECTION]
+    await related.ensure_indexes(db)
+    operations = [
+        ReplaceOne({"_id": document_id}, related.entry(signature, fingerprints[document_id], lists[document_id]), upsert=True)
+        for document_id, signature in zip(ids, sigs)
+    ]
+    for start in range(0, len(operations), args.batch_size):
+        await collection.bulk_write(operations[start:start + args.batch_size], ordered=False)
+    # Entries of documents that no longer exist or have no text: not rewritten by this
+    # run nor by the server since it started
+    removed = await collection.delete_many({"updated_at": {"$lt": run_started}})
+    print(f"Done: {len(operations)} lists written, {removed.deleted_count} removed "
+          f"in {time.perf_counter() - started:.1f}s")
+    return lists
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--neighbors", type=int, default=related.RELATED_NEIGHBORS, help="list length per document")
+    parser.add_argument("--dry-run", action="store_true", help="compute the lists but do not write them")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
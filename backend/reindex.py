@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Recompute derived document fields for the existing archive
+
+Streams the documents collection in ``_id`` order, runs the selected derivation
+steps in a process pool and writes changed fields back with ``bulk_write``.
+Progress is checkpointed per job in ``reindex_checkpoints`` after every batch,
+so an interrupted run continues where it stopped when started again with the
+same ``--job``. The run throttles itself (``--max-docs-per-second``) and backs
+off when writes get slower than ``--max-write-latency-ms``, so it can run next
+to the live API.
+
+Each batch bumps the archive write version, so cached search results are
+recomputed, and records a ``document.updated`` event per changed document, so
+webhooks and the in-process indexes of running servers (which follow the event
+outbox) see the new fields. Other cached reads in a running server pick up the
+changes through the change stream watchers (CACHE_CHANGE_STREAMS=1) or when
+their TTL expires.
+
+Examples:
+    python reindex.py --steps content_preview one_liner
+    python reindex.py --job previews-2024 --steps content_preview --category supplement
+    python reindex.py --job previews-2024 --restart --max-docs-per-second 50
+    python reindex.py --job citations --steps references
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+sys.path.insert(0, str(Path(__file__).parent))
+import bodies  # noqa: E402
+import cache  # noqa: E402
+import citations  # noqa: E402
+import enrichment  # noqa: E402
+import events  # noqa: E402
+import mongo  # noqa: E402
+from derivations import generate_document_preview, generate_oneliner_mock, generate_consumer_blog_title_mock  # noqa: E402
+
+ROOT_DIR = Path(__file__).parent
+
+CHECKPOINTS_COLLECTION = 'reindex_checkpoints'
+
+PROJECTION = {"_id": 1, "content": 1, "content_external": 1, "content_preview": 1, "is_large_document": 1,
+              "chunk_hashes": 1, "references": 1, **{field: 1 for field in events.PAYLOAD_FIELDS}}
+
+
+# Derivation steps: pure functions of (title, content) returning the fields to set.
+# They run in worker processes, so they must be picklable top-level functions.
+
+def step_content_preview(title: str, content: str) -> dict:
+    preview, is_large = generate_document_preview(content, title)
+    # Like the upload paths: small documents show their content, not a copy of it
+    return {"content_preview": preview if is_large else None, "is_large_document": is_large}
+
+
+def step_one_liner(title: str, content: str) -> dict:
+    return {"one_liner": generate_oneliner_mock(title, content)}
+
+
+def step_consumer_blog_title(title: str, content: str) -> dict:
+    # Seeded by the input, so a rerun only changes titles of changed documents
+    return {"consumer_blog_title": generate_consumer_blog_title_mock(title, content, seed=f"{title}\n{content}")}
+
+
+def step_chunk_hashes(title: str, content: str) -> dict:
+    return {"chunk_hashes": enrichment.chunk_hashes(content)}
+
+
+def step_references(title: str, content: str) -> dict:
+    return {"references": citations.reference_strings(citations.extract(content))}
+
+
+STEPS = {
+    "content_preview": step_content_preview,
+    "one_liner": step_one_liner,
+    "consumer_blog_title": step_consumer_blog_title,
+    "chunk_hashes": step_chunk_hashes,
+    "references": step_references,
+}
+
+
+def derive(docs: list, steps: list) -> list:
+    """Worker: [(id, fields that differ from the stored values)] for a slice of documents"""
+    results = []
+    for doc in docs:
+        fields = {}
+        for name in steps:
+            fields.update(STEPS[name](doc.get('title', ''), doc.get('content') or ''))
+        changed = {key: value for key, value in fields.items() if doc.get(key) != value}
+        results.append((doc['id'], changed))
+    return results
+
+
+def build_query(args) -> dict:
+    query = {}
+    if args.category:
+        query["category"] = args.category
+    if args.file_type:
+        query["file_type"] = args.file_type
+    return query
+
+
+class Stats:
+    def __init__(self, total: int, processed: int = 0, updated: int = 0):
+        self.total = total
+        self.processed = processed
+        self.updated = updated
+        self.resumed_at = processed
+        self.write_seconds = 0.0
+        self.started = time.perf_counter()
+
+    def report(self, final: bool = False):
+        elapsed = time.perf_counter() - self.started
+        rate = (self.processed - self.resumed_at) / elapsed if elapsed else 0.0
+        print(
+            f"{'Done' if final else 'Progress'}: {self.processed}/{self.total} documents "
+            f"({rate:.1f} docs/s), {self.updated} updated, {self.write_seconds:.1f}s writing",
+            flush=True,
+        )
+
+
+class Throttle:
+    """Caps the document rate and backs off while database writes are slow"""
+
+    def __init__(self, max_docs_per_second: float, max_write_latency: float, max_pause: float = 30.0):
+        self.max_docs_per_second = max_docs_per_second
+        self.max_write_latency = max_write_latency
+        self.max_pause = max_pause
+        self.backoff = 0.0
+
+    async def wait(self, batch_size: int, batch_seconds: float, write_seconds: float):
+        pause = 0.0
+        if self.max_docs_per_second:
+            pause = max(0.0, batch_size / self.max_docs_per_second - batch_seconds)
+        if self.max_write_latency and write_seconds > self.max_write_latency:
+            self.backoff = min(self.max_pause, max(self.backoff * 2, write_seconds))
+        else:
+            self.backoff /= 2
+        pause += self.backoff
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+
+async def load_checkpoint(db, args) -> dict:
+    checkpoints = db[CHECKPOINTS_COLLECTION]
+    if args.restart:
+        await checkpoints.delete_one({"_id": args.job})
+    checkpoint = await checkpoints.find_one({"_id": args.job})
+    if checkpoint and checkpoint.get("steps") != args.steps:
+        raise SystemExit(
+            f"Job '{args.job}' was started with steps {checkpoint.get('steps')}; "
+            f"use --restart or another --job to run {args.steps}"
+        )
+    return checkpoint or {}
+
+
+async def save_checkpoint(db, args, last_id, stats: Stats, finished: bool = False):
+    now = datetime.now(timezone.utc).isoformat()
+    await db[CHECKPOINTS_COLLECTION].update_one(
+        {"_id": args.job},
+        {"$set": {"steps": args.steps, "last_id": last_id, "processed": stats.processed,
+                  "updated": stats.updated, "finished": finished, "updated_at": now},
+         "$setOnInsert": {"started_at": now}},
+        upsert=True,
+    )
+
+
+async def run(args, db=None):
+    if db is None:
+        load_dotenv(ROOT_DIR / '.env')
+        client, _ = mongo.create_client()
+        db = client[os.environ['DB_NAME']]
+
+    checkpoint = await load_checkpoint(db, args)
+    if checkpoint.get("finished"):
+        print(f"Job '{args.job}' already finished ({checkpoint['processed']} documents); use --restart to run it again")
+        return
+
+    query = build_query(args)
+    total = await db.documents.count_documents(query)
+    if args.limit:
+        total = min(total, checkpoint.get("processed", 0) + args.limit)
+    stats = Stats(total, checkpoint.get("processed", 0), checkpoint.get("updated", 0))
+    last_id = checkpoint.get("last_id")
+    if last_id is not None:
+        print(f"Resuming job '{args.job}' after {stats.processed} documents")
+    print(f"Reindexing {total} documents ({', '.join(args.steps)}) in batches of {args.batch_size} "
+          f"with {args.workers} workers{' (dry run)' if args.dry_run else ''}")
+
+    throttle = Throttle(args.max_docs_per_second, args.max_write_latency_ms / 1000)
+    loop = asyncio.get_running_loop()
+    remaining = args.limit or None
+    exhausted = False
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        while remaining is None or remaining > 0:
+            batch_started = time.perf_counter()
+            batch_query = dict(query)
+            if last_id is not None:
+                batch_query["_id"] = {"$gt": last_id}
+            size = args.batch_size if remaining is None else min(args.batch_size, remaining)
+            docs = await db.documents.find(batch_query, PROJECTION).sort("_id", 1).limit(size).to_list(size)
+            if not docs:
+                exhausted = True
+                break
+
+            for doc in docs:
+                if doc.get("content_external"):
+                    doc["content"] = await bodies.load_content(db, doc)
+
+            # Spread the batch over the workers
+            slice_size = -(-len(docs) // args.workers)
+            slices = [
+                [{key: value for key, value in doc.items() if key != "_id"} for doc in docs[start:start + slice_size]]
+                for start in range(0, len(docs), slice_size)
+            ]
+            results = await asyncio.gather(*[
+                loop.run_in_executor(executor, derive, part, args.steps) for part in slices
+            ])
+
+            now = datetime.now(timezone.utc).isoformat()
+            changes = [(document_id, {**changed, "updated_at": now})
+                       for part in results for document_id, changed in part if changed]
+            operations = [UpdateOne({"id": document_id}, {"$set": fields}) for document_id, fields in changes]
+
+            write_seconds = 0.0
+            if operations and not args.dry_run:
+                write_started = time.perf_counter()
+                await db.documents.bulk_write(operations, ordered=False)
+                await cache.bump_write_version(db)
+                by_id = {doc["id"]: doc for doc in docs}
+                for document_id, fields in changes:
+                    before = by_id[document_id]
+                    await events.record(db, document_id, before, {**before, **fields})
+                write_seconds = time.perf_counter() - write_started
+            if "references" in args.steps and not args.dry_run:
+                # The shared citation index follows the documents' references
+                write_started = time.perf_counter()
+                for doc in docs:
+                    found = await asyncio.to_thread(citations.extract, doc.get("content") or '')
+                    await citations.update(db, doc["id"], None, found=found)
+                write_seconds += time.perf_counter() - write_started
+
+            last_id = docs[-1]["_id"]
+            stats.processed += len(docs)
+            stats.updated += len(operations)
+            stats.write_seconds += write_seconds
+            if remaining is not None:
+                remaining -= len(docs)
+            if not args.dry_run:
+                await save_checkpoint(db, args, last_id, stats)
+            stats.report()
+
+            await throttle.wait(len(docs), time.perf_counter() - batch_started, write_seconds)
+
+    if not args.dry_run and exhausted:
+        await save_checkpoint(db, args, last_id, stats, finished=True)
+    stats.report(final=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", nargs="+", choices=list(STEPS), default=["content_preview", "one_liner"])
+    parser.add_argument("--job", default="default", help="checkpoint name; rerun with the same name to resume")
+    parser.add_argument("--restart", action="store_true", help="discard the job's checkpoint and start over")
+    parser.add_argument("--category", help="only documents in this category")
+    parser.add_argument("--file-type", help="only documents of this file type (e.g. pdf, blog_article)")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many documents (resumable)")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--max-docs-per-second", type=float, default=200, help="0 disables rate limiting")
+    parser.add_argument("--max-write-latency-ms", type=float, default=500,
+                        help="back off while a bulk write takes longer than this; 0 disables")
+    parser.add_argument("--dry-run", action="store_true", help="derive and count changes but do not write")
+    args = parser.parse_args(argv)
+    args.steps = sorted(set(args.steps), key=list(STEPS).index)
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
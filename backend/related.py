@@ -0,0 +1,193 @@
+"""Related documents from precomputed nearest-neighbour lists.
+
+Each document gets a MinHash signature of its word set (title, tags and the
+start of the body, tokenized like the search index). The share of equal
+signature values estimates the Jaccard similarity of two word sets, without
+comparing the texts themselves. Signatures are cut into 32 bands of four
+values each (locality-sensitive hashing). Documents that share a whole band
+are candidates, and are ranked by their estimated similarity. Two documents
+at similarity J share a band with probability 1 - (1 - J^4)^32: 0.3% at 0.1,
+5% at 0.2 (``RELATED_MIN_SCORE``), 56% at 0.4 and 99% at 0.6. Unrelated
+pairs are rarely fetched and scored, while good neighbours are still found.
+
+Everything lives in the ``related_documents`` collection, keyed by document
+id: the signature, its band keys (indexed, so candidates are one query) and
+the ``RELATED_NEIGHBORS`` best neighbours with their scores. A write to a
+document computes its own list and adds it to, or removes it from, the lists
+of the documents it affects. Lists that lose an entry are recomputed from
+their stored signature. rebuild_related.py recomputes every list using all
+cores.
+"""
+import asyncio
+import hashlib
+import heapq
+import os
+import random
+import zlib
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+from retrieval import tokenize
+
+RELATED_NEIGHBORS = int(os.environ.get('RELATED_NEIGHBORS', '10'))
+RELATED_MIN_SCORE = float(os.environ.get('RELATED_MIN_SCORE', '0.2'))
+RELATED_MAX_CHARS = int(os.environ.get('RELATED_MAX_CHARS', '20000'))
+
+RELATED_COLLECTION = "related_documents"
+
+NUM_PERM = 128
+BAND_ROWS = 4
+_PRIME = (1 << 61) - 1
+_rng = random.Random(47)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+PROJECTION = {"_id": 0, "id": 1, "title": 1, "tags": 1, "content": 1, "content_external": 1}
+
+
+def features(doc: dict) -> set:
+    """Words of the title and body start, plus the tags as their own features"""
+    text = f"{doc.get('title') or ''} {(doc.get('content') or '')[:RELATED_MAX_CHARS]}"
+    words = {token for token in tokenize(text) if len(token) > 2}
+    words.update(f"#{tag.lower()}" for tag in doc.get('tags') or [])
+    return words
+
+
+def fingerprint(doc: dict) -> str:
+    """Changes only when the features or signature layout can change, so metadata edits skip recomputing"""
+    source = f"{NUM_PERM}/{BAND_ROWS}\n{doc.get('title') or ''}\n{sorted(doc.get('tags') or [])}\n{(doc.get('content') or '')[:RELATED_MAX_CHARS]}"
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def minhash(words: Iterable[str]) -> List[int]:
+    hashes = [zlib.crc32(word.encode('utf-8')) for word in words]
+    if not hashes:
+        return []
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_keys(signature: List[int]) -> List[int]:
+    """One key per band: band number in the high bits, hash of its rows below"""
+    keys = []
+    for band, start in enumerate(range(0, len(signature), BAND_ROWS)):
+        rows = ','.join(map(str, signature[start:start + BAND_ROWS]))
+        keys.append(band << 32 | zlib.crc32(rows.encode('ascii')))
+    return keys
+
+
+def similarity(a: List[int], b: List[int]) -> float:
+    if not a or not b:
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+def best(signature: List[int], candidates: Iterable[tuple], limit: int = RELATED_NEIGHBORS) -> List[dict]:
+    """Top neighbours among (id, signature) candidates"""
+    scored = ((similarity(signature, other), document_id) for document_id, other in candidates)
+    return [
+        {"id": document_id, "score": round(score, 4)}
+        for score, document_id in heapq.nlargest(limit, (hit for hit in scored if hit[0] >= RELATED_MIN_SCORE))
+    ]
+
+
+def signatures(docs: List[dict]) -> List[tuple]:
+    """Worker: [(id, fingerprint, signature)] for a slice of documents"""
+    return [(doc['id'], fingerprint(doc), minhash(features(doc))) for doc in docs]
+
+
+def entry(signature: List[int], source: str, neighbors: List[dict]) -> dict:
+    return {
+        "signature": signature,
+        "bands": band_keys(signature),
+        "source": source,
+        "neighbors": neighbors,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+async def ensure_indexes(db):
+    await db[RELATED_COLLECTION].create_index("bands")
+    await db[RELATED_COLLECTION].create_index("neighbors.id")
+
+
+async def _candidates(db, document_id: str, bands: List[int]) -> List[tuple]:
+    rows = db[RELATED_COLLECTION].find(
+        {"bands": {"$in": bands}, "_id": {"$ne": document_id}}, {"signature": 1}
+    )
+    return [(row["_id"], row["signature"]) async for row in rows]
+
+
+async def _refresh(db, document_ids: Iterable[str]):
+    """Recompute the lists of documents that lost a neighbour"""
+    collection = db[RELATED_COLLECTION]
+    for document_id in document_ids:
+        row = await collection.find_one({"_id": document_id}, {"signature": 1, "bands": 1})
+        if not row:
+            continue
+        neighbors = best(row["signature"], await _candidates(db, document_id, row["bands"]))
+        await collection.update_one({"_id": document_id}, {"$set": {"neighbors": neighbors}})
+
+
+async def update(db, document_id: str, after: Optional[dict]):
+    """Recompute one document's neighbours and its place in the lists of others"""
+    import bodies
+
+    collection = db[RELATED_COLLECTION]
+    if after is None:
+        await collection.delete_one({"_id": document_id})
+        affected = await collection.distinct("_id", {"neighbors.id": document_id})
+        await collection.update_many({"neighbors.id": document_id}, {"$pull": {"neighbors": {"id": document_id}}})
+        await _refresh(db, affected)
+        return
+
+    doc = await bodies.hydrate(db, after)
+    source = fingerprint(doc)
+    current = await collection.find_one({"_id": document_id}, {"source": 1})
+    if current and current.get("source") == source:
+        return
+
+    signature = await asyncio.to_thread(minhash, features(doc))
+    bands = band_keys(signature)
+    neighbors = best(signature, await _candidates(db, document_id, bands))
+    await collection.replace_one({"_id": document_id}, entry(signature, source, neighbors), upsert=True)
+
+    # Take this document out of the lists it was in, then insert it where it now belongs
+    neighbor_ids = {neighbor["id"] for neighbor in neighbors}
+    previous = set(await collection.distinct("_id", {"neighbors.id": document_id}))
+    await collection.update_many({"neighbors.id": document_id}, {"$pull": {"neighbors": {"id": document_id}}})
+    for neighbor in neighbors:
+        await collection.update_one({"_id": neighbor["id"]}, {"$push": {"neighbors": {
+            "$each": [{"id": document_id, "score": neighbor["score"]}],
+            "$sort": {"score": -1},
+            "$slice": RELATED_NEIGHBORS,
+        }}})
+    await _refresh(db, previous - neighbor_ids)
+
+
+async def neighbors(db, document_id: str) -> Optional[List[dict]]:
+    """Stored neighbours of a document, or None when it has no entry yet"""
+    row = await db[RELATED_COLLECTION].find_one({"_id": document_id}, {"neighbors": 1})
+    return row["neighbors"] if row else None
+
+
+# Full rebuild (rebuild_related.py): every worker process holds all signatures
+# and their band buckets, and computes the lists of one slice of documents.
+_shared = {}
+
+
+def load_signatures(ids: List[str], sigs: List[List[int]]):
+    """Worker initializer"""
+    buckets = {}
+    for i, signature in enumerate(sigs):
+        for key in band_keys(signature):
+            buckets.setdefault(key, []).append(i)
+    _shared.update(ids=ids, sigs=sigs, buckets=buckets)
+
+
+def neighbor_slice(start: int, stop: int, limit: int = RELATED_NEIGHBORS) -> List[tuple]:
+    """Worker: [(id, neighbours)] for documents start..stop"""
+    ids, sigs, buckets = _shared["ids"], _shared["sigs"], _shared["buckets"]
+    result = []
+    for i in range(start, stop):
+        candidates = {j for key in band_keys(sigs[i]) for j in buckets[key] if j != i}
+        result.append((ids[i], best(sigs[i], ((ids[j], sigs[j]) for j in candidates), limit)))
+    return result
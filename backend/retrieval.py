@@ -0,0 +1,389 @@
+"""Hybrid document retrieval for search and LLM grounding.
+
+One in-process index serves ``/documents/search`` and the context builders of
+the chat and supplement-advice prompts. Two rankers run per query and are
+fused with reciprocal-rank fusion (RRF):
+
+- lexical: BM25 over word tokens, with title and tag tokens weighted up;
+- vector: cosine similarity of hashed character-trigram vectors of the title,
+  tags and the start of the body. It matches inflections and compounds
+  ("darm" vs "darmgezondheid") that exact tokens miss. No embedding model is
+  available to this service, so this trigram vector stands in for one.
+  ``score_vector`` is the place to plug one in.
+
+Candidates can be filtered by category, tag and language
+(``original_language``, where empty means Dutch), and fused scores get a
+recency boost. Each query has a latency budget: rarest terms and features are
+scored first, and a ranker that runs out of time returns what it has
+(``degraded`` in the query info). The index is built at startup, updated by
+``server.on_document_write`` and synced from the event outbox, so writes from
+other workers also show up. Until it is ready, callers fall back to their old
+regex queries. retrieval_eval.py measures relevance and latency offline.
+"""
+import asyncio
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+import events
+
+RETRIEVAL_ENABLED = os.environ.get('RETRIEVAL_ENABLED', '1') == '1'
+RETRIEVAL_RRF_K = int(os.environ.get('RETRIEVAL_RRF_K', '60'))
+RETRIEVAL_CANDIDATES = int(os.environ.get('RETRIEVAL_CANDIDATES', '200'))
+RETRIEVAL_MAX_DOC_CHARS = int(os.environ.get('RETRIEVAL_MAX_DOC_CHARS', '100000'))
+RETRIEVAL_VECTOR_CHARS = int(os.environ.get('RETRIEVAL_VECTOR_CHARS', '4000'))
+RETRIEVAL_RECENCY_WEIGHT = float(os.environ.get('RETRIEVAL_RECENCY_WEIGHT', '0.1'))
+RETRIEVAL_RECENCY_HALF_LIFE_DAYS = float(os.environ.get('RETRIEVAL_RECENCY_HALF_LIFE_DAYS', '365'))
+RETRIEVAL_SEARCH_BUDGET_MS = float(os.environ.get('RETRIEVAL_SEARCH_BUDGET_MS', '150'))
+RETRIEVAL_CONTEXT_BUDGET_MS = float(os.environ.get('RETRIEVAL_CONTEXT_BUDGET_MS', '300'))
+RETRIEVAL_SYNC_SECONDS = float(os.environ.get('RETRIEVAL_SYNC_SECONDS', '5'))
+# Vector hits must share at least this fraction of the query's trigrams
+RETRIEVAL_VECTOR_MIN_COVERAGE = float(os.environ.get('RETRIEVAL_VECTOR_MIN_COVERAGE', '0.5'))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 3
+TAG_WEIGHT = 2
+VECTOR_DIM = 1 << 20
+
+STOPWORDS = {
+    "de", "het", "een", "en", "van", "in", "is", "op", "te", "met", "voor", "dat", "die", "aan",
+    "als", "bij", "of", "om", "ook", "tot", "uit", "wordt", "zijn", "er", "niet", "naar", "maar",
+    "the", "and", "of", "to", "in", "for", "with", "on", "is", "are", "by", "an", "or",
+}
+
+_TOKEN = re.compile(r'[0-9a-z]+')
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents (patiënt -> patient)"""
+    text = text.lower()
+    if text.isascii():
+        return text
+    # Tokens are [0-9a-z] only, so dropping what does not fold to ASCII loses nothing
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+
+
+class _FoldTable(dict):
+    """str.translate table folding every character to exactly one character, filled on first use"""
+
+    def __missing__(self, code: int) -> str:
+        folded = normalize(chr(code))
+        self[code] = folded[0] if folded else ' '
+        return self[code]
+
+
+_FOLD = _FoldTable()
+
+
+def fold(text: str) -> str:
+    """normalize() that keeps the length, so offsets in the result are offsets in text"""
+    return text.translate(_FOLD)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(normalize(text)) if token not in STOPWORDS]
+
+
+def trigram_features(tokens: Iterable[str]) -> Counter:
+    """Hashed character trigrams of the tokens, padded so word starts and ends count"""
+    features = Counter()
+    for token, count in Counter(tokens).items():
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            features[zlib.crc32(padded[i:i + 3].encode('utf-8')) % VECTOR_DIM] += count
+    return features
+
+
+def _parse_time(value) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Entry:
+    __slots__ = ("id", "category", "tags", "language", "created", "length", "terms", "features")
+
+    def __init__(self, doc: dict):
+        self.id = doc['id']
+        self.category = doc.get('category')
+        self.tags = {normalize(tag) for tag in doc.get('tags') or []}
+        self.language = (doc.get('original_language') or 'nl').lower()
+        self.created = _parse_time(doc.get('created_at'))
+
+        title = tokenize(doc.get('title') or '')
+        tags = tokenize(' '.join(doc.get('tags') or []))
+        content = doc.get('content') or ''
+        body = tokenize(content[:RETRIEVAL_MAX_DOC_CHARS])
+
+        terms = Counter(body)
+        for token in title:
+            terms[token] += TITLE_WEIGHT
+        for token in tags:
+            terms[token] += TAG_WEIGHT
+        self.terms = terms
+        self.length = sum(terms.values())
+
+        features = trigram_features(title + tags + tokenize(content[:RETRIEVAL_VECTOR_CHARS]))
+        weights = {feature: 1 + math.log(count) for feature, count in features.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        self.features = {feature: w / norm for feature, w in weights.items()}
+
+
+class Hit:
+    __slots__ = ("id", "score", "lexical_rank", "vector_rank")
+
+    def __init__(self, id: str, score: float, lexical_rank: Optional[int], vector_rank: Optional[int]):
+        self.id = id
+        self.score = score
+        self.lexical_rank = lexical_rank
+        self.vector_rank = vector_rank
+
+
+class RetrievalIndex:
+    """Inverted indexes for BM25 terms and trigram vector features"""
+
+    def __init__(self):
+        self.entries = {}
+        self.postings = {}
+        self.feature_postings = {}
+        self.total_length = 0
+        # Bumped on every change, so cached search results can tell they are stale
+        self.generation = 0
+        self.ready = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, doc: dict):
+        entry = Entry(doc)
+        with self._lock:
+            self._remove(entry.id)
+            self.generation += 1
+            self.entries[entry.id] = entry
+            self.total_length += entry.length
+            for term, tf in entry.terms.items():
+                self.postings.setdefault(term, {})[entry.id] = tf
+            for feature, weight in entry.features.items():
+                self.feature_postings.setdefault(feature, {})[entry.id] = weight
+
+    def add_many(self, docs: Iterable[dict]):
+        for doc in docs:
+            self.add(doc)
+
+    def remove(self, document_id: str):
+        with self._lock:
+            self._remove(document_id)
+
+    def _remove(self, document_id: str):
+        entry = self.entries.pop(document_id, None)
+        if entry is None:
+            return
+        self.generation += 1
+        self.total_length -= entry.length
+        for term in entry.terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(document_id, None)
+                if not posting:
+                    del self.postings[term]
+        for feature in entry.features:
+            posting = self.feature_postings.get(feature)
+            if posting is not None:
+                posting.pop(document_id, None)
+                if not posting:
+                    del self.feature_postings[feature]
+
+    # Ranking
+
+    def _allowed(self, categories, tags, language):
+        if not categories and not tags and not language:
+            return None
+        categories = set(categories or ())
+        tags = {normalize(tag) for tag in tags or ()}
+        language = language.lower() if language else None
+
+        def allowed(entry: Entry) -> bool:
+            return ((not categories or entry.category in categories)
+                    and (not tags or not entry.tags.isdisjoint(tags))
+                    and (not language or entry.language == language))
+        return allowed
+
+    def score_lexical(self, terms: List[str], allowed, deadline: float) -> tuple:
+        """BM25 scores of the candidates; rarest terms first so a budget cut keeps the most informative ones"""
+        n = len(self.entries)
+        average_length = self.total_length / n if n else 1.0
+        scores = {}
+        present = sorted((t for t in set(terms) if t in self.postings), key=lambda t: len(self.postings[t]))
+        for term in present:
+            if time.perf_counter() > deadline:
+                return scores, True
+            posting = self.postings[term]
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for document_id, tf in posting.items():
+                entry = self.entries[document_id]
+                if allowed is not None and not allowed(entry):
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * entry.length / average_length)
+                scores[document_id] = scores.get(document_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores, False
+
+    def score_vector(self, terms: List[str], allowed, deadline: float) -> tuple:
+        """Cosine similarity of trigram vectors, idf-weighted on the query side"""
+        n = len(self.entries)
+        query = trigram_features(terms)
+        present = sorted((f for f in query if f in self.feature_postings), key=lambda f: len(self.feature_postings[f]))
+        # Trigrams found in most documents say little and cost the most to score
+        if len(present) > 3:
+            present = [f for f in present if len(self.feature_postings[f]) <= n * 0.5]
+        required = RETRIEVAL_VECTOR_MIN_COVERAGE * sum(
+            count for f, count in query.items() if f in present or f not in self.feature_postings
+        )
+        scores = {}
+        matched = {}
+        cut = False
+        for feature in present:
+            if time.perf_counter() > deadline:
+                cut = True
+                break
+            posting = self.feature_postings[feature]
+            weight = (1 + math.log(query[feature])) * math.log(1 + n / len(posting))
+            for document_id, value in posting.items():
+                if allowed is not None and not allowed(self.entries[document_id]):
+                    continue
+                scores[document_id] = scores.get(document_id, 0.0) + weight * value
+                matched[document_id] = matched.get(document_id, 0) + query[feature]
+        return {d: score for d, score in scores.items() if matched[d] >= required}, cut
+
+    def search(self, query: str, limit: int = 20, categories: Optional[Iterable[str]] = None,
+               tags: Optional[Iterable[str]] = None, language: Optional[str] = None,
+               budget_ms: float = RETRIEVAL_SEARCH_BUDGET_MS, mode: str = "hybrid") -> tuple:
+        """Top `limit` hits and timing info; mode is hybrid, lexical or vector"""
+        started = time.perf_counter()
+        deadline = started + budget_ms / 1000
+        terms = tokenize(query)
+        info = {"terms": terms, "degraded": False}
+        if not terms:
+            return [], info
+
+        with self._lock:
+            allowed = self._allowed(categories, tags, language)
+            rankings = {}
+            if mode in ("hybrid", "lexical"):
+                scores, cut = self.score_lexical(terms, allowed, deadline)
+                rankings["lexical"] = sorted(scores, key=scores.get, reverse=True)[:RETRIEVAL_CANDIDATES]
+                info["degraded"] |= cut
+                info["lexical_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            if mode in ("hybrid", "vector"):
+                vector_started = time.perf_counter()
+                if time.perf_counter() < deadline:
+                    scores, cut = self.score_vector(terms, allowed, deadline)
+                    info["degraded"] |= cut
+                else:
+                    scores = {}
+                    info["degraded"] = True
+                rankings["vector"] = sorted(scores, key=scores.get, reverse=True)[:RETRIEVAL_CANDIDATES]
+                info["vector_ms"] = round((time.perf_counter() - vector_started) * 1000, 3)
+
+            fused = {}
+            ranks = {}
+            for name, ranking in rankings.items():
+                for rank, document_id in enumerate(ranking):
+                    fused[document_id] = fused.get(document_id, 0.0) + 1.0 / (RETRIEVAL_RRF_K + rank + 1)
+                    ranks.setdefault(document_id, {})[name] = rank + 1
+
+            if RETRIEVAL_RECENCY_WEIGHT:
+                now = time.time()
+                for document_id in fused:
+                    created = self.entries[document_id].created
+                    if created:
+                        age_days = max(0.0, now - created) / 86400
+                        fused[document_id] *= 1 + RETRIEVAL_RECENCY_WEIGHT * 0.5 ** (age_days / RETRIEVAL_RECENCY_HALF_LIFE_DAYS)
+
+        top = sorted(fused, key=fused.get, reverse=True)[:limit]
+        hits = [Hit(document_id, fused[document_id], ranks[document_id].get("lexical"), ranks[document_id].get("vector"))
+                for document_id in top]
+        info["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return hits, info
+
+
+def best_passage(content: str, query: str, size: int) -> str:
+    """The `size`-character window of content with the most query term occurrences"""
+    if len(content) <= size:
+        return content
+    terms = set(tokenize(query))
+    if not terms:
+        return content[:size]
+    positions = [m.start() for m in _TOKEN.finditer(fold(content)) if m.group() in terms]
+    if not positions:
+        return content[:size]
+
+    best_start, best_count = 0, 0
+    right = 0
+    for left, start in enumerate(positions):
+        while right < len(positions) and positions[right] < start + size:
+            right += 1
+        if right - left > best_count:
+            best_start, best_count = start, right - left
+    # Start at a sentence or line boundary shortly before the first match
+    boundary = max(content.rfind('. ', 0, best_start), content.rfind('\n', 0, best_start))
+    if boundary != -1 and best_start - boundary < size // 2:
+        best_start = boundary + 1
+    return content[best_start:best_start + size].strip()
+
+
+# Shared index of this worker
+
+BUILD_PROJECTION = {"_id": 0, "id": 1, "title": 1, "content": 1, "content_external": 1, "category": 1,
+                    "tags": 1, "original_language": 1, "created_at": 1}
+
+follower = events.Follower("Retrieval index", RetrievalIndex, BUILD_PROJECTION, unit="documents",
+                           interval=RETRIEVAL_SYNC_SECONDS)
+build, update, sync, maintain = follower.build, follower.update, follower.sync, follower.maintain
+
+
+async def search(query: str, limit: int = 20, categories: Optional[Iterable[str]] = None,
+                 tags: Optional[Iterable[str]] = None, language: Optional[str] = None,
+                 budget_ms: float = RETRIEVAL_SEARCH_BUDGET_MS) -> Optional[List[Hit]]:
+    """Ranked hits, or None while the index is unavailable (callers fall back to regex queries)"""
+    if not is_ready():
+        return None
+    hits, info = await asyncio.to_thread(
+        follower.index.search, query, limit, categories, tags, language, budget_ms
+    )
+    if info["degraded"]:
+        logging.warning(f"Retrieval over budget ({budget_ms}ms) for query {query!r}: {info}")
+    return hits
+
+
+def is_ready() -> bool:
+    return RETRIEVAL_ENABLED and follower.index.ready
+
+
+def generation() -> tuple:
+    """Identifies the current index contents (rebuilds swap in a new index)"""
+    return (follower.builds, follower.index.generation)
+
+
+def stats() -> dict:
+    index = follower.index
+    return {
+        "enabled": RETRIEVAL_ENABLED,
+        "ready": index.ready,
+        "documents": len(index),
+        "terms": len(index.postings),
+        "features": len(index.feature_postings),
+        "synced_seq": follower.synced_seq,
+    }
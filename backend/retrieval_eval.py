@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Offline relevance and latency evaluation of document retrieval
+
+Compares the hybrid ranking of retrieval.py with its lexical (BM25) and vector
+rankers alone and with the old regex search (first 100 matches in storage
+order). Reports nDCG@10, MRR@10, recall@100 and p50/p95 query latency.
+
+By default it runs on the synthetic corpus of benchmark.py; its relevance
+judgments come from the topics in each document's title and tags. With
+--qrels it evaluates the real archive (MONGO_URL/DB_NAME from .env) against a
+JSON list of judged queries:
+    [{"query": "magnesium slaap", "relevant": {"<document id>": 2, "<document id>": 1}}]
+
+Examples:
+    python retrieval_eval.py --size 5000
+    python retrieval_eval.py --qrels qrels.json --output eval.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+import retrieval  # noqa: E402
+from benchmark import make_document, percentile  # noqa: E402
+
+ROOT_DIR = Path(__file__).parent
+
+MODES = ["hybrid", "lexical", "vector", "regex"]
+
+# (query, topics it asks about) for the synthetic corpus
+SYNTHETIC_QUERIES = [
+    ("magnesium", ["magnesium"]),
+    ("vitamine D", ["vitamine d"]),
+    ("darm", ["darmgezondheid"]),
+    ("stress", ["stress"]),
+    ("omega-3", ["omega-3"]),
+    ("slaap", ["slaap"]),
+    ("zink", ["zink"]),
+    ("migraine", ["migraine"]),
+    ("magnesium bij slaapproblemen", ["magnesium", "slaap"]),
+    ("tekort aan vitamine C en vermoeidheid", ["vitamine c", "vermoeidheid"]),
+    ("ontstekingsremmende kurkuma", ["kurkuma", "ontsteking"]),
+    ("schildklier en cortisol", ["schildklier", "cortisol"]),
+    ("microbioom en probiotica", ["microbioom", "probiotica"]),
+    ("ijzertekort", ["ijzer"]),
+    ("diabetes cholesterol", ["diabetes", "cholesterol"]),
+]
+
+_TITLE = re.compile(r"(.+) en (.+) \(\d+\)$")
+
+
+def synthetic_qrels(docs: list) -> list:
+    """Grade 2 for a document whose main title topic is asked for, 1 for a secondary title topic or tag"""
+    qrels = []
+    for query, topics in SYNTHETIC_QUERIES:
+        relevant = {}
+        for doc in docs:
+            match = _TITLE.match(doc["title"])
+            main, other = (match.group(1).lower(), match.group(2).lower()) if match else ("", "")
+            tags = {tag.lower() for tag in doc["tags"]}
+            grade = sum(2 if topic == main else 1 if topic == other or topic in tags else 0 for topic in topics)
+            if grade:
+                relevant[doc["id"]] = grade
+        qrels.append({"query": query, "relevant": relevant})
+    return qrels
+
+
+def regex_search(docs: list, query: str, limit: int = 100) -> list:
+    """What /documents/search did before: case-insensitive regex, first matches in storage order"""
+    try:
+        pattern = re.compile(query, re.IGNORECASE)
+    except re.error:
+        return []
+    matches = []
+    for doc in docs:
+        if pattern.search(doc["title"]) or pattern.search(doc.get("content") or "") or \
+                any(pattern.search(tag) for tag in doc.get("tags") or []):
+            matches.append(doc["id"])
+            if len(matches) >= limit:
+                break
+    return matches
+
+
+def ndcg(ranked: list, relevant: dict, k: int = 10) -> float:
+    dcg = sum(relevant.get(doc_id, 0) / math.log2(i + 2) for i, doc_id in enumerate(ranked[:k]))
+    ideal = sorted(relevant.values(), reverse=True)[:k]
+    idcg = sum(grade / math.log2(i + 2) for i, grade in enumerate(ideal))
+    return dcg / idcg if idcg else 0.0
+
+
+def reciprocal_rank(ranked: list, relevant: dict, k: int = 10) -> float:
+    for i, doc_id in enumerate(ranked[:k]):
+        if relevant.get(doc_id, 0) > 0:
+            return 1.0 / (i + 1)
+    return 0.0
+
+
+def recall(ranked: list, relevant: dict, k: int = 100) -> float:
+    judged = {doc_id for doc_id, grade in relevant.items() if grade > 0}
+    return len(judged & set(ranked[:k])) / len(judged) if judged else 0.0
+
+
+def evaluate(index, docs: list, qrels: list, modes: list, budget_ms: float, repeat: int) -> dict:
+    results = {}
+    for mode in modes:
+        scores = {"ndcg@10": [], "mrr@10": [], "recall@100": []}
+        latencies = []
+        degraded = 0
+        for judged in qrels:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if mode == "regex":
+                    ranked = regex_search(docs, judged["query"])
+                else:
+                    hits, info = index.search(judged["query"], limit=100, budget_ms=budget_ms, mode=mode)
+                    ranked = [hit.id for hit in hits]
+                    degraded += info["degraded"]
+                latencies.append((time.perf_counter() - started) * 1000)
+            scores["ndcg@10"].append(ndcg(ranked, judged["relevant"]))
+            scores["mrr@10"].append(reciprocal_rank(ranked, judged["relevant"]))
+            scores["recall@100"].append(recall(ranked, judged["relevant"]))
+        latencies.sort()
+        results[mode] = {
+            **{name: round(sum(values) / len(values), 4) for name, values in scores.items()},
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "degraded": degraded,
+        }
+    return results
+
+
+async def load_archive() -> list:
+    from dotenv import load_dotenv
+    import bodies
+    import mongo
+
+    load_dotenv(ROOT_DIR / '.env')
+    client, _ = mongo.create_client()
+    db = client[os.environ['DB_NAME']]
+    return [doc async for batch in bodies.batches(db, retrieval.BUILD_PROJECTION, 500) for doc in batch]
+
+
+def main(args) -> dict:
+    if args.qrels:
+        docs = asyncio.run(load_archive())
+        qrels = json.loads(Path(args.qrels).read_text())
+    else:
+        rng = random.Random(args.seed)
+        now = datetime.now(timezone.utc)
+        docs = [make_document(rng, i, now) for i in range(args.size)]
+        qrels = synthetic_qrels(docs)
+
+    started = time.perf_counter()
+    index = retrieval.RetrievalIndex()
+    index.add_many(docs)
+    build_seconds = time.perf_counter() - started
+    print(f"Indexed {len(docs)} documents in {build_seconds:.1f}s; {len(qrels)} judged queries")
+
+    results = evaluate(index, docs, qrels, args.modes, args.budget_ms, args.repeat)
+    print(f"{'mode':<8} {'nDCG@10':>8} {'MRR@10':>8} {'R@100':>8} {'p50 ms':>9} {'p95 ms':>9} {'degraded':>9}")
+    for mode, row in results.items():
+        print(f"{mode:<8} {row['ndcg@10']:>8.3f} {row['mrr@10']:>8.3f} {row['recall@100']:>8.3f} "
+              f"{row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['degraded']:>9}")
+
+    report = {
+        "corpus": "archive" if args.qrels else "synthetic",
+        "documents": len(docs),
+        "queries": len(qrels),
+        "budget_ms": args.budget_ms,
+        "build_seconds": round(build_seconds, 3),
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Wrote {args.output}")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2000, help="synthetic corpus size")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--qrels", help="judged queries for the real archive (JSON)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--budget-ms", type=float, default=retrieval.RETRIEVAL_SEARCH_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per query")
+    parser.add_argument("--output", help="write the report as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,9 +1,11 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form, Header, Request, Response, BackgroundTasks, Query
+from fastapi.responses import StreamingResponse, FileResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
+from starlette.datastructures import Headers
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from bson import ObjectId
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
@@ -13,31 +15,64 @@ import uuid
 from datetime import datetime, timezone
 import base64
 import io
-from emergentintegrations.llm.chat import LlmChat, UserMessage
 import json
-import PyPDF2
-from docx import Document as DocxDocument
 import tempfile
 import asyncio
 import re
+import profiling
+import cache
+import http_caching
+import bodies
+import ocr
+import thumbnails
+import enrichment
+import events
+import retrieval
+import suggest
+import mongo
+import lazy
+import uploads
+import upload_sessions
+import generations
+import digest
+import related
+import graph
+import citations
+import chats
+from derivations import generate_document_preview, generate_oneliner_mock, generate_consumer_blog_title_mock
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection - async for normal operations
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Heavy integrations, imported on first use to keep worker startup fast (see lazy.py)
+LlmChat = lazy.LazyAttribute('emergentintegrations.llm.chat', 'LlmChat')
+UserMessage = lazy.LazyAttribute('emergentintegrations.llm.chat', 'UserMessage')
 
-# Sync MongoDB client for GridFS operations
-sync_client = MongoClient(mongo_url)
-sync_db = sync_client[os.environ['DB_NAME']]
+# MongoDB connection, created per worker process in the lifespan (see mongo.py for pool settings)
+client = None
+db = None
+pool_monitor = None
+
+# Token guarding admin-only endpoints (profiling); admin endpoints are disabled when unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Connect to MongoDB and run background tasks for the lifetime of the worker"""
+    global client, db, pool_monitor
+    client, pool_monitor = mongo.create_client()
+    db = client[os.environ['DB_NAME']]
+    await start_background_tasks()
+    yield
+    await shutdown_db_client()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
+# Upload routes spool large files to disk at their own threshold
+upload_router = APIRouter(prefix="/api", route_class=uploads.SpooledUploadRoute)
 
 # Define Models
 class Document(BaseModel):
@@ -47,6 +82,7 @@ class Document(BaseModel):
     file_type: str
     content: str
     content_preview: Optional[str] = None  # Short excerpt for UI display
+    content_external: bool = False  # Full content lives in document_bodies, `content` holds the head
     is_large_document: bool = False  # Flag for large documents
     one_liner: Optional[str] = None  # One sentence summary for Make.com automation
     consumer_blog_title: Optional[str] = None  # Consumer-friendly blog title
@@ -57,9 +93,23 @@ class Document(BaseModel):
     file_size: Optional[int] = None
     original_filename: Optional[str] = None
     has_original_file: bool = False
+    original_sha256: Optional[str] = None  # SHA-256 of the uploaded file
     original_language: Optional[str] = None
     was_translated: bool = False
 
+# Read path: project raw Mongo rows onto the Document fields and encode them with
+# orjson directly. Rows are validated when they are written, so list endpoints
+# skip building Document models and FastAPI's second response validation.
+DOCUMENT_PROJECTION = {**{name: 1 for name in Document.model_fields}, "_id": 0}
+DOCUMENT_DEFAULTS = {
+    name: field.default for name, field in Document.model_fields.items()
+    if field.default_factory is None and not field.is_required()
+}
+
+def document_rows(rows: List[dict]) -> List[dict]:
+    """Fill defaults for fields missing in older rows, matching Document's shape"""
+    return [{**DOCUMENT_DEFAULTS, **row} for row in rows]
+
 class DocumentCreate(BaseModel):
     title: str
     category: str
@@ -127,10 +177,87 @@ class TreatmentPlanRequest(BaseModel):
     patient_info: str
     symptoms: str
     diagnosis: str
+    bypass_cache: bool = False  # generate without reading or storing a cached plan
+    refresh_cache: bool = False  # generate and replace the cached plan
+
+class UploadSessionCreate(BaseModel):
+    kind: str = "document"  # "document" (PDF, DOCX, TXT, image) or "voice"
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+    title: Optional[str] = None
+    category: Optional[str] = None
 
 class SupplementAdviceRequest(BaseModel):
     condition: str
     patient_details: str
+    bypass_cache: bool = False
+    refresh_cache: bool = False
+
+# Helper function to guard admin-only endpoints
+def require_admin_token(token: Optional[str]):
+    """Reject requests without a valid admin token"""
+    if not ADMIN_TOKEN or token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Geen toegang")
+
+# Helper functions for cached document reads and write propagation
+async def find_document(document_id: str) -> Optional[dict]:
+    """Read-through cached lookup of a raw document by id, with its full content"""
+    doc = cache.document_cache.get(document_id)
+    if doc is cache.MISSING:
+        doc = await bodies.hydrate(db, await db.documents.find_one({"id": document_id}))
+        if doc:
+            cache.document_cache.set(document_id, doc)
+    return doc
+
+async def on_document_write(document_id: str, before: Optional[dict] = None, after: Optional[dict] = None):
+    """Propagate a document create/update/delete to caches and the event outbox"""
+    tags = set((before or {}).get('tags') or []) | set((after or {}).get('tags') or [])
+    cache.invalidate_document(document_id, tags)
+    try:
+        await cache.bump_write_version(db)
+    except Exception as e:
+        logging.error(f"Error bumping archive write version for {document_id}: {str(e)}")
+    seq = None
+    try:
+        seq = await events.record(db, document_id, before, after)
+    except Exception as e:
+        logging.error(f"Error recording event for {document_id}: {str(e)}")
+    # The seq lets the outbox followers skip this write when they sync
+    try:
+        await retrieval.update(db, document_id, after, seq)
+    except Exception as e:
+        logging.error(f"Error updating retrieval index for {document_id}: {str(e)}")
+    try:
+        await suggest.update(db, document_id, after, seq)
+    except Exception as e:
+        logging.error(f"Error updating suggestions for {document_id}: {str(e)}")
+    try:
+        await digest.update(db, document_id, after, seq)
+    except Exception as e:
+        logging.error(f"Error updating knowledge digest for {document_id}: {str(e)}")
+    try:
+        await related.update(db, document_id, after)
+    except Exception as e:
+        logging.error(f"Error updating related documents for {document_id}: {str(e)}")
+    try:
+        await graph.update(db, document_id, after)
+    except Exception as e:
+        logging.error(f"Error updating entity graph for {document_id}: {str(e)}")
+    try:
+        await citations.update(db, document_id, after)
+    except Exception as e:
+        logging.error(f"Error updating citation index for {document_id}: {str(e)}")
+
+async def insert_document(doc_dict: dict) -> dict:
+    """Insert a new document, moving a large body to document_bodies"""
+    row = {**doc_dict, **await bodies.store_content(db, doc_dict['id'], doc_dict['content'])}
+    row['chunk_hashes'] = enrichment.chunk_hashes(doc_dict['content'])
+    await db.documents.insert_one(row)
+    await on_document_write(doc_dict['id'], after=row)
+    # Respond with the full content, without Mongo's _id
+    row.pop('_id', None)
+    return {**row, "content": doc_dict['content']}
 
 # Helper function to detect language and translate if needed
 async def translate_to_dutch_if_needed(content: str, title: str) -> tuple[str, str]:
@@ -193,33 +320,67 @@ Nederlandse vertaling:"""
         # Return original content if translation fails
         return content, "unknown"
 
+IMAGE_MEDIA_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'bmp': 'image/bmp'
+}
+
+# Helper functions for GridFS (original files and thumbnails)
+async def put_file(data, filename: str, content_type: str, **metadata) -> ObjectId:
+    """Store bytes or a readable stream in GridFS and return its id"""
+    fs = AsyncIOMotorGridFSBucket(db)
+    return await fs.upload_from_stream(filename, data, metadata={"contentType": content_type, **metadata})
+
+async def read_file(file_id: str) -> bytes:
+    fs = AsyncIOMotorGridFSBucket(db)
+    grid_out = await fs.open_download_stream(ObjectId(file_id))
+    return await grid_out.read()
+
+async def delete_file(file_id: str):
+    await AsyncIOMotorGridFSBucket(db).delete(ObjectId(file_id))
+
+# Helper function to render and store a thumbnail next to the original file
+async def store_thumbnail(document_id: str, file_content, file_type: str) -> Optional[str]:
+    """Render a WebP thumbnail and store it in GridFS, returning its file id"""
+    thumbnail = await thumbnails.generate(file_content, file_type)
+    if not thumbnail:
+        return None
+    thumbnail_id = await put_file(
+        thumbnail,
+        f"thumbnail-{document_id}.webp",
+        thumbnails.THUMBNAIL_MEDIA_TYPE,
+        document_id=document_id
+    )
+    return str(thumbnail_id)
+
 # Helper function to extract text from files
-async def extract_text_from_file(file: UploadFile) -> str:
-    """Extract text from uploaded file"""
-    content = await file.read()
-    
-    if file.filename.endswith('.pdf'):
+def extract_text_from_file(upload: uploads.UploadBuffer) -> str:
+    """Extract text from uploaded file (blocking; run it in a thread)"""
+    if upload.filename.endswith('.pdf'):
         # Extract from PDF
-        pdf_file = io.BytesIO(content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
+        with upload.open() as pdf_file:
+            pdf_reader = lazy.load('PyPDF2').PdfReader(pdf_file)
+            text = ""
+            for page in pdf_reader.pages:
+                text += page.extract_text() + "\n"
+                # Drop parsed objects (embedded images) of finished pages instead of keeping the whole PDF
+                pdf_reader.resolved_objects.clear()
         return text
     
-    elif file.filename.endswith('.docx'):
+    elif upload.filename.endswith('.docx'):
         # Extract from DOCX
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as tmp_file:
-            tmp_file.write(content)
-            tmp_file.flush()
-            doc = DocxDocument(tmp_file.name)
+        with upload.open() as docx_file:
+            doc = lazy.load('docx').Document(docx_file)
             text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            os.unlink(tmp_file.name)
         return text
     
-    elif file.filename.endswith('.txt'):
+    elif upload.filename.endswith('.txt'):
         # Extract from TXT
-        return content.decode('utf-8')
+        return upload.text('utf-8')
     
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type")
@@ -289,306 +450,74 @@ Antwoord alleen met de referenties of GEEN."""
         if response.strip().upper() == "GEEN":
             return []
         
-        # Parse references
-        references = [ref.strip() for ref in response.split('\n') if ref.strip() and not ref.strip().startswith('-')]
-        return references[:10]  # Max 10 references
+        # Parse references, one per line; the requested format starts lines with "- "
+        references = [citations.BULLET.sub('', ref.strip()) for ref in response.split('\n')]
+        return [ref for ref in references if ref][:10]  # Max 10 references
     except Exception as e:
         logging.error(f"Error extracting references: {str(e)}")
         return []
 
-# Helper functions
-def generate_document_preview(content: str, title: str = "") -> tuple[str, bool]:
-    """Generate intelligent preview for documents and determine if it's a large document"""
-    
-    # Define thresholds
-    LARGE_DOCUMENT_THRESHOLD = 2000  # characters
-    PREVIEW_LENGTH = 800  # characters for preview
-    
-    content_length = len(content)
-    is_large = content_length > LARGE_DOCUMENT_THRESHOLD
-    
-    if not is_large:
-        # Small document - return full content
-        return content, False
-    
-    # Large document - generate intelligent preview
-    lines = content.split('\n')
-    preview_lines = []
-    char_count = 0
-    
-    # Always include title if provided
-    if title:
-        preview_lines.append(f"Samenvatting van: {title}")
-        preview_lines.append("")
-    
-    # Try to get meaningful content from the beginning
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Skip headers that might be metadata
-        if line.lower().startswith(('auteur:', 'bron:', 'datum:', 'pagina:', 'hoofdstuk:')):
-            continue
-            
-        # Add line if it contributes to understanding
-        if char_count + len(line) <= PREVIEW_LENGTH:
-            preview_lines.append(line)
-            char_count += len(line) + 2  # +2 for \n\n
-        else:
-            # Add partial line and break
-            remaining_chars = PREVIEW_LENGTH - char_count
-            if remaining_chars > 50:  # Only add if meaningful portion remains
-                preview_lines.append(line[:remaining_chars] + "...")
-            break
-    
-    # Add summary footer
-    preview_lines.append("")
-    preview_lines.append(f"[Dit is een preview van een document met {content_length:,} karakters. De volledige inhoud is beschikbaar voor AI verwerking en blog generatie.]")
-    
-    preview = "\n\n".join(preview_lines)
-    
-    return preview, is_large
-
-def generate_oneliner_mock(title: str, content: str) -> str:
-    """Generate a concise one-sentence summary for Make.com automation"""
-    
-    # Simple mock implementation - extract key concepts
-    words = content.lower().split()
-    
-    # Common orthomolecular/health keywords to look for
-    health_keywords = [
-        'vitamine', 'mineralen', 'supplement', 'voeding', 'gezondheid', 
-        'orthomoleculair', 'behandeling', 'therapie', 'preventie',
-        'darm', 'microbioom', 'ontstekingsremming', 'antioxidant',
-        'stress', 'energie', 'immuniteit', 'herstel', 'balans'
-    ]
-    
-    # Find relevant keywords in content
-    found_keywords = [kw for kw in health_keywords if kw in ' '.join(words)][:3]
-    
-    # Generate context-aware one-liner
-    if 'vitamine' in found_keywords or 'mineralen' in found_keywords:
-        return f"Onderzoek naar de rol van vitamines en mineralen bij {title.lower()}, met focus op orthomoleculaire behandelingsmogelijkheden."
-    elif 'darm' in found_keywords or 'microbioom' in found_keywords:
-        return f"Inzichten over darmgezondheid en microbioom in relatie tot {title.lower()}, belangrijk voor holistische gezondheidszorg."
-    elif 'ontstekingsremming' in found_keywords or 'antioxidant' in found_keywords:
-        return f"Evidence voor ontstekingsremmende en antioxidantrijke interventies bij {title.lower()}, geschikt voor natuurgeneeskundige praktijk."
-    elif 'stress' in found_keywords or 'energie' in found_keywords:
-        return f"Natuurlijke strategieën voor stress- en energiemanagement gerelateerd aan {title.lower()}, toepasbaar in orthomoleculaire behandeling."
-    else:
-        # Generic health-focused one-liner
-        return f"Praktische inzichten over {title.lower()} vanuit orthomoleculair perspectief, relevant voor natuurgeneeskundige behandeling en preventie."
-
-def generate_consumer_blog_title_mock(title: str, content: str) -> str:
-    """Generate consumer-friendly blog title based on actual document content"""
-    import random
-    import re
-    
-    # Extract key concepts, nutrients, and topics from the actual content
-    content_lower = content.lower()
-    
-    # Extract specific nutrients, vitamins, minerals mentioned in content
-    nutrients = []
-    vitamin_pattern = r'\b(vitamine?\s*[a-z0-9]+|vitamin\s*[a-z0-9]+|foliumzuur|biotine|niacine|riboflavine|thiamine)\b'
-    mineral_pattern = r'\b(magnesium|calcium|ijzer|zink|selenium|jodium|kalium|fosfor|chroom|mangaan|koper)\b'
-    supplement_pattern = r'\b(omega[- ]?3|probiotica|prebiotica|coq10|co-enzym|kurkuma|ginkgo|ginseng|spirulina|chlorella)\b'
-    condition_pattern = r'\b(diabetes|hypertensie|cholesterol|artritis|fibromyalgie|migraine|eczeem|psoriasis|astma|allergieën?|depressie|angst|adhd|autisme|alzheimer|parkinson|kanker|hart[- ]?vaatziekten?)\b'
-    
-    # Find all matches
-    vitamins = re.findall(vitamin_pattern, content_lower)
-    minerals = re.findall(mineral_pattern, content_lower)  
-    supplements = re.findall(supplement_pattern, content_lower)
-    conditions = re.findall(condition_pattern, content_lower)
-    
-    # Also look for food items and health topics
-    foods = []
-    food_patterns = [
-        r'\b(groenten?|fruit|vis|vlees|noten|zaden|graanproducten?|peulvruchten?|oliën?|kruiden?)\b',
-        r'\b(broccoli|spinazie|wortel|biet|avocado|blauwe bessen?|zalm|sardines?|walnoten|lijnzaad|kurkuma|gember)\b'
-    ]
-    for pattern in food_patterns:
-        foods.extend(re.findall(pattern, content_lower))
-    
-    # Generate content-specific blog titles based on what's actually in the document
-    blog_options = []
-    
-    # Vitamin-specific titles
-    for vitamin in set(vitamins):
-        if 'vitamine d' in vitamin or 'vitamin d' in vitamin:
-            blog_options.extend([
-                "vitamine D: waarom heb je het nodig?",
-                "hoe optimaliseer je vitamine D natuurlijk",
-                "vitamine D tekort herkennen en aanpakken",
-                "de beste bronnen van vitamine D",
-                "vitamine D en je immuunsysteem"
-            ])
-        elif 'vitamine c' in vitamin or 'vitamin c' in vitamin:
-            blog_options.extend([
-                "vitamine C: meer dan alleen weerstand",
-                "natuurlijke vitamine C bronnen die werken",
-                "hoe veel vitamine C heb je echt nodig?",
-                "vitamine C bij verkoudheid: werkt het?"
-            ])
-        elif 'vitamine b' in vitamin or 'b-complex' in content_lower:
-            blog_options.extend([
-                "B-vitamines: energie uit je voeding",
-                "welke B-vitamines heb je nodig?",
-                "B12 tekort: signalen en oplossingen",
-                "foliumzuur: niet alleen voor zwangere vrouwen"
-            ])
-    
-    # Mineral-specific titles  
-    for mineral in set(minerals):
-        if mineral == 'magnesium':
-            blog_options.extend([
-                "magnesium: het ontspanningsmineraal",
-                "magnesiumtekort herkennen en oplossen",
-                "de beste magnesium supplementen",
-                "magnesium tegen stress en spierkrampen"
-            ])
-        elif mineral == 'ijzer':
-            blog_options.extend([
-                "ijzertekort: meer dan alleen vermoeidheid",
-                "ijzer uit plantaardige bronnen",
-                "hoe verbeter je ijzeropname natuurlijk?",
-                "ijzer en je energieniveau"
-            ])
-        elif mineral == 'zink':
-            blog_options.extend([
-                "zink: het immuunmineraal",
-                "zinktekort herkennen: deze signalen wijzen erop",
-                "de beste natuurlijke zinkbronnen",
-                "zink voor huid, haar en nagels"
-            ])
-        elif mineral == 'calcium':
-            blog_options.extend([
-                "calcium zonder zuivel: kan dat?",
-                "calcium en vitamine D: het perfecte duo",
-                "sterke botten na de menopauze",
-                "calcium uit plantaardige bronnen"
-            ])
-    
-    # Supplement-specific titles
-    for supplement in set(supplements):
-        if 'omega' in supplement:
-            blog_options.extend([
-                "omega-3: waarom vis niet genoeg is",
-                "de beste omega-3 supplementen",
-                "omega-3 voor hersenen en hart",
-                "plantaardige omega-3: wat zijn de opties?"
-            ])
-        elif 'probiotica' in supplement:
-            blog_options.extend([
-                "probiotica: welke stammen werken echt?",
-                "probiotica na antibiotica: zo doe je het",
-                "fermented food vs probiotica supplementen",
-                "probiotica voor een gezonde darm"
-            ])
-        elif 'kurkuma' in supplement:
-            blog_options.extend([
-                "kurkuma: het gouden ontstekingsremmende kruid",
-                "kurkuma supplementen: waar moet je op letten?",
-                "kurkuma in de keuken: zo gebruik je het",
-                "kurkuma en zwarte peper: waarom samen?"
-            ])
-    
-    # Condition-specific titles
-    for condition in set(conditions):
-        if condition in ['diabetes', 'bloedsuiker']:
-            blog_options.extend([
-                "bloedsuiker stabiliseren met voeding",
-                "natuurlijke diabeteszorg: wat helpt?",
-                "suikervrije snacks die echt lekker zijn",
-                "insulineresistentie omkeren met voeding"
-            ])
-        elif condition in ['hypertensie', 'hoge bloeddruk']:
-            blog_options.extend([
-                "bloeddruk verlagen zonder medicijnen",
-                "zout verminderen: praktische tips",
-                "kalium: het vergeten mineraal voor je hart",
-                "natuurlijke bloeddrukverlagende voeding"
-            ])
-        elif condition == 'cholesterol':
-            blog_options.extend([
-                "cholesterol verlagen met deze voedingsmiddelen",
-                "goed vs slecht cholesterol: wat is het verschil?",
-                "cholesterolvrije voeding: myt of waarheid?",
-                "natuurlijke cholesterolverlaging: zo werkt het"
-            ])
-        elif condition in ['artritis', 'gewrichtspijn']:
-            blog_options.extend([
-                "ontstekingsremmende voeding bij artritis",
-                "gewrichtspijn verlichting uit je keuken",
-                "voedingsmiddelen die ontstekingen verergeren",
-                "natuurlijke gewrichtsverzorging"
-            ])
-    
-    # Food-specific titles
-    for food in set(foods):
-        if food in ['vis', 'zalm', 'sardines']:
-            blog_options.extend([
-                "vette vis: waarom 2x per week niet genoeg is",
-                "duurzame visoliën: waar moet je op letten?",
-                "vis eten met kwik: hoe minimaliseer je risico's?",
-                "de beste vissoorten voor omega-3"
-            ])
-        elif food in ['noten', 'walnoten']:
-            blog_options.extend([
-                "noten: de gezondste snack voor je brein",
-                "welke noten zijn het gezondst?",
-                "notenschillen: weg ermee of laten zitten?",
-                "noten en gewichtsbeheersing: past dat samen?"
-            ])
-    
-    # If document mentions metabolism/energy
-    if any(word in content_lower for word in ['metabolisme', 'stofwisseling', 'energieproductie', 'mitochondriën']):
-        blog_options.extend([
-            "je metabolisme aanjagen: natuurlijke methoden",
-            "mitochondriën: de energiefabrieken van je cellen",
-            "stofwisseling verbeteren na je 40e",
-            "energie krijgen uit je voeding: zo werkt het"
-        ])
-    
-    # If document mentions digestion
-    if any(word in content_lower for word in ['spijsvertering', 'darmgezondheid', 'microbioom']):
-        blog_options.extend([
-            "spijsvertering optimaliseren: praktische tips",
-            "microbioom herstellen na antibiotica",
-            "darmgezondheid en je immuunsysteem",
-            "fermented foods: de natuurlijke probiotica"
-        ])
-    
-    # If document mentions hormones
-    if any(word in content_lower for word in ['hormonen', 'oestrogeen', 'testosteron', 'cortisol', 'insuline', 'schildklier']):
-        blog_options.extend([
-            "hormonen balanceren met voeding",
-            "schildklierfunctie ondersteunen natuurlijk",
-            "stress hormonen verlagen: voedingstips",
-            "hormonen en gewichtstoename: het verband"
-        ])
-    
-    # If no specific content matches found, use document title for inspiration
-    if not blog_options:
-        title_words = title.lower().split()
-        if any(word in title_words for word in ['advanced', 'nutrition', 'metabolisme', 'voeding']):
-            blog_options = [
-                "voeding en metabolisme: de basis uitgelegd",
-                "advanced nutrition: wat betekent dat voor jou?",
-                "wetenschappelijk bewezen voedingstips",
-                "voedingsleer voor de praktijk"
-            ]
-        else:
-            # Fallback generic options
-            blog_options = [
-                "orthomoleculaire voeding: waar begin je?",
-                "natuurlijke gezondheid: de basis principes",
-                "voedingssupplementen: wat werkt echt?",
-                "preventieve gezondheidszorg met voeding"
-            ]
-    
-    # Return random option from the content-specific options
-    return random.choice(blog_options)
+# Helper function to extract references
+async def extract_references(content: str, allow_llm: bool = True) -> List[str]:
+    """References found by the local citation parser; the LLM is only asked when enabled and nothing was found"""
+    found = await asyncio.to_thread(citations.extract, content)
+    if not found and allow_llm and citations.CITATIONS_LLM_FALLBACK:
+        return await extract_references_with_ai(content)
+    return citations.reference_strings(found)
+
+# Helper function to select grounding documents for LLM prompts
+async def retrieve_context(query: str, limit: int, excerpt_chars: int, categories: Optional[List[str]] = None):
+    """Best matching documents with their most relevant passage as content, or None without an index"""
+    hits = await retrieval.search(query, limit=limit, categories=categories,
+                                  budget_ms=retrieval.RETRIEVAL_CONTEXT_BUDGET_MS)
+    if hits is None:
+        return None
+    if not hits and categories:
+        hits = await retrieval.search(query, limit=limit, budget_ms=retrieval.RETRIEVAL_CONTEXT_BUDGET_MS) or []
+    docs = []
+    for hit in hits:
+        doc = await find_document(hit.id)
+        if doc:
+            docs.append({**doc, "content": retrieval.best_passage(doc['content'], query, excerpt_chars)})
+    return docs
+
+# Background re-enrichment after edits
+async def reenrich_document(document_id: str, old_content: str, old_title: str, manual_fields: List[str]):
+    """Recompute the derived fields affected by an edit, calling the LLM only when needed"""
+    try:
+        doc = await db.documents.find_one({"id": document_id})
+        if not doc:
+            return
+        content = await bodies.load_content(db, doc)
+        title_changed = doc['title'] != old_title
+        plan = enrichment.plan(old_content, content, doc.get('chunk_hashes'), title_changed)
+        if not plan['changed']:
+            return
+        
+        preview, is_large = generate_document_preview(content, doc['title'])
+        update_data = {
+            "chunk_hashes": plan['chunk_hashes'],
+            "content_preview": preview if is_large else None,
+            "is_large_document": is_large,
+            "one_liner": generate_oneliner_mock(doc['title'], content),
+        }
+        
+        # Fields set explicitly in the edit are never overwritten
+        if plan['refresh_tags'] and 'tags' not in manual_fields:
+            update_data['tags'] = await generate_tags_with_ai(doc['title'], content)
+        if plan['refresh_references'] and 'references' not in manual_fields:
+            update_data['references'] = await extract_references(content, allow_llm=not plan['trivial'])
+        update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+        
+        await db.documents.update_one({"id": document_id}, {"$set": update_data})
+        await on_document_write(document_id, before=doc, after={**doc, **update_data})
+        logging.info(
+            f"Re-enriched document {document_id}: {plan['changed_ratio']:.1%} of the text changed, "
+            f"tags {'refreshed' if 'tags' in update_data else 'kept'}, "
+            f"references {'refreshed' if 'references' in update_data else 'kept'}"
+        )
+    except Exception as e:
+        logging.error(f"Re-enrichment error for {document_id}: {str(e)}")
 
 # Document routes
 @api_router.post("/documents", response_model=Document)
@@ -596,29 +525,31 @@ async def create_document(doc: DocumentCreate):
     """Upload a new document to the knowledge base"""
     doc_dict = doc.dict()
     doc_obj = Document(**doc_dict)
-    await db.documents.insert_one(doc_obj.dict())
-    return doc_obj
+    inserted_doc = await insert_document(doc_obj.dict())
+    return Document(**inserted_doc)
 
-@api_router.post("/documents/upload")
+@upload_router.post("/documents/upload")
 async def upload_document(
     file: UploadFile = File(...),
     title: Optional[str] = Form(None),
     category: str = Form("artikel")
 ):
     """Upload a file and extract text with auto-generated tags and references"""
+    # Read the upload once; extraction, GridFS and thumbnails share its spool
+    upload = await uploads.receive(file)
     try:
-        # Read file content
-        file_content = await file.read()
-        
         # Determine file type
         file_type = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else 'unknown'
         
         # Check if it's an image
-        is_image = file_type in ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp']
+        is_image = file_type in IMAGE_MEDIA_TYPES
         is_pdf = file_type == 'pdf'
         
-        # For images, store the image (vision/OCR can be added later)
-        if is_image:
+        # For images, recognize text with OCR (in the worker pool)
+        ocr_text = await ocr.ocr_image(upload.bytes()) if is_image else ""
+        
+        # Images without recognizable text are stored with placeholder content
+        if is_image and not ocr_text:
             doc_title = title if title else file.filename.rsplit('.', 1)[0]
             
             # Simple content for now - just indicate it's an image
@@ -629,21 +560,10 @@ async def upload_document(
             references = []
             
             # Store image in GridFS
-            import gridfs
-            fs = gridfs.GridFS(sync_db)
-            
             # Determine media type
-            media_type_map = {
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'png': 'image/png',
-                'gif': 'image/gif',
-                'webp': 'image/webp',
-                'bmp': 'image/bmp'
-            }
-            media_type = media_type_map.get(file_type, 'image/jpeg')
+            media_type = IMAGE_MEDIA_TYPES.get(file_type, 'image/jpeg')
             
-            file_id = fs.put(file_content, filename=file.filename, content_type=media_type)
+            file_id = await put_file(upload.open(), file.filename, media_type, sha256=upload.sha256)
             
             doc = Document(
                 title=doc_title,
@@ -652,32 +572,38 @@ async def upload_document(
                 content=content,
                 tags=tags,
                 references=references,
-                file_size=len(file_content),
+                file_size=upload.size,
                 original_filename=file.filename,
-                has_original_file=True
+                has_original_file=True,
+                original_sha256=upload.sha256
             )
             
             doc_dict = doc.dict()
             doc_dict['original_file_id'] = str(file_id)
+            if thumbnails.THUMBNAILS_AT_UPLOAD:
+                doc_dict['thumbnail_file_id'] = await store_thumbnail(doc.id, upload.open(), file_type)
             
-            # Insert into database
-            result = await db.documents.insert_one(doc_dict)
-            
-            # Fetch the inserted document to get clean data
-            inserted_doc = await db.documents.find_one({"id": doc.id})
-            
-            # Remove _id for JSON response
-            if inserted_doc and '_id' in inserted_doc:
-                del inserted_doc['_id']
+            # Insert into database (large bodies are stored out-of-line)
+            inserted_doc = await insert_document(doc_dict)
             
             return {
                 "message": "Afbeelding succesvol geüpload",
-                "document": inserted_doc or doc_dict
+                "document": inserted_doc
             }
         
-        # For PDFs and text files, extract text
-        await file.seek(0)  # Reset file pointer
-        content = await extract_text_from_file(file)
+        if is_image:
+            logging.info(f"OCR recognized {len(ocr_text)} characters in image: {file.filename}")
+            content = ocr_text
+        else:
+            # For PDFs and text files, extract text
+            content = await asyncio.to_thread(extract_text_from_file, upload)
+            
+            # Scanned PDFs have no text layer; fall back to OCR of the page images
+            if is_pdf and ocr.looks_scanned(content):
+                ocr_text = await ocr.ocr_scanned_pdf(upload.bytes())
+                if ocr_text:
+                    logging.info(f"OCR recognized {len(ocr_text)} characters in scanned PDF: {file.filename}")
+                    content = ocr_text
         
         if not content.strip():
             raise HTTPException(status_code=400, detail="Geen tekst gevonden in bestand")
@@ -694,16 +620,18 @@ async def upload_document(
         
         # Generate tags and extract references with AI (using translated content)
         tags = await generate_tags_with_ai(doc_title, translated_content)
-        references = await extract_references_with_ai(translated_content)
+        references = await extract_references(translated_content)
         
-        # Store original file for PDFs
+        # Store original file for PDFs and images
         file_id = None
         has_original = False
         
-        if is_pdf:
-            import gridfs
-            fs = gridfs.GridFS(sync_db)
-            file_id = fs.put(file_content, filename=file.filename, content_type=file.content_type or 'application/pdf')
+        if is_pdf or is_image:
+            if is_image:
+                media_type = IMAGE_MEDIA_TYPES.get(file_type, 'image/jpeg')
+            else:
+                media_type = file.content_type or 'application/pdf'
+            file_id = await put_file(upload.open(), file.filename, media_type, sha256=upload.sha256)
             has_original = True
         
         # Generate preview for large documents
@@ -726,6 +654,7 @@ async def upload_document(
             file_size=len(translated_content),
             original_filename=file.filename if has_original else None,
             has_original_file=has_original,
+            original_sha256=upload.sha256 if has_original else None,
             original_language=original_lang if was_translated else None,
             was_translated=was_translated
         )
@@ -733,24 +662,21 @@ async def upload_document(
         doc_dict = doc.dict()
         if file_id:
             doc_dict['original_file_id'] = str(file_id)
+            if thumbnails.THUMBNAILS_AT_UPLOAD:
+                doc_dict['thumbnail_file_id'] = await store_thumbnail(doc.id, upload.open(), file_type)
         
-        # Insert into database
-        result = await db.documents.insert_one(doc_dict)
-        
-        # Fetch the inserted document to get clean data without ObjectId
-        inserted_doc = await db.documents.find_one({"id": doc.id})
-        
-        # Convert for JSON response (remove _id)
-        if inserted_doc and '_id' in inserted_doc:
-            del inserted_doc['_id']
+        # Insert into database (large bodies are stored out-of-line)
+        inserted_doc = await insert_document(doc_dict)
         
         return {
             "message": "Document succesvol geüpload",
-            "document": inserted_doc or doc_dict
+            "document": inserted_doc
         }
     except Exception as e:
         logging.error(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        upload.release()
 
 @api_router.post("/documents/paste")
 async def paste_document(
@@ -772,7 +698,7 @@ async def paste_document(
         
         # Generate tags and extract references with AI (using translated content)
         tags = await generate_tags_with_ai(title, translated_content)
-        references = await extract_references_with_ai(translated_content)
+        references = await extract_references(translated_content)
         
         # Generate preview for large documents
         preview, is_large = generate_document_preview(translated_content, title)
@@ -798,31 +724,29 @@ async def paste_document(
         
         doc_dict = doc.dict()
         
-        # Insert into database
-        result = await db.documents.insert_one(doc_dict)
-        
-        # Fetch the inserted document to get clean data
-        inserted_doc = await db.documents.find_one({"id": doc.id})
-        
-        # Remove _id for JSON response
-        if inserted_doc and '_id' in inserted_doc:
-            del inserted_doc['_id']
+        # Insert into database (large bodies are stored out-of-line)
+        inserted_doc = await insert_document(doc_dict)
         
         return {
             "message": "Document succesvol toegevoegd",
-            "document": inserted_doc or doc_dict
+            "document": inserted_doc
         }
     except Exception as e:
         logging.error(f"Paste error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/documents/voice")
+@upload_router.post("/documents/voice")
 async def voice_document(
     audio: UploadFile = File(...),
     title: str = Form(...),
     category: str = Form("aantekening")
 ):
     """Create document from voice recording with speech-to-text"""
+    if audio.size is not None and audio.size > upload_sessions.UPLOAD_MAX_AUDIO_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Audio bestand is te groot (maximaal {upload_sessions.UPLOAD_MAX_AUDIO_BYTES // (1024 * 1024)} MB)"
+        )
     try:
         # Read audio file
         audio_content = await audio.read()
@@ -831,14 +755,13 @@ async def voice_document(
             raise HTTPException(status_code=400, detail="Audio bestand is leeg")
         
         # Save audio temporarily
-        import tempfile
         with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as tmp_audio:
             tmp_audio.write(audio_content)
             tmp_audio_path = tmp_audio.name
         
         try:
             # Use OpenAI Whisper for speech-to-text via Emergent LLM
-            import requests
+            requests = lazy.load('requests')
             
             api_key = os.environ.get('EMERGENT_LLM_KEY')
             
@@ -885,7 +808,7 @@ async def voice_document(
         
         # Generate tags and extract references with AI
         tags = await generate_tags_with_ai(title, translated_content)
-        references = await extract_references_with_ai(translated_content)
+        references = await extract_references(translated_content)
         
         # Create document
         doc = Document(
@@ -902,19 +825,12 @@ async def voice_document(
         
         doc_dict = doc.dict()
         
-        # Insert into database
-        result = await db.documents.insert_one(doc_dict)
-        
-        # Fetch the inserted document
-        inserted_doc = await db.documents.find_one({"id": doc.id})
-        
-        # Remove _id for JSON response
-        if inserted_doc and '_id' in inserted_doc:
-            del inserted_doc['_id']
+        # Insert into database (large bodies are stored out-of-line)
+        inserted_doc = await insert_document(doc_dict)
         
         return {
             "message": "Spraakopname succesvol verwerkt en opgeslagen",
-            "document": inserted_doc or doc_dict,
+            "document": inserted_doc,
             "transcription_length": len(content)
         }
         
@@ -922,27 +838,134 @@ async def voice_document(
         logging.error(f"Voice error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Resumable uploads for large files (see upload_sessions.py)
+@api_router.post("/uploads", status_code=201)
+async def create_upload_session(request: UploadSessionCreate):
+    """Start a resumable upload; send the bytes with PUT /uploads/{id}?offset=N"""
+    try:
+        session = await upload_sessions.create(db, **request.dict())
+    except upload_sessions.UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return upload_sessions.public(session)
+
+@api_router.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """Get the offset to resume an upload from"""
+    try:
+        return upload_sessions.public(await upload_sessions.get(db, upload_id))
+    except upload_sessions.UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@api_router.put("/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, offset: int, request: Request):
+    """Append the request body at offset to a resumable upload"""
+    length = request.headers.get("content-length")
+    if length and int(length) > upload_sessions.UPLOAD_CHUNK_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Deel is te groot (maximaal {upload_sessions.UPLOAD_CHUNK_MAX_BYTES} bytes)")
+    try:
+        session = await upload_sessions.append(db, upload_id, offset, request.stream())
+    except upload_sessions.UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return upload_sessions.public(session)
+
+@api_router.post("/uploads/{upload_id}/complete")
+async def complete_upload_session(upload_id: str, sha256: Optional[str] = None):
+    """Process a fully received upload like /documents/upload or /documents/voice"""
+    try:
+        session = await upload_sessions.claim(db, upload_id, sha256)
+    except upload_sessions.UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    with open(upload_sessions.spool_path(upload_id), 'rb') as spool:
+        upload = UploadFile(
+            file=spool,
+            filename=session["filename"],
+            size=session["size"],
+            headers=Headers({"content-type": session.get("content_type") or "application/octet-stream"})
+        )
+        try:
+            if session["kind"] == "voice":
+                result = await voice_document(
+                    audio=upload,
+                    title=session.get("title") or session["filename"].rsplit('.', 1)[0],
+                    category=session.get("category") or "aantekening"
+                )
+            else:
+                result = await upload_document(
+                    file=upload,
+                    title=session.get("title"),
+                    category=session.get("category") or "artikel"
+                )
+        except Exception:
+            # Keep the received bytes so processing can be retried
+            await upload_sessions.release(db, upload_id)
+            raise
+    await upload_sessions.discard(db, upload_id)
+    return result
+
+@api_router.delete("/uploads/{upload_id}")
+async def delete_upload_session(upload_id: str):
+    """Abort a resumable upload and delete its received bytes"""
+    await upload_sessions.discard(db, upload_id)
+    return {"message": "Upload geannuleerd"}
+
 @api_router.get("/documents", response_model=List[Document])
-async def get_documents(category: Optional[str] = None):
+async def get_documents(request: Request, category: Optional[str] = None):
     """Get all documents, optionally filtered by category"""
     query = {}
     if category:
         query["category"] = category
-    documents = await db.documents.find(query).sort("created_at", -1).to_list(1000)
-    return [Document(**doc) for doc in documents]
+    
+    # Every document write bumps the archive write version, so it versions any list of documents
+    etag = http_caching.make_etag("documents", category, await cache.write_version(db))
+    cache_control = http_caching.CACHE_CONTROL["documents"]
+    if http_caching.etag_matches(request, etag):
+        return http_caching.not_modified(etag, cache_control)
+    
+    documents = await db.documents.find(query, DOCUMENT_PROJECTION).sort("created_at", -1).to_list(1000)
+    response = ORJSONResponse(document_rows(documents))
+    http_caching.set_cache_headers(response, etag, cache_control)
+    return response
+
+# Fixed-prefix routes first: /documents/{document_id}/... would otherwise match /documents/search/related
+@api_router.get("/documents/search/{query}", response_model=List[Document])
+async def search_documents(query: str, category: Optional[str] = None, tag: Optional[str] = None,
+                           language: Optional[str] = None):
+    """Search documents by title, content, or tags, best matches first"""
+    if not (category or tag or language):
+        cache.count_query(" ".join(query.lower().split()))
+    body = await cached_search(query, category, tag, language)
+    return Response(content=body, media_type="application/json")
+
+@api_router.get("/documents/by-tag/{tag}", response_model=List[Document])
+async def get_documents_by_tag(tag: str):
+    """Get all documents that have a specific tag"""
+    documents = cache.tag_cache.get(cache.tag_key(tag))
+    if documents is cache.MISSING:
+        documents = document_rows(await db.documents.find({
+            "tags": {"$regex": f"^{tag}$", "$options": "i"}
+        }, DOCUMENT_PROJECTION).sort("created_at", -1).to_list(1000))
+        cache.tag_cache.set(cache.tag_key(tag), documents)
+    return ORJSONResponse(documents)
 
 @api_router.get("/documents/{document_id}", response_model=Document)
-async def get_document(document_id: str):
+async def get_document(document_id: str, request: Request, response: Response):
     """Get a specific document by ID"""
-    doc = await db.documents.find_one({"id": document_id})
+    doc = await find_document(document_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
+    
+    etag = http_caching.make_etag("document", document_id, doc.get("created_at"), doc.get("updated_at"))
+    cache_control = http_caching.CACHE_CONTROL["document"]
+    if http_caching.etag_matches(request, etag):
+        return http_caching.not_modified(etag, cache_control)
+    http_caching.set_cache_headers(response, etag, cache_control)
     return Document(**doc)
 
 @api_router.get("/documents/{document_id}/file")
 async def get_original_file(document_id: str):
     """Get the original uploaded file"""
-    doc = await db.documents.find_one({"id": document_id})
+    doc = await find_document(document_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
@@ -950,12 +973,7 @@ async def get_original_file(document_id: str):
         raise HTTPException(status_code=404, detail="Origineel bestand niet beschikbaar")
     
     try:
-        import gridfs
-        from bson import ObjectId
-        
-        fs = gridfs.GridFS(sync_db)
-        file_id = ObjectId(doc['original_file_id'])
-        grid_out = fs.get(file_id)
+        file_content = await read_file(doc['original_file_id'])
         
         # Determine media type based on file extension
         file_type = doc.get('file_type', '').lower()
@@ -972,7 +990,7 @@ async def get_original_file(document_id: str):
         media_type = media_types.get(file_type, 'application/octet-stream')
         
         return StreamingResponse(
-            io.BytesIO(grid_out.read()),
+            io.BytesIO(file_content),
             media_type=media_type,
             headers={
                 "Content-Disposition": f"inline; filename={doc.get('original_filename', 'document')}"
@@ -982,9 +1000,94 @@ async def get_original_file(document_id: str):
         logging.error(f"Error retrieving file: {str(e)}")
         raise HTTPException(status_code=500, detail="Fout bij ophalen bestand")
 
+@api_router.get("/documents/{document_id}/thumbnail")
+async def get_thumbnail(document_id: str, request: Request):
+    """Get a small WebP preview of the original image or PDF, rendered on first request"""
+    doc = await find_document(document_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    if not doc.get('has_original_file') or not doc.get('original_file_id'):
+        raise HTTPException(status_code=404, detail="Geen voorbeeld beschikbaar")
+    
+    try:
+        thumbnail_id = doc.get('thumbnail_file_id')
+        
+        if not thumbnail_id:
+            # Render lazily from the original and remember it on the document
+            original = await read_file(doc['original_file_id'])
+            thumbnail_id = await store_thumbnail(document_id, original, doc.get('file_type', '').lower())
+            if not thumbnail_id:
+                raise HTTPException(status_code=404, detail="Geen voorbeeld beschikbaar")
+            await db.documents.update_one({"id": document_id}, {"$set": {"thumbnail_file_id": thumbnail_id}})
+            cache.invalidate_document(document_id)
+        
+        # The thumbnail of a stored original never changes, so it can be cached forever
+        etag = http_caching.make_etag("thumbnail", thumbnail_id)
+        if http_caching.etag_matches(request, etag):
+            return http_caching.not_modified(etag, thumbnails.THUMBNAIL_CACHE_CONTROL)
+        
+        return Response(
+            content=await read_file(thumbnail_id),
+            media_type=thumbnails.THUMBNAIL_MEDIA_TYPE,
+            headers={"ETag": etag, "Cache-Control": thumbnails.THUMBNAIL_CACHE_CONTROL}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error retrieving thumbnail: {str(e)}")
+        raise HTTPException(status_code=500, detail="Fout bij ophalen voorbeeld")
+
+@api_router.get("/documents/{document_id}/related")
+async def get_related_documents(document_id: str, limit: int = 5):
+    """Documents most similar to this one, from its precomputed neighbour list"""
+    doc = await find_document(document_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    neighbors = await related.neighbors(db, document_id)
+    if neighbors is None:
+        # Written before the lists existed and not rebuilt yet: compute it now
+        await related.update(db, document_id, doc)
+        neighbors = await related.neighbors(db, document_id) or []
+    neighbors = neighbors[:min(max(1, limit), related.RELATED_NEIGHBORS)]
+    
+    scores = {neighbor['id']: neighbor['score'] for neighbor in neighbors}
+    rows = await db.documents.find(
+        {"id": {"$in": list(scores)}},
+        {"_id": 0, "id": 1, "title": 1, "category": 1, "tags": 1, "one_liner": 1, "file_type": 1, "created_at": 1}
+    ).to_list(len(scores))
+    rows.sort(key=lambda row: scores[row['id']], reverse=True)
+    return ORJSONResponse({
+        "document_id": document_id,
+        "related": [{**row, "score": scores[row['id']]} for row in rows],
+    })
+
+@api_router.get("/documents/{document_id}/citations")
+async def get_document_citations(document_id: str):
+    """References found in a document, with how many documents in the archive cite each"""
+    if not await find_document(document_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return ORJSONResponse({"document_id": document_id, "citations": await citations.document_citations(db, document_id)})
+
+@api_router.get("/citations")
+async def get_citing_documents(q: str):
+    """Documents that cite a study, looked up by DOI, PMID, URL or citation text"""
+    matches = await citations.citing_documents(db, q)
+    ids = list(dict.fromkeys(document_id for match in matches for document_id in match['documents']))
+    rows = await db.documents.find(
+        {"id": {"$in": ids}},
+        {"_id": 0, "id": 1, "title": 1, "category": 1, "tags": 1, "one_liner": 1, "file_type": 1, "created_at": 1}
+    ).to_list(len(ids))
+    return ORJSONResponse({
+        "query": q,
+        "citations": [{key: value for key, value in match.items() if key != "documents"} for match in matches],
+        "documents": rows,
+    })
+
 @api_router.put("/documents/{document_id}")
-async def update_document(document_id: str, update: DocumentUpdate):
-    """Update a document"""
+async def update_document(document_id: str, update: DocumentUpdate, background_tasks: BackgroundTasks):
+    """Update a document; derived fields are refreshed in the background"""
     doc = await db.documents.find_one({"id": document_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -992,41 +1095,143 @@ async def update_document(document_id: str, update: DocumentUpdate):
     update_data = update.dict(exclude_unset=True)
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
+    content_changed = update_data.get("content") is not None
+    title_changed = update_data.get("title") is not None and update_data["title"] != doc["title"]
+    if content_changed or title_changed:
+        old_content = await bodies.load_content(db, doc)
+        background_tasks.add_task(
+            reenrich_document, document_id, old_content, doc["title"], list(update_data.keys())
+        )
+    if content_changed:
+        update_data.update(await bodies.store_content(db, document_id, update_data["content"]))
+    
     await db.documents.update_one(
         {"id": document_id},
         {"$set": update_data}
     )
     
     updated_doc = await db.documents.find_one({"id": document_id})
+    await on_document_write(document_id, before=doc, after=updated_doc)
+    updated_doc = await bodies.hydrate(db, updated_doc)
     return {"message": "Document bijgewerkt", "document": Document(**updated_doc).dict()}
 
 @api_router.delete("/documents/{document_id}")
 async def delete_document(document_id: str):
     """Delete a document"""
-    result = await db.documents.delete_one({"id": document_id})
-    if result.deleted_count == 0:
+    deleted_doc = await db.documents.find_one_and_delete({"id": document_id})
+    if not deleted_doc:
         raise HTTPException(status_code=404, detail="Document not found")
+    await bodies.delete_body(db, document_id)
+    if deleted_doc.get('thumbnail_file_id'):
+        await delete_file(deleted_doc['thumbnail_file_id'])
+    await on_document_write(document_id, before=deleted_doc)
     return {"message": "Document deleted successfully"}
 
-@api_router.get("/documents/search/{query}")
-async def search_documents(query: str):
-    """Search documents by title, content, or tags"""
+# Helper functions for cached search
+def search_cache_key(query: str, category: Optional[str], tag: Optional[str], language: Optional[str]) -> tuple:
+    """Normalized cache key: ranked results only depend on the query tokens"""
+    filters = (category, tag.lower() if tag else None, language.lower() if language else None)
+    if retrieval.is_ready():
+        return ("ranked", tuple(retrieval.tokenize(query))) + filters
+    return ("regex", " ".join(query.lower().split())) + filters
+
+async def cached_search(query: str, category: Optional[str] = None, tag: Optional[str] = None,
+                        language: Optional[str] = None) -> bytes:
+    """JSON body of a search, from the search cache when the archive has not changed since"""
+    key = search_cache_key(query, category, tag, language)
+    # Read the version before searching: a write during the search leaves the entry stale
+    version = await cache.write_version(db)
+    generation = retrieval.generation() if key[0] == "ranked" else None
+    body = cache.search_cache.lookup(key, version, generation)
+    if body is cache.MISSING:
+        body = ORJSONResponse(await search_rows(query, category, tag, language)).body
+        cache.search_cache.store(key, version, generation, body)
+    return body
+
+async def search_rows(query: str, category: Optional[str], tag: Optional[str], language: Optional[str]) -> list:
+    """Search result rows, ranked by the retrieval index or from a regex scan while it is not ready"""
+    hits = await retrieval.search(
+        query, limit=100, categories=[category] if category else None,
+        tags=[tag] if tag else None, language=language,
+    )
+    if hits is not None:
+        rows = await db.documents.find({"id": {"$in": [hit.id for hit in hits]}}, DOCUMENT_PROJECTION).to_list(len(hits))
+        by_id = {row["id"]: row for row in rows}
+        return document_rows([by_id[hit.id] for hit in hits if hit.id in by_id])
+
+    # Index not built yet: regex scan
+    filters = {}
+    if category:
+        filters["category"] = category
+    if tag:
+        filters["tags"] = {"$regex": f"^{re.escape(tag)}$", "$options": "i"}
+    if language:
+        filters["original_language"] = {"$in": [None, "nl"]} if language.lower() == "nl" else language.lower()
     documents = await db.documents.find({
+        **filters,
         "$or": [
             {"title": {"$regex": query, "$options": "i"}},
             {"content": {"$regex": query, "$options": "i"}},
             {"tags": {"$regex": query, "$options": "i"}}
         ]
-    }).to_list(100)
-    return [Document(**doc) for doc in documents]
-
-@api_router.get("/documents/by-tag/{tag}")
-async def get_documents_by_tag(tag: str):
-    """Get all documents that have a specific tag"""
-    documents = await db.documents.find({
-        "tags": {"$regex": f"^{tag}$", "$options": "i"}
-    }).sort("created_at", -1).to_list(1000)
-    return [Document(**doc) for doc in documents]
+    }, DOCUMENT_PROJECTION).to_list(100)
+    
+    # Only the head of external bodies is inline, so scan the compressed bodies too
+    if len(documents) < 100:
+        body_matches = await bodies.search_bodies(
+            db, query, exclude=[doc["id"] for doc in documents], limit=100 - len(documents)
+        )
+        if body_matches:
+            documents += await db.documents.find(
+                {**filters, "id": {"$in": body_matches}}, DOCUMENT_PROJECTION
+            ).to_list(len(body_matches))
+    return document_rows(documents)
+
+async def warm_search_cache():
+    """Precompute the most frequent searches once the retrieval index is ready"""
+    for _ in range(300):
+        if retrieval.is_ready() or not retrieval.RETRIEVAL_ENABLED:
+            break
+        await asyncio.sleep(1)
+    try:
+        queries = await cache.top_queries(db)
+        for query in queries:
+            await cached_search(query)
+        logging.info(f"Search cache warmed with {len(queries)} queries")
+    except Exception as e:
+        logging.error(f"Search cache warm-up error: {str(e)}")
+
+@api_router.get("/suggest")
+async def get_suggestions(q: str, limit: int = 8):
+    """Typeahead suggestions (titles, tags, known entities) for a search prefix"""
+    suggestions = suggest.suggest(q, min(max(1, limit), 20))
+    return ORJSONResponse({"query": q, "suggestions": suggestions or [], "ready": suggestions is not None})
+
+@api_router.get("/entities/documents")
+async def get_documents_by_entities(names: List[str] = Query(...), limit: int = 20):
+    """Documents that mention all of the given nutrients, herbs, conditions or foods"""
+    matches = await graph.documents_with(db, names[:5], min(max(1, limit), 100))
+    rows = await db.documents.find(
+        {"id": {"$in": [match['document_id'] for match in matches]}},
+        {"_id": 0, "id": 1, "title": 1, "category": 1, "tags": 1, "one_liner": 1, "file_type": 1, "created_at": 1}
+    ).to_list(len(matches))
+    by_id = {row['id']: row for row in rows}
+    return ORJSONResponse({
+        "entities": [graph.entity_key(name) for name in names[:5]],
+        "documents": [
+            {**by_id[match['document_id']], "mentions": match['mentions']}
+            for match in matches if match['document_id'] in by_id
+        ],
+    })
+
+@api_router.get("/entities/{name}/co-occurring")
+async def get_co_occurring_entities(name: str, limit: int = 20):
+    """Entities mentioned in the most documents together with this one"""
+    return ORJSONResponse({
+        "entity": graph.entity_key(name),
+        "documents": await graph.document_count(db, name),
+        "co_occurring": await graph.co_occurring(db, name, min(max(1, limit), 100)),
+    })
 
 # Category routes
 @api_router.post("/categories", response_model=Category)
@@ -1039,12 +1244,24 @@ async def create_category(cat: CategoryCreate):
     
     category = Category(**cat.dict())
     await db.categories.insert_one(category.dict())
+    cache.invalidate_categories()
     return category
 
 @api_router.get("/categories", response_model=List[Category])
-async def get_categories():
+async def get_categories(request: Request, response: Response):
     """Get all categories"""
-    categories = await db.categories.find().sort("name", 1).to_list(100)
+    categories = cache.category_cache.get(cache.CATEGORIES_KEY)
+    if categories is cache.MISSING:
+        categories = await db.categories.find().sort("name", 1).to_list(100)
+        cache.category_cache.set(cache.CATEGORIES_KEY, categories)
+    
+    etag = http_caching.make_etag("categories", *[
+        f"{cat.get('id')}:{cat.get('name')}:{cat.get('description')}" for cat in categories
+    ])
+    cache_control = http_caching.CACHE_CONTROL["categories"]
+    if http_caching.etag_matches(request, etag):
+        return http_caching.not_modified(etag, cache_control)
+    http_caching.set_cache_headers(response, etag, cache_control)
     return [Category(**cat) for cat in categories]
 
 @api_router.delete("/categories/{category_id}")
@@ -1053,28 +1270,31 @@ async def delete_category(category_id: str):
     result = await db.categories.delete_one({"id": category_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    cache.invalidate_categories()
     return {"message": "Category deleted successfully"}
 
 # Chat routes with Claude integration
 @api_router.post("/chat")
 async def chat(request: ChatRequest):
     """Chat with AI assistant using Claude Sonnet 4"""
+    # Store the question first, so it stays in the history when the answer fails or times out
+    user_msg = ChatMessage(
+        session_id=request.session_id,
+        role="user",
+        content=request.message
+    )
     try:
-        # Save user message
-        user_msg = ChatMessage(
-            session_id=request.session_id,
-            role="user",
-            content=request.message
-        )
-        await db.chat_messages.insert_one(user_msg.dict())
+        await chats.append(db, request.session_id, [user_msg.dict()])
         
         # Get relevant documents for context
-        relevant_docs = await db.documents.find({
-            "$or": [
-                {"content": {"$regex": request.message.split()[0] if request.message.split() else "", "$options": "i"}},
-                {"tags": {"$regex": request.message.split()[0] if request.message.split() else "", "$options": "i"}}
-            ]
-        }).limit(3).to_list(3)
+        relevant_docs = await retrieve_context(request.message, 3, 200)
+        if relevant_docs is None:
+            relevant_docs = await db.documents.find({
+                "$or": [
+                    {"content": {"$regex": request.message.split()[0] if request.message.split() else "", "$options": "i"}},
+                    {"tags": {"$regex": request.message.split()[0] if request.message.split() else "", "$options": "i"}}
+                ]
+            }).limit(3).to_list(3)
         
         context = ""
         if relevant_docs:
@@ -1112,7 +1332,7 @@ async def chat(request: ChatRequest):
             role="assistant",
             content=response
         )
-        await db.chat_messages.insert_one(assistant_msg.dict())
+        await chats.append(db, request.session_id, [assistant_msg.dict()])
         
         return {
             "response": response,
@@ -1123,27 +1343,32 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str):
-    """Get chat history for a session"""
-    messages = await db.chat_messages.find(
-        {"session_id": session_id}
-    ).sort("timestamp", 1).to_list(1000)
-    return [ChatMessage(**msg) for msg in messages]
+async def get_chat_history(session_id: str, limit: int = chats.CHAT_HISTORY_LIMIT):
+    """Get the latest messages of a chat session, oldest first"""
+    messages = await chats.history(db, session_id, min(max(1, limit), 10000))
+    return ORJSONResponse([ChatMessage(**msg).dict() for msg in messages])
+
+@api_router.delete("/chat/history/{session_id}")
+async def delete_chat_history(session_id: str):
+    """Delete all messages of a chat session"""
+    deleted = await chats.delete_session(db, session_id)
+    return {"message": "Chatgeschiedenis verwijderd", "deleted": deleted}
 
 # Treatment plan generation
-@api_router.post("/treatment-plan")
-async def generate_treatment_plan(request: TreatmentPlanRequest):
-    """Generate a treatment plan using AI"""
-    try:
-        session_id = str(uuid.uuid4())
-        
-        chat = LlmChat(
-            api_key=os.environ.get('EMERGENT_LLM_KEY'),
-            session_id=session_id,
-            system_message="Je bent een expert orthomoleculair therapeut gespecialiseerd in kPNI. Maak gedetailleerde behandelplannen met specifieke aanbevelingen voor supplementen, kruiden, leefstijl en aanvullende diagnostiek."
-        ).with_model("anthropic", "claude-4-sonnet-20250514")
-        
-        prompt = f"""Maak een uitgebreid behandelplan voor de volgende patiënt:
+# Model for treatment plans and supplement advice; part of their generation cache key
+ADVICE_MODEL = ("anthropic", "claude-4-sonnet-20250514")
+
+# Helper function to generate a treatment plan with AI
+async def treatment_plan_with_ai(request: TreatmentPlanRequest) -> str:
+    session_id = str(uuid.uuid4())
+    
+    chat = LlmChat(
+        api_key=os.environ.get('EMERGENT_LLM_KEY'),
+        session_id=session_id,
+        system_message="Je bent een expert orthomoleculair therapeut gespecialiseerd in kPNI. Maak gedetailleerde behandelplannen met specifieke aanbevelingen voor supplementen, kruiden, leefstijl en aanvullende diagnostiek."
+    ).with_model(*ADVICE_MODEL)
+    
+    prompt = f"""Maak een uitgebreid behandelplan voor de volgende patiënt:
 
 Patiënt informatie: {request.patient_info}
 Symptomen: {request.symptoms}
@@ -1156,44 +1381,87 @@ Geef een gestructureerd behandelplan met:
 4. Leefstijladviezen
 5. Aanvullende diagnostiek indien nodig
 6. Tijdslijn en evaluatiemomenten"""
+    
+    user_message = UserMessage(text=prompt)
+    return await chat.send_message(user_message)
+
+@api_router.post("/treatment-plan")
+async def generate_treatment_plan(request: TreatmentPlanRequest):
+    """Generate a treatment plan using AI, reusing an earlier plan for the same patient input"""
+    try:
+        response, cache_info = await generations.generate(
+            db, "treatment_plan",
+            {"patient_info": request.patient_info, "symptoms": request.symptoms, "diagnosis": request.diagnosis},
+            generations.NO_DOCUMENTS, "/".join(ADVICE_MODEL),
+            lambda: treatment_plan_with_ai(request),
+            bypass=request.bypass_cache, refresh=request.refresh_cache
+        )
         
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
-        
-        return {"treatment_plan": response}
+        return {"treatment_plan": response, "cache": cache_info}
     except Exception as e:
         logging.error(f"Treatment plan error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# Supplement advice
-@api_router.post("/supplement-advice")
-async def get_supplement_advice(request: SupplementAdviceRequest):
-    """Get supplement and herb advice using AI"""
-    try:
-        session_id = str(uuid.uuid4())
-        
-        # Get relevant supplement documents
+# Helper function to select the supplement documents for an advice prompt
+async def supplement_documents(query: str) -> List[dict]:
+    """Excerpts of the most relevant supplement documents, cached until the archive changes"""
+    key = generations.normalize(query)
+    version = await cache.write_version(db)
+    docs = cache.context_cache.lookup(key, version, retrieval.generation())
+    if docs is not cache.MISSING:
+        return docs
+    
+    relevant_docs = await retrieve_context(query, 5, 300, categories=["supplement", "kruiden"])
+    if relevant_docs is None:
         relevant_docs = await db.documents.find({
             "$or": [
                 {"category": "supplement"},
                 {"category": "kruiden"},
                 {"tags": {"$in": ["supplement", "kruiden", "gemmo"]}}
             ]
-        }).limit(5).to_list(5)
-        
-        context = ""
-        if relevant_docs:
-            context = "\n\nRelevante informatie uit kennisbank:\n"
-            for doc in relevant_docs:
-                context += f"- {doc['title']}: {doc['content'][:300]}...\n"
-        
-        chat = LlmChat(
-            api_key=os.environ.get('EMERGENT_LLM_KEY'),
-            session_id=session_id,
-            system_message="Je bent expert in orthomoleculaire supplementen, kruiden en gemmo therapie. Geef praktische en evidence-based adviezen."
-        ).with_model("anthropic", "claude-4-sonnet-20250514")
-        
-        prompt = f"""Geef supplement- en kruidenadvies voor:
+        }, {"_id": 0, "id": 1, "title": 1, "content": 1, "created_at": 1, "updated_at": 1}).limit(5).to_list(5)
+    
+    docs = [{
+        "id": doc['id'],
+        "title": doc['title'],
+        "content": doc['content'][:300],
+        "created_at": doc.get('created_at'),
+        "updated_at": doc.get('updated_at'),
+    } for doc in relevant_docs]
+    cache.context_cache.store(key, version, retrieval.generation(), docs)
+    return docs
+
+# Helper function to assemble the knowledge base context of an advice prompt
+async def supplement_context(condition: str, patient_details: str):
+    """Context text within ADVICE_CONTEXT_TOKENS and the documents it quotes"""
+    query = f"{condition} {patient_details}"
+    if digest.is_ready():
+        # Passages, doses and contraindications of the supplements and herbs in the question
+        assembled = digest.context_for(query)
+        if assembled is None:
+            related = await supplement_documents(query)
+            assembled = digest.context_for(query, [doc['id'] for doc in related])
+        if assembled is not None:
+            return assembled
+    
+    relevant_docs = await supplement_documents(query)
+    return digest.excerpt_context(relevant_docs, digest.ADVICE_CONTEXT_TOKENS), relevant_docs
+
+# Helper function to generate supplement advice with AI
+async def supplement_advice_with_ai(request: SupplementAdviceRequest, knowledge: str) -> str:
+    session_id = str(uuid.uuid4())
+    
+    context = ""
+    if knowledge:
+        context = f"\n\nRelevante informatie uit kennisbank:\n{knowledge}\n"
+    
+    chat = LlmChat(
+        api_key=os.environ.get('EMERGENT_LLM_KEY'),
+        session_id=session_id,
+        system_message="Je bent expert in orthomoleculaire supplementen, kruiden en gemmo therapie. Geef praktische en evidence-based adviezen."
+    ).with_model(*ADVICE_MODEL)
+    
+    prompt = f"""Geef supplement- en kruidenadvies voor:
 
 Conditie: {request.condition}
 Patiënt details: {request.patient_details}
@@ -1207,15 +1475,41 @@ Geef advies over:
 6. Interacties met andere middelen
 
 {context}"""
+    
+    user_message = UserMessage(text=prompt)
+    return await chat.send_message(user_message)
+
+# Supplement advice
+@api_router.post("/supplement-advice")
+async def get_supplement_advice(request: SupplementAdviceRequest):
+    """Get supplement and herb advice using AI, regenerated when its source documents change"""
+    try:
+        # Get the knowledge base context and the documents it comes from
+        knowledge, relevant_docs = await supplement_context(request.condition, request.patient_details)
+        
+        response, cache_info = await generations.generate(
+            db, "supplement_advice",
+            {"condition": request.condition, "patient_details": request.patient_details},
+            generations.kb_version(relevant_docs), "/".join(ADVICE_MODEL),
+            lambda: supplement_advice_with_ai(request, knowledge),
+            bypass=request.bypass_cache, refresh=request.refresh_cache
+        )
         
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
-        
-        return {"advice": response}
+        return {"advice": response, "cache": cache_info}
     except Exception as e:
         logging.error(f"Supplement advice error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/digest/{name}")
+async def get_digest_entry(name: str):
+    """Passages, dosing and contraindications collected for one supplement or herb"""
+    if not digest.is_ready():
+        raise HTTPException(status_code=503, detail="Kennisoverzicht wordt nog opgebouwd")
+    entry = digest.lookup(name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Geen informatie gevonden voor dit middel")
+    return ORJSONResponse(entry)
+
 # Blog Article Creation
 @api_router.post("/blog/create")
 async def create_blog_article(request: BlogCreateRequest):
@@ -1224,7 +1518,7 @@ async def create_blog_article(request: BlogCreateRequest):
         # Fetch source documents
         source_documents = []
         for doc_id in request.document_ids:
-            doc = await db.documents.find_one({"id": doc_id})
+            doc = await find_document(doc_id)
             if not doc:
                 raise HTTPException(status_code=404, detail=f"Document {doc_id} not found")
             source_documents.append(doc)
@@ -1406,7 +1700,7 @@ Gevestigd in het hart van Zeist, combineren we moderne orthomoleculaire kennis m
         
         # Save to database
         blog_dict = blog_article.dict()
-        result = await db.documents.insert_one(blog_dict)
+        await insert_document(blog_dict)
         
         return {
             "success": True,
@@ -1421,8 +1715,14 @@ Gevestigd in het hart van Zeist, combineren we moderne orthomoleculaire kennis m
 
 # Statistics
 @api_router.get("/stats")
-async def get_stats():
+async def get_stats(request: Request, response: Response):
     """Get knowledge base statistics"""
+    etag = http_caching.make_etag("stats", await cache.write_version(db))
+    cache_control = http_caching.CACHE_CONTROL["stats"]
+    if http_caching.etag_matches(request, etag):
+        return http_caching.not_modified(etag, cache_control)
+    http_caching.set_cache_headers(response, etag, cache_control)
+    
     total_docs = await db.documents.count_documents({})
     categories = await db.documents.distinct("category")
     
@@ -1472,7 +1772,7 @@ async def generate_blog_title(document_id: str):
     """Generate consumer-friendly blog title for a document"""
     try:
         # Get document
-        doc = await db.documents.find_one({"id": document_id})
+        doc = await find_document(document_id)
         if not doc:
             raise HTTPException(status_code=404, detail="Document niet gevonden")
         
@@ -1482,8 +1782,12 @@ async def generate_blog_title(document_id: str):
         # Update document with generated title
         await db.documents.update_one(
             {"id": document_id},
-            {"$set": {"consumer_blog_title": blog_title}}
+            {"$set": {
+                "consumer_blog_title": blog_title,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }}
         )
+        await on_document_write(document_id, before=doc, after={**doc, "consumer_blog_title": blog_title})
         
         return {
             "success": True,
@@ -1495,12 +1799,90 @@ async def generate_blog_title(document_id: str):
         logging.error(f"Generate blog title error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Cache statistics
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Get hit ratios and sizes of the in-process read caches and the shared generation cache"""
+    return {**cache.stats(), "generations": await generations.stats(db)}
+
+@api_router.delete("/admin/generation-cache")
+async def clear_generation_cache(kind: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Delete cached treatment plans and supplement advice"""
+    require_admin_token(x_admin_token)
+    return {"deleted": await generations.invalidate(db, kind)}
+
+@api_router.get("/retrieval/stats")
+async def get_retrieval_stats():
+    """Get size and sync state of the search index"""
+    return retrieval.stats()
+
+# Change feed for automations (Make.com)
+@api_router.get("/events")
+async def get_events(after: int = 0, limit: int = 100, types: Optional[str] = None):
+    """Get document change events after a cursor, oldest first"""
+    type_list = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    if type_list and any(t not in events.EVENT_TYPES for t in type_list):
+        raise HTTPException(status_code=400, detail=f"Onbekend event type; kies uit {', '.join(events.EVENT_TYPES)}")
+    return await events.read(db, after=max(0, after), limit=min(max(1, limit), 1000), types=type_list)
+
+@api_router.get("/admin/webhooks")
+async def get_webhook_status(x_admin_token: Optional[str] = Header(None)):
+    """Get delivery cursors, lag and last errors of the configured webhooks"""
+    require_admin_token(x_admin_token)
+    return {"webhooks": await events.webhook_status(db)}
+
+# Request profiling
+@api_router.get("/admin/profiles")
+async def list_request_profiles(x_admin_token: Optional[str] = Header(None)):
+    """List stored request profiles"""
+    require_admin_token(x_admin_token)
+    return {"profiles": profiling.list_profiles()}
+
+@api_router.get("/admin/profiles/{name}")
+async def download_request_profile(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Download a stored request profile"""
+    require_admin_token(x_admin_token)
+    path = profiling.profile_path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profiel niet gevonden")
+    media_type = "application/json" if name.endswith(".json") else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=name)
+
+@api_router.get("/health")
+async def health():
+    """Report MongoDB reachability and connection pool utilization of this worker"""
+    started = asyncio.get_running_loop().time()
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=2)
+        status = "ok"
+        error = None
+    except Exception as e:
+        status = "unavailable"
+        error = str(e)
+    body = {
+        "status": status,
+        "worker_pid": os.getpid(),
+        "mongo": {
+            "ping_ms": round((asyncio.get_running_loop().time() - started) * 1000, 3),
+            "error": error,
+            "pool": mongo.pool_stats(pool_monitor) if pool_monitor else None,
+        },
+    }
+    return ORJSONResponse(body, status_code=200 if status == "ok" else 503)
+
 @api_router.get("/")
 async def root():
     return {"message": "Wellness Knowledge Archive API"}
 
 # Include the router in the main app
 app.include_router(api_router)
+app.include_router(upload_router)
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    return await profiling.profile_request(request, call_next, ADMIN_TOKEN)
+
+app.add_middleware(http_caching.CompressionMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -1517,6 +1899,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
+background_tasks = []
+
+async def start_background_tasks():
+    await bodies.ensure_indexes(db)
+    await events.ensure_indexes(db)
+    await upload_sessions.ensure_indexes(db)
+    await generations.ensure_indexes(db)
+    await related.ensure_indexes(db)
+    await graph.ensure_indexes(db)
+    await citations.ensure_indexes(db)
+    await chats.ensure_indexes(db)
+    if retrieval.RETRIEVAL_ENABLED:
+        background_tasks.append(asyncio.create_task(retrieval.maintain(db)))
+    background_tasks.append(asyncio.create_task(suggest.maintain(db)))
+    background_tasks.append(asyncio.create_task(digest.maintain(db)))
+    background_tasks.append(asyncio.create_task(cache.flush_query_counts_periodically(db)))
+    background_tasks.append(asyncio.create_task(upload_sessions.cleanup_periodically(db)))
+    background_tasks.append(asyncio.create_task(chats.cleanup_periodically(db)))
+    if cache.CACHE_ENABLED and cache.SEARCH_WARMUP_QUERIES:
+        background_tasks.append(asyncio.create_task(warm_search_cache()))
+    if events.WEBHOOK_URLS:
+        background_tasks.append(asyncio.create_task(events.dispatch(db)))
+    if cache.CACHE_CHANGE_STREAMS:
+        background_tasks.append(asyncio.create_task(cache.watch_documents(db)))
+        background_tasks.append(asyncio.create_task(cache.watch_categories(db)))
+
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    try:
+        await cache.flush_query_counts(db)
+    except Exception as e:
+        logging.error(f"Error saving search query counts: {str(e)}")
+    ocr.shutdown()
     client.close()
\ No newline at end of file
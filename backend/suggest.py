@@ -0,0 +1,185 @@
+"""Typeahead suggestions for the search box.
+
+Suggestions come from three sources:
+- document titles, matched at the start of any word;
+- tags;
+- known entities: the vitamins, minerals and supplements recognized by the
+  vocabularies in derivations.py.
+
+Keys are normalized and kept in sorted arrays, so a prefix lookup is a
+``bisect`` plus a scan of the matching range. Tags and entities are ranked by
+document frequency: the number of documents that carry the tag or mention the
+entity. Titles fill the remaining slots in alphabetical order, so a lookup
+only reads as many title keys as it returns.
+
+Each document's contributions are remembered, so a write only removes and
+re-inserts that document's keys.
+"""
+import bisect
+import heapq
+import re
+import threading
+from typing import Optional
+
+import events
+from derivations import extract_entities
+from retrieval import STOPWORDS, normalize
+
+SUGGEST_MAX_SCAN = 5000
+
+_SEPARATORS = re.compile(r'[^0-9a-z]+')
+
+PROJECTION = {"_id": 0, "id": 1, "title": 1, "tags": 1, "content": 1}
+
+
+def suggest_key(text: str) -> str:
+    """Accent-folded lowercase text with punctuation collapsed to single spaces"""
+    return _SEPARATORS.sub(' ', normalize(text)).lstrip()
+
+
+def title_keys(title: str) -> list:
+    """Keys for the title starting at each word, so 'stress' finds 'Magnesium en stress'"""
+    words = suggest_key(title).split()
+    return [' '.join(words[i:]) for i in range(len(words)) if i == 0 or words[i] not in STOPWORDS]
+
+
+class Suggestion:
+    __slots__ = ("type", "kind", "text", "documents", "document_id")
+
+    def __init__(self, type: str, kind: Optional[str], text: str):
+        self.type = type
+        self.kind = kind
+        self.text = text
+        self.documents = 0
+        self.document_id = None
+
+    def as_dict(self) -> dict:
+        row = {"text": self.text, "type": self.type, "count": self.documents}
+        if self.kind:
+            row["kind"] = self.kind
+        if self.document_id:
+            row["document_id"] = self.document_id
+        return row
+
+
+class SuggestIndex:
+    def __init__(self):
+        self.term_keys = []       # sorted (key, suggestion id) of tags and entities
+        self.title_keys = []      # sorted (key, suggestion id) of titles
+        self.suggestions = {}     # suggestion id -> Suggestion
+        self.contributions = {}   # document id -> [(key, suggestion id)]
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.suggestions)
+
+    def _entries(self, doc: dict) -> list:
+        entries = []
+        title = doc.get('title') or ''
+        if title:
+            sid = ("title", doc['id'])
+            entries += [(key, sid, "title", None, title) for key in title_keys(title)]
+        for tag in set(doc.get('tags') or []):
+            key = suggest_key(tag)
+            if key:
+                entries.append((key, ("tag", key), "tag", None, tag))
+        text = f"{title}\n{doc.get('content') or ''}"
+        for kind, name in extract_entities(text):
+            key = suggest_key(name)
+            entries.append((key, ("entity", key), "entity", kind, name))
+        return entries
+
+    def add(self, doc: dict):
+        entries = self._entries(doc)
+        with self._lock:
+            self._remove(doc['id'])
+            counted = set()
+            contributed = []
+            for key, sid, type, kind, text in entries:
+                suggestion = self.suggestions.get(sid)
+                if suggestion is None:
+                    suggestion = self.suggestions[sid] = Suggestion(type, kind, text)
+                    if type == "title":
+                        suggestion.document_id = doc['id']
+                if sid not in counted:
+                    suggestion.documents += 1
+                    counted.add(sid)
+                # A key is shared by all documents contributing the same tag or entity
+                if type == "title":
+                    bisect.insort(self.title_keys, (key, sid))
+                elif suggestion.documents == 1:
+                    bisect.insort(self.term_keys, (key, sid))
+                contributed.append((key, sid))
+            self.contributions[doc['id']] = contributed
+
+    def add_many(self, docs):
+        for doc in docs:
+            self.add(doc)
+
+    def remove(self, document_id: str):
+        with self._lock:
+            self._remove(document_id)
+
+    def _remove(self, document_id: str):
+        removed = set()
+        for key, sid in self.contributions.pop(document_id, ()):
+            suggestion = self.suggestions.get(sid)
+            if suggestion is None:
+                continue
+            if sid not in removed:
+                suggestion.documents -= 1
+                removed.add(sid)
+            if suggestion.documents <= 0:
+                keys = self.title_keys if suggestion.type == "title" else self.term_keys
+                i = bisect.bisect_left(keys, (key, sid))
+                if i < len(keys) and keys[i] == (key, sid):
+                    del keys[i]
+        for sid in removed:
+            if self.suggestions[sid].documents <= 0:
+                del self.suggestions[sid]
+
+    def lookup(self, prefix: str, limit: int = 8) -> list:
+        prefix = suggest_key(prefix)
+        if not prefix:
+            return []
+        results, seen = [], set()
+
+        def take(suggestion) -> bool:
+            label = suggestion.text.lower()
+            if label not in seen:
+                seen.add(label)
+                results.append(suggestion.as_dict())
+            return len(results) >= limit
+
+        with self._lock:
+            matches = {}
+            i = bisect.bisect_left(self.term_keys, (prefix,))
+            end = min(len(self.term_keys), i + SUGGEST_MAX_SCAN)
+            while i < end and self.term_keys[i][0].startswith(prefix):
+                sid = self.term_keys[i][1]
+                matches[sid] = self.suggestions[sid]
+                i += 1
+            # Most documents first, shorter before longer
+            for suggestion in heapq.nsmallest(limit, matches.values(), key=lambda s: (-s.documents, len(s.text), s.text)):
+                if take(suggestion):
+                    return results
+
+            i = bisect.bisect_left(self.title_keys, (prefix,))
+            while i < len(self.title_keys) and self.title_keys[i][0].startswith(prefix):
+                if take(self.suggestions[self.title_keys[i][1]]):
+                    break
+                i += 1
+        return results
+
+
+# Inline content only: entities in the head of a large body are enough for typeahead
+follower = events.Follower("Suggestion index", SuggestIndex, PROJECTION, unit="suggestions", full=False)
+build, update, sync, maintain = follower.build, follower.update, follower.sync, follower.maintain
+
+
+def suggest(prefix: str, limit: int = 8) -> Optional[list]:
+    """Ranked suggestions, or None while the index is being built"""
+    if not follower.index.ready:
+        return None
+    return follower.index.lookup(prefix, limit)
@@ -0,0 +1,99 @@
+"""Small WebP previews of uploaded images and PDFs.
+
+Thumbnails are derived from the original stored in GridFS, either at upload or
+lazily on the first request to ``/documents/{id}/thumbnail``, and stored back
+in GridFS next to ``original_file_id`` as ``thumbnail_file_id``. PDF pages are
+rendered with PyMuPDF when it is installed; otherwise the largest image
+embedded in the first page is used, which covers scanned PDFs.
+"""
+import asyncio
+import functools
+import io
+import logging
+import os
+from typing import Optional
+
+import lazy
+
+THUMBNAIL_MAX_SIZE = int(os.environ.get('THUMBNAIL_MAX_SIZE', '320'))
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', '75'))
+THUMBNAILS_AT_UPLOAD = os.environ.get('THUMBNAILS_AT_UPLOAD', '1') == '1'
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+THUMBNAIL_MEDIA_TYPE = "image/webp"
+
+
+def _to_webp(image) -> bytes:
+    from PIL import ImageOps
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    image.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+    output = io.BytesIO()
+    image.save(output, format='WEBP', quality=THUMBNAIL_QUALITY, method=4)
+    return output.getvalue()
+
+
+def _stream(data):
+    """A readable stream over bytes, or the stream itself (e.g. an upload reader)"""
+    return data if hasattr(data, 'read') else io.BytesIO(data)
+
+
+def render_image(data) -> bytes:
+    from PIL import Image
+
+    with Image.open(_stream(data)) as image:
+        image.draft('RGB', (THUMBNAIL_MAX_SIZE * 2, THUMBNAIL_MAX_SIZE * 2))  # fast JPEG downscale
+        return _to_webp(image)
+
+
+@functools.lru_cache(maxsize=None)
+def _pymupdf():
+    """PyMuPDF, imported on first use like the other PDF libraries; None when not installed"""
+    try:
+        return lazy.load('fitz')
+    except ImportError:
+        return None
+
+
+def render_pdf(data) -> Optional[bytes]:
+    """First page of a PDF as a WebP thumbnail, or None when it cannot be rendered"""
+    from PIL import Image
+
+    fitz = _pymupdf()
+    if fitz is not None:
+        with fitz.open(stream=data.read() if hasattr(data, 'read') else data, filetype='pdf') as pdf:
+            if pdf.page_count == 0:
+                return None
+            page = pdf[0]
+            zoom = THUMBNAIL_MAX_SIZE * 2 / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            with Image.open(io.BytesIO(pixmap.tobytes('png'))) as image:
+                return _to_webp(image)
+
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(_stream(data))
+    if not reader.pages:
+        return None
+    images = reader.pages[0].images
+    if not images:
+        return None
+    largest = max(images, key=lambda embedded: len(embedded.data))
+    with Image.open(io.BytesIO(largest.data)) as image:
+        return _to_webp(image)
+
+
+def render(data, file_type: str) -> Optional[bytes]:
+    if file_type == 'pdf':
+        return render_pdf(data)
+    return render_image(data)
+
+
+async def generate(data, file_type: str) -> Optional[bytes]:
+    """Render a thumbnail of bytes or a seekable stream off the event loop; None when the file cannot be previewed"""
+    try:
+        return await asyncio.to_thread(render, data, file_type)
+    except Exception as e:
+        logging.error(f"Thumbnail rendering error: {str(e)}")
+        return None
@@ -0,0 +1,252 @@
+"""Resumable uploads for large PDFs and voice recordings.
+
+A client creates a session with the file name and total size, sends the bytes
+in chunks with their offset, and completes the session. After an interrupted
+PUT it asks for the session's offset and continues from there:
+
+    POST   /api/uploads                  {"kind": "document" | "voice", "filename", "size", ...}
+    PUT    /api/uploads/{id}?offset=N    raw bytes of the next chunk
+    GET    /api/uploads/{id}             current offset
+    POST   /api/uploads/{id}/complete    hand the file to /documents/upload or /documents/voice
+    DELETE /api/uploads/{id}             abort
+
+Chunks are written straight to a spool file in ``UPLOAD_SESSION_DIR``. The
+session (offset, expiry) lives in the ``upload_sessions`` collection, and a
+chunk is only accepted when its offset equals the stored one, so a retried
+chunk or two workers racing on one session cannot leave gaps. The spool
+directory must be shared by every worker that serves the session; with more
+than one host, route a session to one host or mount a shared volume.
+
+Completing a session claims it until ``completing_until``, so a second
+request for the same upload is refused while it is being processed. A claim
+left behind by a worker that crashed runs out after
+``UPLOAD_COMPLETE_LEASE_SECONDS``, and the upload can be completed again.
+
+Voice sessions are limited to ``TRANSCRIPTION_MAX_BYTES``, the largest file
+the transcription API accepts, so an oversized recording is refused when the
+session is created instead of after the whole file was sent.
+
+Sessions that are not completed within ``UPLOAD_SESSION_TTL_HOURS`` after
+their last chunk are deleted together with their spool files.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from pymongo import ReturnDocument
+
+UPLOAD_SESSIONS_COLLECTION = "upload_sessions"
+UPLOAD_SESSION_DIR = Path(os.environ.get('UPLOAD_SESSION_DIR', os.path.join(tempfile.gettempdir(), 'wellness-uploads')))
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(1024 * 1024 * 1024)))
+# The transcription API (Whisper) rejects files over 25 MB, so longer recordings cannot be processed
+TRANSCRIPTION_MAX_BYTES = 25 * 1024 * 1024
+UPLOAD_MAX_AUDIO_BYTES = min(
+    int(os.environ.get('UPLOAD_MAX_AUDIO_BYTES', str(TRANSCRIPTION_MAX_BYTES))), TRANSCRIPTION_MAX_BYTES
+)
+UPLOAD_CHUNK_MAX_BYTES = int(os.environ.get('UPLOAD_CHUNK_MAX_BYTES', str(64 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_HOURS = float(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '24'))
+UPLOAD_CLEANUP_SECONDS = float(os.environ.get('UPLOAD_CLEANUP_SECONDS', '600'))
+UPLOAD_COMPLETE_LEASE_SECONDS = float(os.environ.get('UPLOAD_COMPLETE_LEASE_SECONDS', '1800'))
+
+# Suggested chunk size for clients
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
+KINDS = {"document": UPLOAD_MAX_BYTES, "voice": UPLOAD_MAX_AUDIO_BYTES}
+
+SESSION_PROJECTION = {"_id": 0}
+
+
+class UploadSessionError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def spool_path(upload_id: str) -> Path:
+    return UPLOAD_SESSION_DIR / f"{upload_id}.part"
+
+
+def _expires_at(now: datetime) -> str:
+    return (now + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)).isoformat()
+
+
+def public(session: dict) -> dict:
+    return {
+        "upload_id": session["id"],
+        "kind": session["kind"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "offset": session["offset"],
+        "complete": session["offset"] == session["size"],
+        "chunk_size": UPLOAD_CHUNK_BYTES,
+        "max_chunk_size": UPLOAD_CHUNK_MAX_BYTES,
+        "expires_at": session["expires_at"],
+    }
+
+
+async def ensure_indexes(db):
+    await db[UPLOAD_SESSIONS_COLLECTION].create_index("id", unique=True)
+    await db[UPLOAD_SESSIONS_COLLECTION].create_index("expires_at")
+
+
+async def create(db, kind: str, filename: str, size: int, content_type: Optional[str] = None,
+                 title: Optional[str] = None, category: Optional[str] = None) -> dict:
+    if kind not in KINDS:
+        raise UploadSessionError(400, f"Onbekend upload type; kies uit {', '.join(KINDS)}")
+    if not filename or size <= 0:
+        raise UploadSessionError(400, "Bestandsnaam en grootte zijn verplicht")
+    if size > KINDS[kind]:
+        raise UploadSessionError(413, f"Bestand is te groot (maximaal {KINDS[kind] // (1024 * 1024)} MB)")
+
+    now = datetime.now(timezone.utc)
+    session = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "filename": os.path.basename(filename),
+        "content_type": content_type,
+        "size": size,
+        "offset": 0,
+        "title": title,
+        "category": category,
+        "created_at": now.isoformat(),
+        "expires_at": _expires_at(now),
+    }
+    UPLOAD_SESSION_DIR.mkdir(parents=True, exist_ok=True)
+    spool_path(session["id"]).touch()
+    await db[UPLOAD_SESSIONS_COLLECTION].insert_one(dict(session))
+    return session
+
+
+async def get(db, upload_id: str) -> dict:
+    session = await db[UPLOAD_SESSIONS_COLLECTION].find_one({"id": upload_id}, SESSION_PROJECTION)
+    if not session:
+        raise UploadSessionError(404, "Upload sessie niet gevonden of verlopen")
+    return session
+
+
+async def append(db, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> dict:
+    """Write one chunk at offset; the offset must be where the previous chunk ended"""
+    session = await get(db, upload_id)
+    if offset != session["offset"]:
+        raise UploadSessionError(409, f"Verwachte offset {session['offset']}")
+
+    written = 0
+    fd = os.open(spool_path(upload_id), os.O_WRONLY)
+    try:
+        async for data in chunks:
+            if not data:
+                continue
+            if written + len(data) > UPLOAD_CHUNK_MAX_BYTES:
+                raise UploadSessionError(413, f"Deel is te groot (maximaal {UPLOAD_CHUNK_MAX_BYTES} bytes)")
+            if offset + written + len(data) > session["size"]:
+                raise UploadSessionError(413, "Meer bytes dan de opgegeven bestandsgrootte")
+            await asyncio.to_thread(os.pwrite, fd, data, offset + written)
+            written += len(data)
+    except UploadSessionError:
+        raise
+    except Exception:
+        # The connection dropped mid-chunk: keep what arrived so the client resumes from there
+        if written:
+            await _advance(db, upload_id, offset, written)
+        raise
+    finally:
+        os.close(fd)
+    return await _advance(db, upload_id, offset, written)
+
+
+async def _advance(db, upload_id: str, offset: int, written: int) -> dict:
+    now = datetime.now(timezone.utc)
+    updated = await db[UPLOAD_SESSIONS_COLLECTION].find_one_and_update(
+        {"id": upload_id, "offset": offset},
+        {"$set": {"offset": offset + written, "updated_at": now.isoformat(), "expires_at": _expires_at(now)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        # Another request stored a chunk at this offset first
+        raise UploadSessionError(409, f"Verwachte offset {(await get(db, upload_id))['offset']}")
+    updated.pop("_id", None)
+    return updated
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def claim(db, upload_id: str, sha256: Optional[str] = None) -> dict:
+    """Take a fully received session for processing, so it is completed only once"""
+    session = await get(db, upload_id)
+    if session["offset"] != session["size"]:
+        raise UploadSessionError(409, f"Upload is onvolledig ({session['offset']} van {session['size']} bytes)")
+    now = datetime.now(timezone.utc)
+    lease = (now + timedelta(seconds=UPLOAD_COMPLETE_LEASE_SECONDS)).isoformat()
+    claimed = await db[UPLOAD_SESSIONS_COLLECTION].find_one_and_update(
+        {"id": upload_id, "$or": [
+            {"completing_until": {"$exists": False}},
+            {"completing_until": {"$lt": now.isoformat()}},
+        ]},
+        # Keep the session and its spool file at least as long as the claim
+        {"$set": {"completing_until": lease, "expires_at": max(session["expires_at"], lease)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if claimed is None:
+        raise UploadSessionError(409, "Upload wordt al verwerkt")
+    claimed.pop("_id", None)
+    if sha256 and await asyncio.to_thread(_sha256, spool_path(upload_id)) != sha256.lower():
+        await release(db, upload_id)
+        raise UploadSessionError(422, "Controlegetal (SHA-256) komt niet overeen")
+    return claimed
+
+
+async def release(db, upload_id: str):
+    """Let a claimed session be completed again, e.g. after processing failed"""
+    await db[UPLOAD_SESSIONS_COLLECTION].update_one({"id": upload_id}, {"$unset": {"completing_until": ""}})
+
+
+async def discard(db, upload_id: str):
+    await db[UPLOAD_SESSIONS_COLLECTION].delete_one({"id": upload_id})
+    try:
+        spool_path(upload_id).unlink()
+    except FileNotFoundError:
+        pass
+
+
+async def cleanup(db) -> int:
+    """Delete expired sessions and spool files without a session"""
+    now = datetime.now(timezone.utc).isoformat()
+    removed = 0
+    async for session in db[UPLOAD_SESSIONS_COLLECTION].find({"expires_at": {"$lt": now}}, {"id": 1}):
+        await discard(db, session["id"])
+        removed += 1
+
+    if UPLOAD_SESSION_DIR.exists():
+        cutoff = datetime.now(timezone.utc).timestamp() - UPLOAD_SESSION_TTL_HOURS * 3600
+        for path in UPLOAD_SESSION_DIR.glob("*.part"):
+            if path.stat().st_mtime < cutoff and not await db[UPLOAD_SESSIONS_COLLECTION].find_one({"id": path.stem}, {"_id": 1}):
+                path.unlink(missing_ok=True)
+                removed += 1
+    if removed:
+        logging.info(f"Removed {removed} abandoned upload sessions")
+    return removed
+
+
+async def cleanup_periodically(db, interval: float = UPLOAD_CLEANUP_SECONDS):
+    try:
+        while True:
+            try:
+                await cleanup(db)
+            except Exception as e:
+                logging.error(f"Upload session cleanup error: {str(e)}")
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        raise
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Local webhook receiver for testing event delivery
+
+Prints every batch posted by the server's webhook dispatcher, skips batches
+whose Idempotency-Key it has already seen, and checks X-Webhook-Signature when
+--secret is given. --fail-rate makes it answer 503 to a fraction of requests
+to exercise retries and backoff.
+
+Example:
+    python webhook_receiver.py --port 8099 --fail-rate 0.3
+    WEBHOOK_URLS=http://localhost:8099/hook uvicorn server:app
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(args):
+    seen_keys = set()
+    seen_events = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            key = self.headers.get("Idempotency-Key")
+
+            if args.secret:
+                expected = "sha256=" + hmac.new(args.secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+                if not hmac.compare_digest(expected, self.headers.get("X-Webhook-Signature", "")):
+                    print(f"REJECTED {key}: bad signature", flush=True)
+                    return self.respond(401)
+
+            if random.random() < args.fail_rate:
+                print(f"FAILED   {key} (simulated)", flush=True)
+                return self.respond(503)
+
+            if key in seen_keys:
+                print(f"DUPLICATE {key}, ignored", flush=True)
+                return self.respond(200)
+            seen_keys.add(key)
+
+            for event in json.loads(body)["events"]:
+                duplicate = " (duplicate event)" if event["id"] in seen_events else ""
+                seen_events.add(event["id"])
+                print(f"#{event['seq']} {event['type']} {event['document_id']} "
+                      f"{event['data'].get('title', '')!r}{duplicate}", flush=True)
+            self.respond(200)
+
+        def respond(self, status: int):
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--secret", help="WEBHOOK_SECRET of the server, to verify signatures")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"Listening on http://{args.host}:{args.port}/", flush=True)
+    ThreadingHTTPServer((args.host, args.port), make_handler(args)).serve_forever()
@@ -195,8 +195,16 @@ const Dashboard = () => {
     }
   };
 
-  const handleDocumentClick = (doc) => {
+  const handleDocumentClick = async (doc) => {
     setSelectedDocument(doc);
+    // List rows of large documents only carry the start of the body
+    if (!doc.content_external) return;
+    try {
+      const response = await axios.get(`${API}/documents/${doc.id}`);
+      setSelectedDocument(current => (current && current.id === doc.id ? response.data : current));
+    } catch (error) {
+      toast.error("Fout bij ophalen document");
+    }
   };
 
   const handleBackToMain = () => {
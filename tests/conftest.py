@@ -0,0 +1,5 @@
+"""Backend modules are imported as top-level modules, like server.py does"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "backend"))
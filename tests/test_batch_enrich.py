@@ -0,0 +1,108 @@
+"""Batch enrichment: prompt, response validation and the per-document fallback"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import enrichment
+
+DOCS = [
+    {"id": "a", "title": "Magnesium", "content": "Magnesium bij kramp. " * 200},
+    {"id": "b", "title": "Zink", "content": "Jansen P. Zink en afweer. J Nutr 2019;12:45-9. doi:10.1000/zink"},
+]
+
+
+def answer(*items) -> str:
+    return json.dumps({"documents": list(items)})
+
+
+def test_prompt_holds_every_document_excerpt():
+    prompt = enrichment.build_batch_prompt(DOCS)
+    assert "### DOCUMENT a" in prompt and "### DOCUMENT b" in prompt
+    assert "Magnesium bij kramp. " * 10 in prompt
+    assert len(prompt) < len(DOCS[0]["content"]) + 2000
+
+
+def test_response_is_validated_per_document():
+    response = "Hier is het resultaat:\n" + answer(
+        {"id": "a", "tags": ["magnesium", " - kramp", "magnesium"], "references": []},
+        {"id": "x", "tags": ["onbekend"], "references": []},
+        {"id": "b", "tags": [], "references": []},
+    ) + "\nSucces!"
+    assert enrichment.parse_batch_response(response, ["a", "b"]) == {
+        "a": {"tags": ["magnesium", "kramp"], "references": []},
+    }
+
+
+def test_malformed_or_partial_responses_give_no_results():
+    ids = ["a", "b"]
+    assert enrichment.parse_batch_response("GEEN", ids) == {}
+    assert enrichment.parse_batch_response('{"documents": [{"id": "a", "tags": ["x"]', ids) == {}
+    assert enrichment.parse_batch_response('{"documents": {"id": "a"}}', ids) == {}
+    assert enrichment.parse_batch_response(answer({"id": "a", "tags": ["x", 3]}), ids) == {}
+    assert enrichment.parse_batch_response(answer({"id": "a", "tags": ["x"], "references": "GEEN"}), ids) == {}
+    # Missing references count as none
+    assert enrichment.parse_batch_response(answer({"id": "a", "tags": ["x"]}), ids) == {
+        "a": {"tags": ["x"], "references": []},
+    }
+
+
+def test_unanswered_documents_fall_back_without_a_reference_llm_call(monkeypatch):
+    import batch_enrich
+    import server
+
+    class Chat:
+        def __init__(self, **kwargs):
+            pass
+
+        def with_model(self, provider, model):
+            return self
+
+        async def send_message(self, message):
+            return answer({"id": "a", "tags": ["magnesium"], "references": []})
+
+    calls = []
+
+    async def tags_with_ai(title, content):
+        calls.append("tags")
+        return ["zink"]
+
+    async def references_with_ai(content):
+        calls.append("references")
+        return []
+
+    monkeypatch.setattr(server, "LlmChat", Chat)
+    monkeypatch.setattr(server, "UserMessage", lambda text: text)
+    monkeypatch.setattr(server, "generate_tags_with_ai", tags_with_ai)
+    monkeypatch.setattr(server, "extract_references_with_ai", references_with_ai)
+
+    args = SimpleNamespace(fields=["tags", "references"])
+    stats = batch_enrich.Stats(len(DOCS))
+    updates = dict((doc["id"], update) for doc, update in asyncio.run(batch_enrich.enrich_batch(DOCS, args, stats)))
+
+    assert updates["a"]["tags"] == ["magnesium"]
+    assert updates["b"]["tags"] == ["zink"]
+    assert any("doi:10.1000/zink" in reference for reference in updates["b"]["references"])
+    assert calls == ["tags"]
+    assert (stats.batch_calls, stats.single_calls, stats.fallback_docs) == (1, 1, 1)
+
+
+def test_tag_filter_is_escaped():
+    import batch_enrich
+
+    args = SimpleNamespace(category=None, tag="vitamine c (ascorbinezuur)", missing_only=False, fields=["tags"])
+    assert batch_enrich.build_query(args)["tags"]["$regex"] == r"^vitamine\ c\ \(ascorbinezuur\)$"
+
+
+def test_writes_are_propagated_like_edits(monkeypatch):
+    import batch_enrich
+    import server
+
+    written = []
+
+    async def on_document_write(document_id, before=None, after=None):
+        written.append((document_id, before["tags"], after["tags"]))
+
+    monkeypatch.setattr(server, "on_document_write", on_document_write)
+    before = {"id": "a", "title": "Magnesium", "tags": ["kennis"]}
+    asyncio.run(batch_enrich.record_writes([(before, {"tags": ["magnesium"], "updated_at": "2026"})]))
+    assert written == [("a", ["kennis"], ["magnesium"])]
@@ -0,0 +1,70 @@
+"""Read caches: precise invalidation and write-version stamping (mongomock)"""
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import cache  # noqa: E402
+
+
+def fresh_db():
+    return mongomock_motor.AsyncMongoMockClient()["cache_test"]
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    for read_cache in (cache.document_cache, cache.category_cache, cache.tag_cache, cache.search_cache):
+        read_cache.clear()
+
+
+def test_invalidate_document_drops_it_and_its_tag_lists():
+    cache.document_cache.set("a", {"id": "a", "content": "magnesium"})
+    cache.document_cache.set("b", {"id": "b", "content": "zink"})
+    cache.tag_cache.set(cache.tag_key("Magnesium"), [{"id": "a"}])
+    cache.tag_cache.set(cache.tag_key("zink"), [{"id": "b"}])
+
+    cache.invalidate_document("a", ["MAGNESIUM"])
+    assert cache.document_cache.get("a") is cache.MISSING
+    assert cache.tag_cache.get("magnesium") is cache.MISSING
+    assert cache.document_cache.get("b")["id"] == "b"
+    assert cache.tag_cache.get("zink") == [{"id": "b"}]
+
+
+def test_search_entry_from_an_older_version_is_not_served():
+    key = ("ranked", ("magnesium",), None, None, None)
+    cache.search_cache.store(key, 3, 1, b"[]")
+    assert cache.search_cache.lookup(key, 3, 1) == b"[]"
+    assert cache.search_cache.lookup(key, 4, 1) is cache.MISSING
+    # The stale entry was dropped, not kept for a later lookup at the old version
+    assert cache.search_cache.lookup(key, 3, 1) is cache.MISSING
+
+    cache.search_cache.store(key, 4, 1, b"[]")
+    assert cache.search_cache.lookup(key, 4, 2) is cache.MISSING
+    assert cache.search_cache.stats()["stale"] >= 2
+
+
+def test_write_version_is_shared_through_the_database():
+    async def run():
+        db = fresh_db()
+        assert await cache.write_version(db) == 0
+        await cache.bump_write_version(db)
+        await cache.bump_write_version(db)
+        assert await cache.write_version(db) == 2
+
+    asyncio.run(run())
+
+
+def test_value_larger_than_the_budget_is_not_cached():
+    small = cache.ReadCache("small", 4096, 60)
+    small.set("large", {"id": "large", "content": "x" * 10000})
+    assert small.get("large") is cache.MISSING
+    small.set("a", {"id": "a", "content": "x"})
+    assert small.get("a")["id"] == "a"
+    assert small.stats()["hits"] == 1 and small.stats()["misses"] == 1
+
+
+def test_disabled_cache_never_serves(monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_ENABLED", False)
+    cache.document_cache.set("a", {"id": "a"})
+    assert cache.document_cache.get("a") is cache.MISSING
@@ -0,0 +1,71 @@
+"""Chat history in per-session buckets (mongomock)"""
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import chats  # noqa: E402
+
+
+def message(session_id, i, role="user"):
+    return {"id": f"{session_id}-{i}", "session_id": session_id, "role": role, "content": f"bericht {i}",
+            "timestamp": f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}+00:00"}
+
+
+def run(scenario):
+    async def wrapper():
+        db = mongomock_motor.AsyncMongoMockClient()["chats_test"]
+        await chats.ensure_indexes(db)
+        return await scenario(db)
+    return asyncio.run(wrapper())
+
+
+def test_turns_fill_buckets_and_history_returns_the_latest(monkeypatch):
+    monkeypatch.setattr(chats, "CHAT_BUCKET_SIZE", 4)
+
+    async def scenario(db):
+        for i in range(0, 10, 2):
+            await chats.append(db, "s", [message("s", i), message("s", i + 1, "assistant")])
+        buckets = await db[chats.BUCKETS_COLLECTION].find({"session_id": "s"}).to_list(None)
+        return buckets, await chats.history(db, "s", limit=5), await chats.history(db, "s")
+
+    buckets, latest, everything = run(scenario)
+    assert sorted(bucket["count"] for bucket in buckets) == [2, 4, 4]
+    assert [m["id"] for m in latest] == [f"s-{i}" for i in range(5, 10)]
+    assert [m["id"] for m in everything] == [f"s-{i}" for i in range(10)]
+
+
+def test_legacy_messages_are_merged_with_new_turns():
+    async def scenario(db):
+        await db[chats.LEGACY_COLLECTION].insert_many([message("s", i) for i in range(3)])
+        await chats.append(db, "s", [message("s", 3), message("s", 4, "assistant")])
+        return await chats.history(db, "s"), await chats.history(db, "s", limit=3)
+
+    everything, latest = run(scenario)
+    assert [m["id"] for m in everything] == [f"s-{i}" for i in range(5)]
+    assert [m["id"] for m in latest] == ["s-2", "s-3", "s-4"]
+
+
+def test_cleanup_removes_only_idle_sessions():
+    async def scenario(db):
+        await chats.append(db, "old", [message("old", 0)])
+        await chats.append(db, "active", [message("active", 0)])
+        await db[chats.BUCKETS_COLLECTION].update_many({"session_id": "active"}, {"$set": {"last_at": "2999-01-01"}})
+        removed = await chats.cleanup(db, retention_days=1)
+        return removed, await db[chats.BUCKETS_COLLECTION].distinct("session_id")
+
+    assert run(scenario) == (1, ["active"])
+
+
+def test_cleanup_keeps_legacy_messages_of_active_sessions():
+    async def scenario(db):
+        legacy = db[chats.LEGACY_COLLECTION]
+        await legacy.insert_many([message("active", 0), message("idle", 0), message("legacy-active", 0)])
+        await legacy.insert_one({**message("legacy-active", 1), "timestamp": "2999-01-01T00:00:00+00:00"})
+        await chats.append(db, "active", [message("active", 1)])
+        await db[chats.BUCKETS_COLLECTION].update_many({"session_id": "active"}, {"$set": {"last_at": "2999-01-01"}})
+        removed = await chats.cleanup(db, retention_days=1)
+        return removed, sorted(await legacy.distinct("session_id")), await legacy.count_documents({})
+
+    assert run(scenario) == (1, ["active", "legacy-active"], 3)
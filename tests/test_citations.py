@@ -0,0 +1,116 @@
+"""Local reference parser and the shared citation index"""
+import asyncio
+
+import pytest
+
+import citations
+
+PAPER = """Magnesium en slaap
+
+Uit onderzoek (Abbasi et al., 2012) blijkt dat magnesium de slaap verbetert.
+Zie ook https://pubmed.ncbi.nlm.nih.gov/23853635/ en doi:10.1016/j.jsbmb.2012.03.001.
+
+## Referenties
+1. Abbasi B, Kimiagar M, Sadeghniiat K. The effect of magnesium supplementation on primary insomnia. J Res Med Sci. 2012;17(12):1161-9. PMID: 23853635
+2. Jansen, P. (2019). Vitamine D en weerstand. Nederlands Tijdschrift, 12, 45-49.
+- Zonder jaartal en dus geen referentie
+
+## Volgende hoofdstuk
+Een zin met 2019 is hier geen referentie meer.
+"""
+
+
+CITED_BOTH = "Jansen P. Titel. J 2019;1:2. doi:10.1000/xyz PMID: 123"
+
+
+def test_identifiers_normalize_links_and_trailing_punctuation():
+    text = ("Zie https://doi.org/10.1000/ABC.123). en https://www.example.com/pagina/?utm_source=x&id=4, "
+            "PMID:123 of PMC 98765 en https://www.ncbi.nlm.nih.gov/pmc/articles/PMC55555/")
+    assert citations.identifiers(text) == [
+        ("doi", "10.1000/abc.123"),
+        ("url", "https://example.com/pagina?id=4"),
+        ("pmcid", "PMC55555"),
+        ("pmid", "123"),
+        ("pmcid", "PMC98765"),
+    ]
+
+
+def test_extract_finds_inline_identifiers_and_reference_section():
+    found = citations.extract(PAPER)
+    texts = [citation["text"] for citation in found]
+    # The PubMed link and the Vancouver line are the same study
+    pubmed = next(c for c in found if "pmid:23853635" in c["keys"])
+    assert pubmed["type"] == "pmid"
+    assert sum("pmid:23853635" in c["keys"] for c in found) == 1
+    assert "doi:10.1016/j.jsbmb.2012.03.001" in [key for c in found for key in c["keys"]]
+    assert any(text.startswith("Jansen, P. (2019).") for text in texts)
+    # A line with a citation in passing is not a reference itself; only its identifiers count
+    assert not any(c["type"] == "citation" and "Uit onderzoek" in c["text"] for c in found)
+    assert not any("Zonder jaartal" in text for text in texts)
+    assert not any("geen referentie meer" in text for text in texts)
+
+
+def test_citation_styles_outside_a_reference_section():
+    found = citations.extract(
+        "Jansen, P. (2019). Vitamine D en weerstand.\n"
+        "Smith J, de Vries K. Zinc and immunity. Nutrients 2020;12:45-9.\n"
+        "Brown et al. (2018) vonden hetzelfde.\n"
+        "Gewone zin uit 2019 zonder auteur.\n"
+    )
+    assert [c["type"] for c in found] == ["citation", "citation", "citation"]
+    assert all(c["key"].startswith("ref:") for c in found)
+
+
+def test_same_study_under_several_identifiers_is_one_reference():
+    found = citations.extract(f"Eerst PMID: 123.\n{CITED_BOTH}\n")
+    assert len(found) == 1
+    assert found[0]["keys"] == ["pmid:123", "doi:10.1000/xyz"]
+    assert citations.reference_strings(found) == ["Eerst PMID: 123."]
+
+
+def test_lookup_keys():
+    assert citations.lookup_keys(" 23853635 ") == ["pmid:23853635"]
+    assert citations.lookup_keys("https://doi.org/10.1000/XYZ") == ["doi:10.1000/xyz"]
+    assert citations.lookup_keys("- Jansen, P. (2019). Titel.") == [citations.text_key("Jansen, P. (2019). Titel.")]
+    # Typed text matches the stored key regardless of case, accents and punctuation
+    assert citations.text_key("Jansen, P. (2019). Titél") == citations.text_key("jansen p 2019 titel")
+
+
+def test_index_merges_a_study_cited_under_different_keys():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["citations_test"]
+        await citations.ensure_indexes(db)
+        await citations.update(db, "a", None, found=citations.extract("Zie PMID: 123."))
+        await citations.update(db, "b", None, found=citations.extract(CITED_BOTH))
+        await citations.update(db, "c", None, found=citations.extract("Alleen doi:10.1000/xyz."))
+        rows = await db[citations.CITATIONS_COLLECTION].find().to_list(None)
+        cited = await citations.document_citations(db, "c")
+        by_doi = await citations.citing_documents(db, "https://doi.org/10.1000/xyz")
+        await citations.update(db, "a", None, found=[])
+        after_delete = await citations.citing_documents(db, "123")
+        return rows, cited, by_doi, after_delete
+
+    rows, cited, by_doi, after_delete = asyncio.run(scenario())
+    assert len(rows) == 1
+    assert sorted(rows[0]["keys"]) == ["doi:10.1000/xyz", "pmid:123"]
+    assert sorted(rows[0]["documents"]) == ["a", "b", "c"]
+    assert cited[0]["cited_by"] == 3
+    assert sorted(by_doi[0]["documents"]) == ["a", "b", "c"]
+    assert sorted(after_delete[0]["documents"]) == ["b", "c"]
+
+
+def test_index_merges_rows_that_turn_out_to_be_one_study():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["citations_test"]
+        await citations.update(db, "a", None, found=citations.extract("PMID: 123"))
+        await citations.update(db, "b", None, found=citations.extract("doi:10.1000/xyz"))
+        await citations.update(db, "c", None, found=citations.extract(CITED_BOTH))
+        return await db[citations.CITATIONS_COLLECTION].find().to_list(None)
+
+    rows = asyncio.run(scenario())
+    assert len(rows) == 1
+    assert sorted(rows[0]["documents"]) == ["a", "b", "c"]
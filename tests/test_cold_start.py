@@ -0,0 +1,42 @@
+"""Cold-start budget of the API process: `import server` must stay cheap"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parents[1] / "backend"
+
+# Generous enough for a slow CI machine; the import took ~0.7s when this was written
+IMPORT_BUDGET_SECONDS = float(os.environ.get("IMPORT_BUDGET_SECONDS", "2.5"))
+
+# Only imported on first use through lazy.py
+DEFERRED_MODULES = ["emergentintegrations", "PyPDF2", "docx", "requests", "litellm", "openai", "fitz"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import server
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def import_server() -> dict:
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_server_within_budget():
+    # Best of three, so a busy machine does not fail the build
+    seconds = min(import_server()["seconds"] for _ in range(3))
+    assert seconds < IMPORT_BUDGET_SECONDS, f"import server took {seconds:.2f}s (budget {IMPORT_BUDGET_SECONDS}s)"
+
+
+def test_heavy_libraries_are_not_imported():
+    modules = set(import_server()["modules"])
+    loaded = [name for name in DEFERRED_MODULES if name in modules]
+    assert not loaded, f"imported at startup: {loaded}"
@@ -0,0 +1,84 @@
+"""Edit planning: which derived fields an edit affects"""
+import enrichment
+
+PARAGRAPH = ("Magnesium ondersteunt de spieren en het zenuwstelsel. " * 30).strip()
+
+
+def article(paragraphs: int = 40) -> str:
+    return "\n\n".join(f"{i}. {PARAGRAPH}" for i in range(paragraphs))
+
+
+def test_chunks_keep_whole_paragraphs():
+    content = article()
+    chunks = enrichment.chunk_content(content)
+    assert len(chunks) > 1
+    assert "\n\n".join(chunks) == content
+    assert enrichment.chunk_hashes(content.replace(". ", ".  ")) == enrichment.chunk_hashes(content)
+
+
+def test_unchanged_content_plans_nothing():
+    content = article()
+    plan = enrichment.plan(content, content, enrichment.chunk_hashes(content))
+    assert not plan["changed"]
+    assert plan["changed_chunks"] == []
+    assert not plan["refresh_tags"] and not plan["refresh_references"]
+
+
+def test_small_edit_at_the_end_skips_llm_fields():
+    content = article()
+    edited = content + " Zie ook zink."
+    plan = enrichment.plan(content, edited)
+    assert plan["changed"] and plan["trivial"]
+    assert plan["changed_chunks"] == [len(plan["chunk_hashes"]) - 1]
+    assert not plan["refresh_tags"]
+    assert plan["refresh_references"]
+
+
+def test_typo_in_a_small_document_is_trivial():
+    content = article(2)
+    assert len(enrichment.chunk_content(content)) == 2
+    edited = content.replace("spieren", "spiren", 1)
+    plan = enrichment.plan(content, edited)
+    assert plan["changed"] and plan["changed_chunks"] == [0]
+    assert plan["changed_ratio"] < 0.01
+    assert plan["trivial"]
+    assert not plan["refresh_tags"]
+    assert plan["refresh_references"]
+
+
+def test_changed_chars_counts_the_span_between_prefix_and_suffix():
+    assert enrichment.changed_chars("magnesium en zink", "magnesium of zink") == 2
+    assert enrichment.changed_chars("zink", "zink") == 0
+    assert enrichment.changed_chars("ab" * 5000, "ab" * 2500 + "c" + "ab" * 2500) == 1
+    assert enrichment.changed_chars("aaa", "aaaa") == 1
+
+
+def test_large_edit_in_the_tag_window_refreshes_tags():
+    content = article(4)
+    edited = "Vitamine D en calcium. " * 30 + "\n\n" + content
+    plan = enrichment.plan(content, edited)
+    assert not plan["trivial"]
+    assert plan["refresh_tags"]
+
+
+def test_large_edit_after_the_tag_window_keeps_tags():
+    content = article(4)
+    edited = content + "\n\n" + "Ijzer en vermoeidheid. " * 100
+    plan = enrichment.plan(content, edited)
+    assert not plan["trivial"]
+    assert not plan["refresh_tags"]
+    assert plan["refresh_references"]
+
+
+def test_title_change_refreshes_tags_without_content_change():
+    content = article()
+    plan = enrichment.plan(content, content, title_changed=True)
+    assert plan["changed"] and not plan["trivial"]
+    assert plan["refresh_tags"] and not plan["refresh_references"]
+
+
+def test_first_difference_across_blocks():
+    old = "a" * 10000
+    assert enrichment.first_difference(old, old) == 10000
+    assert enrichment.first_difference(old, old[:9000] + "b" + old[9001:]) == 9000
+    assert enrichment.first_difference(old, old[:5000]) == 5000
@@ -0,0 +1,70 @@
+"""Event outbox: seq allocation and the after= cursor (mongomock)"""
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import events  # noqa: E402
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def fresh_db():
+    db = mongomock_motor.AsyncMongoMockClient()["events_test"]
+    await events.ensure_indexes(db)
+    return db
+
+
+def test_concurrent_records_get_consecutive_seqs():
+    async def scenario():
+        db = await fresh_db()
+        seqs = await asyncio.gather(*[
+            events.record(db, f"doc-{i}", after={"id": f"doc-{i}", "title": str(i)}) for i in range(20)
+        ])
+        stored = [row["seq"] async for row in db[events.EVENTS_COLLECTION].find().sort("seq", 1)]
+        return seqs, stored
+
+    seqs, stored = run(scenario())
+    assert sorted(seqs) == list(range(1, 21))
+    assert stored == list(range(1, 21))
+
+
+def test_seq_continues_after_events_expire():
+    async def scenario():
+        db = await fresh_db()
+        await events.record(db, "a", after={"id": "a"})
+        await events.record(db, "b", after={"id": "b"})
+        await db[events.EVENTS_COLLECTION].delete_many({})  # what the TTL index does
+        return await events.record(db, "c", before={"id": "c"})
+
+    assert run(scenario()) == 3
+
+
+def test_read_pages_through_events_in_order():
+    async def scenario():
+        db = await fresh_db()
+        await events.record(db, "a", after={"id": "a", "title": "A"})
+        await events.record(db, "a", before={"id": "a", "title": "A"}, after={"id": "a", "title": "B"})
+        await events.record(db, "a", before={"id": "a", "title": "B"})
+        first = await events.read(db, after=0, limit=2)
+        second = await events.read(db, after=first["next_cursor"], limit=2)
+        deletes = await events.read(db, after=0, types=["document.deleted"])
+        return first, second, deletes
+
+    first, second, deletes = run(scenario())
+    assert [e["type"] for e in first["events"]] == ["document.created", "document.updated"]
+    assert first["has_more"] and first["next_cursor"] == 2
+    assert first["events"][1]["data"]["changed_fields"] == ["title"]
+    assert [e["seq"] for e in second["events"]] == [3] and not second["has_more"]
+    assert [e["seq"] for e in deletes["events"]] == [3]
+
+
+def test_record_ignores_noop_writes():
+    async def scenario():
+        db = await fresh_db()
+        return await events.record(db, "a"), await db[events.EVENTS_COLLECTION].count_documents({})
+
+    assert run(scenario()) == (None, 0)
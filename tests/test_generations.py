@@ -0,0 +1,83 @@
+"""Generation cache: keys, hits, coalescing and cancelled producers (mongomock)"""
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import generations  # noqa: E402
+
+FIELDS = {"condition": "Vermoeidheid", "patient_details": ""}
+
+
+def fresh_db():
+    return mongomock_motor.AsyncMongoMockClient()["generations_test"]
+
+
+class Producer:
+    def __init__(self, delay: float = 0):
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return f"advies {self.calls}"
+
+
+def test_key_ignores_case_accents_and_whitespace():
+    a = generations.cache_key("plan", {"condition": " Vermoeidheid  en Stress"}, "v1", "m")
+    b = generations.cache_key("plan", {"condition": "vermoeidheid en stréss"}, "v1", "m")
+    assert a == b
+    assert a != generations.cache_key("plan", {"condition": "vermoeidheid en stress"}, "v2", "m")
+
+
+def test_kb_version_changes_when_a_source_document_changes():
+    docs = [{"id": "a", "updated_at": "1"}, {"id": "b", "created_at": "0"}]
+    assert generations.kb_version(docs) == generations.kb_version(docs[::-1])
+    assert generations.kb_version(docs) != generations.kb_version([{"id": "a", "updated_at": "2"}, docs[1]])
+    assert generations.kb_version([]) == generations.NO_DOCUMENTS
+
+
+def test_second_request_is_served_from_the_cache():
+    async def scenario():
+        db, produce = fresh_db(), Producer()
+        first = await generations.generate(db, "plan", FIELDS, "v1", "m", produce)
+        second = await generations.generate(db, "plan", FIELDS, "v1", "m", produce)
+        refreshed = await generations.generate(db, "plan", FIELDS, "v1", "m", produce, refresh=True)
+        bypassed = await generations.generate(db, "plan", FIELDS, "v1", "m", produce, bypass=True)
+        return first, second, refreshed, bypassed, produce.calls
+
+    first, second, refreshed, bypassed, calls = asyncio.run(scenario())
+    assert first[1]["status"] == "miss" and second == ("advies 1", {**second[1], "status": "hit"})
+    assert refreshed[0] == "advies 2" and refreshed[1]["status"] == "refresh"
+    assert bypassed[1]["status"] == "bypass" and calls == 3
+
+
+def test_identical_requests_share_one_generation():
+    async def scenario():
+        db, produce = fresh_db(), Producer(delay=0.05)
+        results = await asyncio.gather(*[generations.generate(db, "plan", FIELDS, "v1", "m", produce) for _ in range(3)])
+        return results, produce.calls
+
+    results, calls = asyncio.run(scenario())
+    assert calls == 1
+    assert [info["status"] for _, info in results] == ["miss", "coalesced", "coalesced"]
+    assert not generations._inflight
+
+
+def test_waiters_take_over_when_the_producer_is_cancelled():
+    async def scenario():
+        db, produce = fresh_db(), Producer(delay=0.05)
+        producer = asyncio.create_task(generations.generate(db, "plan", FIELDS, "v1", "m", produce))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(generations.generate(db, "plan", FIELDS, "v1", "m", produce))
+        await asyncio.sleep(0.01)
+        producer.cancel()
+        response, info = await asyncio.wait_for(waiter, timeout=1)
+        return producer.cancelled(), response, info, produce.calls
+
+    cancelled, response, info, calls = asyncio.run(scenario())
+    assert cancelled
+    assert (response, info["status"], calls) == ("advies 2", "miss", 2)
+    assert not generations._inflight
@@ -0,0 +1,85 @@
+"""Entity graph: incremental updates must match a full rebuild (mongomock)"""
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import graph  # noqa: E402
+
+EDITS = [
+    ("a", "Magnesium en vitamine D bij vermoeidheid. Magnesium."),
+    ("b", "Magnesium en zink."),
+    ("c", "Ijzer, zink en kurkuma."),
+    ("a", "Magnesium en ijzer."),       # vitamine d removed, ijzer added
+    ("b", None),                        # deleted
+    ("c", "Ijzer, zink en kurkuma."),   # unchanged
+    ("b", "Zink en kurkuma met magnesium."),
+]
+
+
+def fresh_db():
+    return mongomock_motor.AsyncMongoMockClient()["graph_test"]
+
+
+async def snapshot(db) -> tuple:
+    mentions = sorted([
+        (row["document_id"], row["entity"], row["count"])
+        async for row in db[graph.MENTIONS_COLLECTION].find()
+    ])
+    edges = {row["_id"]: row["documents"] async for row in db[graph.EDGES_COLLECTION].find()}
+    return mentions, edges
+
+
+def test_incremental_updates_match_rebuild():
+    async def run():
+        db, rebuilt = fresh_db(), mongomock_motor.AsyncMongoMockClient()["graph_rebuilt"]
+        final = {}
+        for document_id, content in EDITS:
+            doc = None if content is None else {"id": document_id, "title": "", "content": content}
+            await graph.update(db, document_id, doc)
+            if doc is None:
+                final.pop(document_id, None)
+            else:
+                final[document_id] = doc
+
+        found = {document_id: names for document_id, names in graph.document_mentions(list(final.values())) if names}
+        await graph.replace_all(rebuilt, found)
+        assert await snapshot(db) == await snapshot(rebuilt)
+
+        mentions, edges = await snapshot(db)
+        assert edges["magnesium|zink"] == 1 and edges["zink|magnesium"] == 1
+        assert edges["ijzer|zink"] == 1
+        assert not any(key.startswith("vitamine d|") for key in edges)
+
+    asyncio.run(run())
+
+
+def test_rebuild_replaces_the_live_collections():
+    async def run():
+        db = fresh_db()
+        await graph.update(db, "old", {"id": "old", "title": "", "content": "Vitamine D en calcium."})
+        found = dict(graph.document_mentions([{"id": "b", "title": "", "content": "Magnesium en zink."}]))
+        assert await graph.replace_all(db, found, batch_size=1) == {"documents": 1, "mentions": 2, "edges": 2}
+        mentions, edges = await snapshot(db)
+        assert mentions == [("b", "magnesium", 1), ("b", "zink", 1)]
+        assert set(edges) == {"magnesium|zink", "zink|magnesium"}
+        assert "entity_1_count_-1" in await db[graph.MENTIONS_COLLECTION].index_information()
+
+        await graph.replace_all(db, {})
+        assert await snapshot(db) == ([], {})
+
+    asyncio.run(run())
+
+
+def test_queries_use_canonical_entity_names():
+    async def run():
+        db = fresh_db()
+        for document_id, content in EDITS[:3]:
+            await graph.update(db, document_id, {"id": document_id, "title": "", "content": content})
+        assert [match["document_id"] for match in await graph.documents_with(db, ["Magnesium", "Vitamine  D"])] == ["a"]
+        assert await graph.document_count(db, "zink") == 2
+        co = await graph.co_occurring(db, "zink")
+        assert {row["entity"]: row["documents"] for row in co} == {"magnesium": 1, "ijzer": 1, "kurkuma": 1}
+
+    asyncio.run(run())
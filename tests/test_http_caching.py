@@ -0,0 +1,82 @@
+"""ETags, 304 responses and compression of read endpoints"""
+import asyncio
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import http_caching
+
+LARGE = {"rows": ["magnesium"] * 500}
+SMALL = {"rows": ["zink"]}
+HUGE = {"rows": [f"vitamine {i}" for i in range(20000)]}
+
+
+def make_app():
+    def endpoint(body):
+        async def handler(request: Request):
+            etag = http_caching.make_etag("test", request.url.path)
+            if http_caching.etag_matches(request, etag):
+                return http_caching.not_modified(etag, "private, no-cache")
+            response = JSONResponse(body)
+            http_caching.set_cache_headers(response, etag, "private, no-cache")
+            return response
+        return handler
+
+    app = Starlette(routes=[Route("/large", endpoint(LARGE)), Route("/small", endpoint(SMALL)),
+                                Route("/huge", endpoint(HUGE))])
+    app.add_middleware(http_caching.CompressionMiddleware)
+    return app
+
+
+def get(path: str, **headers) -> httpx.Response:
+    async def run():
+        transport = httpx.ASGITransport(app=make_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path, headers=headers)
+    return asyncio.run(run())
+
+
+def test_compressed_body_gets_suffixed_etag():
+    response = get("/large", **{"accept-encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"].endswith('-gzip"')
+    assert response.json() == LARGE
+
+
+def test_not_modified_repeats_the_representation_etag():
+    etag = get("/large", **{"accept-encoding": "gzip"}).headers["etag"]
+    response = get("/large", **{"accept-encoding": "gzip", "if-none-match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+def test_uncompressed_representation_keeps_plain_etag():
+    small = get("/small", **{"accept-encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert not small.headers["etag"].endswith('-gzip"')
+    revalidated = get("/small", **{"accept-encoding": "gzip", "if-none-match": small.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == small.headers["etag"]
+
+    plain = get("/large", **{"accept-encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    revalidated = get("/large", **{"accept-encoding": "identity", "if-none-match": plain.headers["etag"]})
+    assert revalidated.headers["etag"] == plain.headers["etag"]
+
+
+def test_stale_etag_gets_a_full_response():
+    response = get("/large", **{"accept-encoding": "gzip", "if-none-match": '"stale-gzip"'})
+    assert response.status_code == 200
+    assert response.json() == LARGE
+
+
+def test_large_body_is_compressed_off_the_loop():
+    response = get("/huge", **{"accept-encoding": "gzip"})
+    assert int(response.headers["content-length"]) < http_caching.COMPRESSION_THREAD_BYTES
+    assert response.headers["etag"].endswith('-gzip"')
+    assert response.json() == HUGE
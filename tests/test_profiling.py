@@ -0,0 +1,48 @@
+"""Request profiler: the sampler must keep sampling across back-to-back runs"""
+import threading
+import time
+
+import profiling
+
+
+def busy(seconds: float):
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        sum(range(1000))
+
+
+def test_back_to_back_runs_are_sampled():
+    sampler = profiling.LoopSampler(0.002, 10000)
+    for _ in range(3):
+        sampler.acquire(threading.get_ident())
+        started = time.perf_counter()
+        busy(0.05)
+        finished = time.perf_counter()
+        sampler.release()
+        # The next acquire comes before the previous sampler thread has exited
+        assert sum(sampler.collect(started, finished).values()) > 0
+
+
+def test_acquire_right_after_release_starts_a_live_run():
+    sampler = profiling.LoopSampler(0.002, 10000)
+    sampler.acquire(threading.get_ident())
+    sampler.release()
+    sampler.acquire(threading.get_ident())
+    try:
+        assert sampler._stop is not None and not sampler._stop.is_set()
+    finally:
+        sampler.release()
+
+
+def test_worker_threads_are_sampled_and_labelled():
+    sampler = profiling.LoopSampler(0.002, 10000)
+    worker = threading.Thread(target=busy, args=(0.1,), name="asyncio_0")
+    sampler.acquire(threading.get_ident())
+    started = time.perf_counter()
+    worker.start()
+    worker.join()
+    finished = time.perf_counter()
+    sampler.release()
+    roots = {stack[0] for stack in sampler.collect(started, finished)}
+    assert "[worker thread]" in roots
+    assert "[event loop]" in roots
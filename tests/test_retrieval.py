@@ -0,0 +1,71 @@
+"""Hybrid retrieval index and its outbox follower"""
+import asyncio
+
+import pytest
+
+import retrieval
+
+
+def document(id, title, content, **fields):
+    return {"id": id, "title": title, "content": content, "created_at": "2024-01-01T00:00:00+00:00", **fields}
+
+
+def test_title_match_ranks_first():
+    index = retrieval.RetrievalIndex()
+    index.add_many([
+        document("a", "Slaap en stress", "Over magnesium wordt kort iets gezegd."),
+        document("b", "Magnesium", "Magnesium bij spierkramp en slaap."),
+        document("c", "Vitamine D", "Zonlicht en vitamine D."),
+    ])
+    hits, info = index.search("magnesium")
+    assert [hit.id for hit in hits][:2] == ["b", "a"]
+    assert "c" not in {hit.id for hit in hits}
+    assert not info["degraded"]
+
+
+def test_filters_and_remove():
+    index = retrieval.RetrievalIndex()
+    index.add(document("a", "Magnesium", "Magnesium.", category="supplement", tags=["Mineralen"]))
+    index.add(document("b", "Magnesium in voeding", "Magnesium.", category="voeding", original_language="en"))
+    assert [hit.id for hit in index.search("magnesium", categories=["voeding"])[0]] == ["b"]
+    assert [hit.id for hit in index.search("magnesium", tags=["mineralen"])[0]] == ["a"]
+    assert [hit.id for hit in index.search("magnesium", language="en")[0]] == ["b"]
+    index.remove("b")
+    assert [hit.id for hit in index.search("magnesium")[0]] == ["a"]
+    assert index.postings["magnesium"] == {"a": index.postings["magnesium"]["a"]}
+
+
+def test_sync_skips_writes_already_applied_by_this_worker():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import events
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["retrieval_test"]
+        follower = events.Follower("Test index", retrieval.RetrievalIndex, retrieval.BUILD_PROJECTION)
+        await follower.build(db)
+
+        local = document("a", "Magnesium", "Magnesium en slaap.")
+        await db.documents.insert_one(dict(local))
+        await follower.update(db, "a", local, await events.record(db, "a", after=local))
+        applied = follower.index.generation
+
+        # Written by another worker: only the outbox tells this one
+        other = document("b", "Zink", "Zink en weerstand.")
+        await db.documents.insert_one(dict(other))
+        await events.record(db, "b", after=other)
+        await follower.sync(db)
+        return applied, follower
+
+    applied, follower = asyncio.run(scenario())
+    assert set(follower.index.entries) == {"a", "b"}
+    # Adding "b" bumps the generation once; "a" was not indexed a second time
+    assert follower.index.generation == applied + 1
+    assert follower.synced_seq == 2
+
+
+def test_best_passage_offsets_survive_non_ascii_text():
+    content = "Het is ’s avonds – zo’n 400 µg… " * 200 + "Magnesium helpt bij kramp. " + "Verder niets. " * 40
+    passage = retrieval.best_passage(content, "magnesium", 300)
+    assert "Magnesium helpt bij kramp." in passage
+    assert len(retrieval.fold(content)) == len(content)
+    assert retrieval.fold("Patiënt") == "patient"
@@ -0,0 +1,103 @@
+"""Resumable upload sessions: offsets, claims and their lease (mongomock)"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import upload_sessions  # noqa: E402
+from upload_sessions import UploadSessionError  # noqa: E402
+
+DATA = b"%PDF-1.4 magnesium" * 100
+
+
+@pytest.fixture(autouse=True)
+def spool_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_sessions, "UPLOAD_SESSION_DIR", tmp_path)
+
+
+def fresh_db():
+    return mongomock_motor.AsyncMongoMockClient()["uploads_test"]
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+async def received(db) -> dict:
+    session = await upload_sessions.create(db, "document", "studie.pdf", len(DATA))
+    await upload_sessions.append(db, session["id"], 0, chunks(DATA[:1000]))
+    return await upload_sessions.append(db, session["id"], 1000, chunks(DATA[1000:]))
+
+
+def test_chunks_must_continue_at_the_stored_offset():
+    async def run():
+        db = fresh_db()
+        session = await upload_sessions.create(db, "document", "../studie.pdf", len(DATA))
+        assert session["filename"] == "studie.pdf"
+        await upload_sessions.append(db, session["id"], 0, chunks(DATA[:500], DATA[500:1000]))
+        with pytest.raises(UploadSessionError) as error:
+            await upload_sessions.append(db, session["id"], 0, chunks(DATA[:1000]))
+        assert error.value.status_code == 409
+        with pytest.raises(UploadSessionError) as error:
+            await upload_sessions.append(db, session["id"], 1000, chunks(DATA[1000:] + b"extra"))
+        assert error.value.status_code == 413
+        done = await upload_sessions.append(db, session["id"], 1000, chunks(DATA[1000:]))
+        assert upload_sessions.public(done)["complete"]
+        assert upload_sessions.spool_path(session["id"]).read_bytes() == DATA
+
+    asyncio.run(run())
+
+
+def test_voice_sessions_are_capped_at_the_transcription_limit():
+    async def run():
+        with pytest.raises(UploadSessionError) as error:
+            await upload_sessions.create(fresh_db(), "voice", "memo.webm", upload_sessions.TRANSCRIPTION_MAX_BYTES + 1)
+        assert error.value.status_code == 413
+
+    asyncio.run(run())
+
+
+def test_claim_is_exclusive_until_released():
+    async def run():
+        db = fresh_db()
+        session = await received(db)
+        await upload_sessions.claim(db, session["id"])
+        with pytest.raises(UploadSessionError) as error:
+            await upload_sessions.claim(db, session["id"])
+        assert error.value.status_code == 409
+        await upload_sessions.release(db, session["id"])
+        assert (await upload_sessions.claim(db, session["id"]))["completing_until"]
+
+    asyncio.run(run())
+
+
+def test_expired_claim_can_be_taken_again():
+    async def run():
+        db = fresh_db()
+        session = await received(db)
+        await upload_sessions.claim(db, session["id"])
+        # The worker holding the claim crashed and its lease ran out
+        expired = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+        await db[upload_sessions.UPLOAD_SESSIONS_COLLECTION].update_one(
+            {"id": session["id"]}, {"$set": {"completing_until": expired}}
+        )
+        claimed = await upload_sessions.claim(db, session["id"])
+        assert claimed["completing_until"] > expired
+        assert claimed["expires_at"] >= claimed["completing_until"]
+
+    asyncio.run(run())
+
+
+def test_checksum_mismatch_releases_the_claim():
+    async def run():
+        db = fresh_db()
+        session = await received(db)
+        with pytest.raises(UploadSessionError) as error:
+            await upload_sessions.claim(db, session["id"], sha256="0" * 64)
+        assert error.value.status_code == 422
+        await upload_sessions.claim(db, session["id"])
+
+    asyncio.run(run())